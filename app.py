@@ -1,6 +1,27 @@
 import streamlit as st
-from datetime import datetime
-import json
+from datetime import datetime, timedelta
+import atexit
+import hashlib
+import html
+import io
+import os
+import time
+
+import metrics
+import settings
+from bulk import CsvResultWriter, count_rows, read_rows, run_bulk
+from climate import date_from_day
+from compact import CompactAssessment
+from engine import RecommendationEngine
+from goals import GOALS
+from market import MarketStore
+from recommendation_cache import FARMER_NAME_PLACEHOLDER
+from recommendations import CATEGORIES, CROP_STAGES, CROPS, PROVINCES, SEASONS
+from suitability import SuitabilityTable
+
+RUN_STARTED = time.perf_counter()
+# Declared on every rerun; the registry hands back the same histogram
+PAGE_SECONDS = metrics.histogram('smart_farming_page_render_seconds', "Streamlit script run time, by page", ('page',))
 
 # Page configuration
 st.set_page_config(
@@ -100,23 +121,44 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'assessments' not in st.session_state:
-    st.session_state.assessments = []
+if 'farmer_name' not in st.session_state:
+    # Kept in the URL so a refresh still finds the farmer's history
+    st.session_state.farmer_name = st.query_params.get('farmer')
 if 'current_assessment' not in st.session_state:
-    st.session_state.current_assessment = {}
+    # Profile codes and shared tip ids rather than a dict of strings in every session
+    st.session_state.current_assessment = CompactAssessment()
 if 'page' not in st.session_state:
     st.session_state.page = 'dashboard'
-if 'goals_completed' not in st.session_state:
-    st.session_state.goals_completed = set()
 if 'selected_crop' not in st.session_state:
     st.session_state.selected_crop = None
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 0
+
+@st.cache_resource
+def get_engine(api_key, api_base=None):
+    """Recommendation engine shared by every session, built once per process"""
+    engine = RecommendationEngine.from_settings(api_key, api_base)
+    # Streamlit has no shutdown hook; write the last batch of assessments on exit
+    atexit.register(engine.close)
+    return engine
+
+@st.cache_resource
+def get_market():
+    """Commodity price history and its rolling aggregates, shared by every session"""
+    return MarketStore(settings.MARKET_DIR)
+
+@st.cache_resource
+def get_suitability():
+    """Crop rankings for every province, season and stage, computed once per process"""
+    return SuitabilityTable.from_file(settings.SUITABILITY_PATH)
 
-# Initialize OpenAI client
-openai_client = None
+# Initialize the engine and its OpenAI client
 try:
-    import openai
-    openai.api_key = st.secrets["OPENAI_API_KEY"]
-    openai_client = openai
+    if settings.RECOMMENDATION_MODE == 'offline':
+        # Rule-based advice only; no API key needed
+        engine = get_engine(None)
+    else:
+        engine = get_engine(st.secrets["OPENAI_API_KEY"], st.secrets.get("OPENAI_API_BASE"))
 except ImportError:
     st.error("⚠️ OpenAI library not installed. Please run: pip install openai")
     st.stop()
@@ -127,150 +169,192 @@ except Exception as e:
     st.error(f"⚠️ Error initializing OpenAI: {str(e)}")
     st.stop()
 
-# Goals definition
-GOALS = [
-    {'id': 'first_assessment', 'icon': '🎯', 'title': 'First Steps', 'description': 'Complete your first assessment', 'requirement': 1},
-    {'id': 'five_assessments', 'icon': '📊', 'title': 'Getting Started', 'description': 'Complete 5 assessments', 'requirement': 5},
-    {'id': 'ten_assessments', 'icon': '🌟', 'title': 'Committed Farmer', 'description': 'Complete 10 assessments', 'requirement': 10},
-    {'id': 'all_crops', 'icon': '🌾', 'title': 'Crop Explorer', 'description': 'Try all 4 crop types', 'requirement': 4},
-    {'id': 'all_seasons', 'icon': '🔄', 'title': 'Year-Round', 'description': 'Get advice for all 4 seasons', 'requirement': 4},
-]
-
-def generate_ai_recommendations(farmer_data):
-    """Generate AI-powered farming recommendations using OpenAI"""
-    if not openai_client:
-        return generate_fallback_recommendations(farmer_data)
-    
-    try:
-        prompt = f"""As an expert agricultural advisor for Canadian farming, provide specific recommendations for:
-
-Farmer Profile:
-- Name: {farmer_data['farmer_name']}
-- Province: {farmer_data['province']}
-- Season: {farmer_data['season']}
-- Crop Stage: {farmer_data['crop_stage']}
-- Selected Crop: {farmer_data['selected_crop']}
-
-Please provide detailed recommendations in the following categories:
-1. Weather-Based Advice (3-4 specific tips)
-2. Pest & Disease Management (3-4 actionable items)
-3. Soil & Fertilizer Guidance (3-4 recommendations)
-4. Sustainable Farming Tips (3-4 practices)
-
-Format your response as JSON with keys: weather_advice, pest_advice, soil_advice, sustainability_tips (each containing an array of strings). Only return the JSON, no other text."""
-
-        response = openai_client.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert Canadian agricultural advisor. Always respond with valid JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1500
-        )
-        
-        content = response.choices[0].message.content.strip()
-        # Remove markdown code blocks if present
-        if content.startswith('```'):
-            content = content.split('```')[1]
-            if content.startswith('json'):
-                content = content[4:]
-            content = content.strip()
-        
-        recommendations = json.loads(content)
-        return recommendations
-    
-    except json.JSONDecodeError as e:
-        st.warning("⚠️ AI response was not in correct format. Using fallback recommendations.")
-        return generate_fallback_recommendations(farmer_data)
-    except Exception as e:
-        st.warning(f"⚠️ Error with AI: {str(e)}. Using fallback recommendations.")
-        return generate_fallback_recommendations(farmer_data)
-
-def generate_fallback_recommendations(farmer_data):
-    """Fallback recommendations if AI fails"""
-    crop = farmer_data['selected_crop']
-    season = farmer_data['season']
-    province = farmer_data['province']
-    
-    recommendations = {
-        'weather_advice': [
-            f"Monitor local weather forecasts daily for {season} conditions in {province}",
-            "Watch for frost warnings and protect crops accordingly",
-            "Track precipitation levels for optimal irrigation scheduling",
-            "Plan fieldwork around weather windows to maximize efficiency"
-        ],
-        'pest_advice': [
-            f"Scout fields regularly for common {crop} pests in your region",
-            "Implement integrated pest management strategies to reduce chemical use",
-            "Use crop rotation to naturally reduce pest pressure",
-            "Monitor pest thresholds before applying treatments"
-        ],
-        'soil_advice': [
-            "Conduct soil tests to determine nutrient levels and pH balance",
-            f"Apply fertilizers based on {crop} requirements and soil test results",
-            "Monitor soil moisture levels regularly for optimal crop growth",
-            "Consider adding organic matter to improve soil structure"
-        ],
-        'sustainability_tips': [
-            "Practice crop rotation to maintain soil health and reduce disease",
-            "Reduce chemical inputs where possible through IPM strategies",
-            "Implement water conservation techniques like drip irrigation",
-            "Use cover crops during off-season to prevent erosion"
-        ]
-    }
-    return recommendations
-
-def check_goal_achievements():
-    """Check and update goal achievements"""
-    total = len(st.session_state.assessments)
-    unique_crops = len(set(a.get('selected_crop', '') for a in st.session_state.assessments if a.get('selected_crop')))
-    unique_seasons = len(set(a.get('season', '') for a in st.session_state.assessments if a.get('season')))
-    
-    if total >= 1:
-        st.session_state.goals_completed.add('first_assessment')
-    if total >= 5:
-        st.session_state.goals_completed.add('five_assessments')
-    if total >= 10:
-        st.session_state.goals_completed.add('ten_assessments')
-    if unique_crops >= 4:
-        st.session_state.goals_completed.add('all_crops')
-    if unique_seasons >= 4:
-        st.session_state.goals_completed.add('all_seasons')
+CATEGORY_HEADINGS = {
+    'weather_advice': "### 🌡️ Weather-Based Advice",
+    'pest_advice': "### 🐛 Pest & Disease Management",
+    'soil_advice': "### 💧 Soil & Fertilizer Guidance",
+    'sustainability_tips': "### ♻️ Sustainable Farming Tips",
+}
+
+def info_card(items):
+    """HTML for a bulleted info card, so a whole list renders as one element"""
+    rows = ''.join(f'<li>{html.escape(str(item))}</li>' for item in items)
+    return f'<div class="info-card"><ul>{rows}</ul></div>'
+
+def render_category(category, tips, slot=st):
+    """Render one category of recommendation tips as a single element"""
+    slot.markdown(f"{CATEGORY_HEADINGS[category]}\n\n{info_card(tips)}", unsafe_allow_html=True)
+
+def go_to(page):
+    """Button callback: switch page before the rerun the click triggers"""
+    st.session_state.page = page
+
+def set_history_page(page):
+    """Button callback: move the history pager"""
+    st.session_state.history_page = page
+
+def back_to_profile():
+    """Button callback: leave the crops page without a selection"""
+    st.session_state.selected_crop = None
+    st.session_state.page = 'profile'
+
+def get_goal_tracker():
+    """The current farmer's goal progress, loaded from the store once per session"""
+    if st.session_state.get('goal_tracker') is None:
+        farmer = st.session_state.farmer_name
+        st.session_state.goal_tracker = engine.goal_tracker(farmer)
+    return st.session_state.goal_tracker
+
+def assessment_count():
+    """Number of assessments the current farmer has completed"""
+    return get_goal_tracker().total
+
+def explored_count(field):
+    """Number of distinct values of a field across the current farmer's assessments"""
+    return len(get_goal_tracker().distinct[field])
+
+def save_assessment(assessment):
+    """Record a completed assessment and update goals"""
+    engine.save_assessment(assessment, get_goal_tracker())
 
 # Sidebar navigation
 with st.sidebar:
     st.title("🇨🇦 Smart Farming")
     st.markdown("---")
     
-    if st.button("🏠 Dashboard", use_container_width=True):
-        st.session_state.page = 'dashboard'
-        st.rerun()
-    
-    if st.button("📝 New Assessment", use_container_width=True):
-        st.session_state.page = 'profile'
-        st.rerun()
-    
-    if st.button("🎯 Goals", use_container_width=True):
-        st.session_state.page = 'goals'
-        st.rerun()
-    
-    if st.button("🌤️ Weather", use_container_width=True):
-        st.session_state.page = 'weather'
-        st.rerun()
-    
-    if st.button("💰 Market Prices", use_container_width=True):
-        st.session_state.page = 'market'
-        st.rerun()
-    
-    if st.button("👥 Community", use_container_width=True):
-        st.session_state.page = 'community'
-        st.rerun()
+    st.button("🏠 Dashboard", use_container_width=True, on_click=go_to, args=('dashboard',))
+    st.button("📝 New Assessment", use_container_width=True, on_click=go_to, args=('profile',))
+    st.button("🎯 Goals", use_container_width=True, on_click=go_to, args=('goals',))
+    st.button("🌤️ Weather", use_container_width=True, on_click=go_to, args=('weather',))
+    st.button("💰 Market Prices", use_container_width=True, on_click=go_to, args=('market',))
+    st.button("👥 Community", use_container_width=True, on_click=go_to, args=('community',))
+    st.button("📦 Bulk Assessments", use_container_width=True, on_click=go_to, args=('bulk',))
+    if settings.DIAGNOSTICS_PAGE:
+        st.button("📈 Diagnostics", use_container_width=True, on_click=go_to, args=('diagnostics',))
     
     st.markdown("---")
     st.markdown("### 📊 Quick Stats")
-    st.metric("Total Assessments", len(st.session_state.assessments))
-    st.metric("Goals Completed", f"{len(st.session_state.goals_completed)}/{len(GOALS)}")
+    st.metric("Total Assessments", assessment_count())
+    st.metric("Goals Completed", f"{len(get_goal_tracker().completed)}/{len(GOALS)}")
+    
+    with st.expander("⚙️ AI Service"):
+        stats = engine.stats()
+        if 'breaker' not in stats:
+            st.caption("Offline: advice comes from the agronomic rule base")
+        else:
+            st.caption(f"Circuit breaker: {stats['breaker']['state']} (tripped {stats['breaker']['trips']}×)")
+            st.caption(f"Cache hit rate: {stats['cache']['hit_rate']:.0%}")
+            st.caption(f"Repaired responses: {stats['responses']['repaired']} (unusable {stats['responses']['failed']})")
+            st.caption(f"Coalesced requests: {stats['single_flight']['coalesced']}")
+            if 'scheduler' in stats:
+                st.caption(f"Advisories refreshed: {stats['scheduler']['refreshed']} (queued {stats['scheduler']['queued']})")
+            st.caption(f"Queued requests: {stats['rate_limiter']['queued']} (avg wait {stats['rate_limiter']['avg_wait']:.1f}s, max {stats['rate_limiter']['max_wait']:.1f}s)")
+        if stats['mode'] == 'rules-first':
+            st.caption(f"Rules-first: {stats['rules']['tailored_profiles']}/{stats['rules']['profiles']} profiles answered without AI")
+
+@st.fragment
+def history_section():
+    """Paged assessment history; paging reruns only this fragment"""
+    total = assessment_count()
+    if not total:
+        return
+    st.markdown("### 📜 Your Assessment History")
+    page_size = settings.HISTORY_PAGE_SIZE
+    page = min(st.session_state.history_page, (total - 1) // page_size)
+    for entry in engine.history(st.session_state.farmer_name, page=page, page_size=page_size):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{entry['selected_crop']}** · {entry['province']} · {entry['season']} · {entry['crop_stage']} — {entry['timestamp'][:16].replace('T', ' ')}")
+        with col2:
+            if st.button("View", key=f"history_{entry['id']}", use_container_width=True):
+                st.session_state.current_assessment = CompactAssessment(entry)
+                st.session_state.page = 'results'
+                st.rerun()
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        st.button("← Newer", disabled=page == 0, use_container_width=True, on_click=set_history_page, args=(page - 1,))
+    with col2:
+        st.caption(f"Page {page + 1} of {(total - 1) // page_size + 1}")
+    with col3:
+        st.button("Older →", disabled=(page + 1) * page_size >= total, use_container_width=True, on_click=set_history_page, args=(page + 1,))
+
+@st.fragment
+def profile_form():
+    """Profile form; a failed validation reruns only this fragment"""
+    with st.form("profile_form"):
+        farmer_name = st.text_input("👤 Farmer Name", placeholder="Enter your name")
+        
+        province = st.selectbox("📍 Province", [""] + PROVINCES)
+        
+        season = st.selectbox("🌤️ Current Season", [""] + SEASONS)
+        
+        crop_stage = st.selectbox("🌱 Crop Stage", [""] + CROP_STAGES)
+        
+        submitted = st.form_submit_button("Continue →", use_container_width=True, type="primary")
+        
+        if submitted:
+            if farmer_name and province and season and crop_stage:
+                if farmer_name != st.session_state.farmer_name:
+                    st.session_state.farmer_name = farmer_name
+                    st.query_params['farmer'] = farmer_name
+                    st.session_state.history_page = 0
+                    st.session_state.goal_tracker = None
+                st.session_state.current_assessment = CompactAssessment({
+                    'farmer_name': farmer_name,
+                    'province': province,
+                    'season': season,
+                    'crop_stage': crop_stage,
+                    'timestamp': datetime.now().isoformat()
+                })
+                st.session_state.page = 'crops'
+                st.rerun()
+            else:
+                st.error("Please fill in all fields")
+
+@st.fragment
+def crop_picker():
+    """Crop buttons and the generate button; picking a crop reruns only this fragment"""
+    assessment = st.session_state.current_assessment
+    # Ranked when the app starts; this is only a lookup
+    ranking = get_suitability().ranking(assessment['province'], assessment['season'], assessment['crop_stage'])
+    
+    for row_start in range(0, len(ranking), 4):
+        columns = st.columns(4)
+        for column, entry in zip(columns, ranking[row_start:row_start + 4]):
+            with column:
+                label = f"{entry['icon']}\n\n**{entry['crop']}**"
+                if entry['score'] is not None:
+                    label += f"\n\n{entry['score']}% match"
+                if st.button(label, use_container_width=True, key=entry['crop'].lower()):
+                    st.session_state.selected_crop = entry['crop']
+                st.caption(("⭐ Best match · " if entry is ranking[0] else "") + entry['note'])
+    
+    # Show selected crop
+    if st.session_state.selected_crop:
+        st.success(f"✅ Selected: {st.session_state.selected_crop}")
+        
+        if st.button("Get AI Recommendations →", use_container_width=True, type="primary", key="get_recommendations"):
+            st.session_state.current_assessment['selected_crop'] = st.session_state.selected_crop
+            
+            # New profiles stream onto the results page instead of waiting here
+            if settings.STREAM_RECOMMENDATIONS and engine.should_stream(st.session_state.current_assessment):
+                st.session_state.current_assessment['recommendations'] = None
+                st.session_state.selected_crop = None
+                st.session_state.page = 'results'
+                st.rerun()
+            
+            with st.spinner("🤖 Generating AI-powered recommendations..."):
+                try:
+                    recommendations = engine.recommend(st.session_state.current_assessment, warn=st.warning)
+                    st.session_state.current_assessment['recommendations'] = recommendations
+                    save_assessment(st.session_state.current_assessment.copy())
+                    st.session_state.selected_crop = None  # Reset for next time
+                    st.session_state.page = 'results'
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error generating recommendations: {str(e)}")
+                    st.info("Please try again or contact support.")
 
 # Main content area
 if st.session_state.page == 'dashboard':
@@ -279,19 +363,17 @@ if st.session_state.page == 'dashboard':
     # Statistics
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.markdown(f'<div class="stat-box"><div class="stat-number">{len(st.session_state.assessments)}</div><div class="stat-label">Total Assessments</div></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="stat-box"><div class="stat-number">{assessment_count()}</div><div class="stat-label">Total Assessments</div></div>', unsafe_allow_html=True)
     with col2:
-        st.markdown(f'<div class="stat-box"><div class="stat-number">{len(st.session_state.goals_completed)}</div><div class="stat-label">Goals Completed</div></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="stat-box"><div class="stat-number">{len(get_goal_tracker().completed)}</div><div class="stat-label">Goals Completed</div></div>', unsafe_allow_html=True)
     with col3:
-        unique_crops = len(set(a.get('selected_crop', '') for a in st.session_state.assessments if a.get('selected_crop'))) if st.session_state.assessments else 0
+        unique_crops = explored_count('selected_crop')
         st.markdown(f'<div class="stat-box"><div class="stat-number">{unique_crops}</div><div class="stat-label">Crops Explored</div></div>', unsafe_allow_html=True)
     
     st.markdown("---")
     
     # Get Started Button
-    if st.button("🚀 Get Started - Create Assessment", use_container_width=True, type="primary"):
-        st.session_state.page = 'profile'
-        st.rerun()
+    st.button("🚀 Get Started - Create Assessment", use_container_width=True, type="primary", on_click=go_to, args=('profile',))
     
     # Common Challenges
     st.markdown("### ⚠️ Common Farming Challenges in Canada")
@@ -304,46 +386,16 @@ if st.session_state.page == 'dashboard':
         st.markdown("#### 🌧️\n**Unpredictable Weather**")
     with col4:
         st.markdown("#### 🐛\n**Pests & Disease**")
+    
+    # Assessment history, one page at a time
+    history_section()
 
 elif st.session_state.page == 'profile':
     st.markdown('<div class="main-header"><h1>📋 Your Farm Profile</h1><p>Tell us about your farming situation</p></div>', unsafe_allow_html=True)
     
-    with st.form("profile_form"):
-        farmer_name = st.text_input("👤 Farmer Name", placeholder="Enter your name")
-        
-        province = st.selectbox("📍 Province", [
-            "", "Alberta", "British Columbia", "Manitoba", 
-            "New Brunswick", "Newfoundland and Labrador", "Nova Scotia",
-            "Ontario", "Prince Edward Island", "Quebec", "Saskatchewan"
-        ])
-        
-        season = st.selectbox("🌤️ Current Season", [
-            "", "Spring", "Summer", "Fall", "Winter"
-        ])
-        
-        crop_stage = st.selectbox("🌱 Crop Stage", [
-            "", "Pre-Planting", "Planting", "Growing", "Harvesting", "Post-Harvest"
-        ])
-        
-        submitted = st.form_submit_button("Continue →", use_container_width=True, type="primary")
-        
-        if submitted:
-            if farmer_name and province and season and crop_stage:
-                st.session_state.current_assessment = {
-                    'farmer_name': farmer_name,
-                    'province': province,
-                    'season': season,
-                    'crop_stage': crop_stage,
-                    'timestamp': datetime.now().isoformat()
-                }
-                st.session_state.page = 'crops'
-                st.rerun()
-            else:
-                st.error("Please fill in all fields")
+    profile_form()
     
-    if st.button("← Back to Dashboard"):
-        st.session_state.page = 'dashboard'
-        st.rerun()
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
 
 elif st.session_state.page == 'crops':
     st.markdown('<div class="main-header"><h1>🌱 Crop Recommendations</h1><p>Select the crop you want guidance for</p></div>', unsafe_allow_html=True)
@@ -360,52 +412,9 @@ elif st.session_state.page == 'crops':
     
     st.markdown("### Recommended Crops for Your Region")
     
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        if st.button("🌾\n\n**Wheat**", use_container_width=True, key="wheat"):
-            st.session_state.selected_crop = "Wheat"
-            st.rerun()
+    crop_picker()
     
-    with col2:
-        if st.button("💛\n\n**Canola**", use_container_width=True, key="canola"):
-            st.session_state.selected_crop = "Canola"
-            st.rerun()
-    
-    with col3:
-        if st.button("🌾\n\n**Barley**", use_container_width=True, key="barley"):
-            st.session_state.selected_crop = "Barley"
-            st.rerun()
-    
-    with col4:
-        if st.button("🌾\n\n**Oats**", use_container_width=True, key="oats"):
-            st.session_state.selected_crop = "Oats"
-            st.rerun()
-    
-    # Show selected crop
-    if st.session_state.selected_crop:
-        st.success(f"✅ Selected: {st.session_state.selected_crop}")
-        
-        if st.button("Get AI Recommendations →", use_container_width=True, type="primary", key="get_recommendations"):
-            st.session_state.current_assessment['selected_crop'] = st.session_state.selected_crop
-            
-            with st.spinner("🤖 Generating AI-powered recommendations..."):
-                try:
-                    recommendations = generate_ai_recommendations(st.session_state.current_assessment)
-                    st.session_state.current_assessment['recommendations'] = recommendations
-                    st.session_state.assessments.append(st.session_state.current_assessment.copy())
-                    check_goal_achievements()
-                    st.session_state.selected_crop = None  # Reset for next time
-                    st.session_state.page = 'results'
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Error generating recommendations: {str(e)}")
-                    st.info("Please try again or contact support.")
-    
-    if st.button("← Back", key="back_to_profile"):
-        st.session_state.selected_crop = None
-        st.session_state.page = 'profile'
-        st.rerun()
+    st.button("← Back", key="back_to_profile", on_click=back_to_profile)
 
 elif st.session_state.page == 'results':
     st.markdown('<div class="main-header"><h1>✅ Your Personalized Recommendations</h1><p>AI-generated guidance for your farm</p></div>', unsafe_allow_html=True)
@@ -423,65 +432,44 @@ elif st.session_state.page == 'results':
     """, unsafe_allow_html=True)
     
     # Recommendations
-    recommendations = assessment.get('recommendations', {})
-    
-    st.markdown("### 🌡️ Weather-Based Advice")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    for tip in recommendations.get('weather_advice', []):
-        st.markdown(f"- {tip}")
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    st.markdown("### 🐛 Pest & Disease Management")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    for tip in recommendations.get('pest_advice', []):
-        st.markdown(f"- {tip}")
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    st.markdown("### 💧 Soil & Fertilizer Guidance")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    for tip in recommendations.get('soil_advice', []):
-        st.markdown(f"- {tip}")
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    st.markdown("### ♻️ Sustainable Farming Tips")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    for tip in recommendations.get('sustainability_tips', []):
-        st.markdown(f"- {tip}")
-    st.markdown('</div>', unsafe_allow_html=True)
+    recommendations = assessment.get('recommendations')
+    
+    if recommendations is None:
+        # Streaming: show each category as soon as its tips arrive
+        slots = {}
+        for category in CATEGORIES:
+            slots[category] = st.empty()
+            slots[category].markdown(f"{CATEGORY_HEADINGS[category]}\n\n🤖 Generating...")
+        
+        recommendations = {}
+        for category, tips in engine.stream(assessment, warn=st.warning):
+            recommendations[category] = tips
+            render_category(category, tips, slots[category])
+        
+        assessment['recommendations'] = recommendations
+        save_assessment(assessment.copy())
+    else:
+        for category in CATEGORIES:
+            render_category(category, recommendations.get(category, []))
     
     st.success("🎉 Recommendations generated successfully!")
     
-    if st.button("Back to Dashboard", use_container_width=True, type="primary"):
-        st.session_state.page = 'dashboard'
-        st.rerun()
+    st.button("Back to Dashboard", use_container_width=True, type="primary", on_click=go_to, args=('dashboard',))
 
 elif st.session_state.page == 'goals':
     st.markdown('<div class="main-header"><h1>🎯 Goals & Achievements</h1><p>Track your farming journey</p></div>', unsafe_allow_html=True)
     
-    total = len(st.session_state.assessments)
-    progress = (len(st.session_state.goals_completed) / len(GOALS)) * 100
+    progress = (len(get_goal_tracker().completed) / len(GOALS)) * 100
     
     st.metric("Overall Progress", f"{int(progress)}%")
     st.progress(progress / 100)
     
     st.markdown("### Your Achievements")
     
-    unique_crops = len(set(a.get('selected_crop', '') for a in st.session_state.assessments if a.get('selected_crop')))
-    unique_seasons = len(set(a.get('season', '') for a in st.session_state.assessments if a.get('season')))
-    
+    tracker = get_goal_tracker()
     for goal in GOALS:
-        completed = goal['id'] in st.session_state.goals_completed
-        
-        if goal['id'] == 'first_assessment':
-            current_progress = min(total, 1)
-        elif goal['id'] == 'five_assessments':
-            current_progress = min(total, 5)
-        elif goal['id'] == 'ten_assessments':
-            current_progress = min(total, 10)
-        elif goal['id'] == 'all_crops':
-            current_progress = unique_crops
-        elif goal['id'] == 'all_seasons':
-            current_progress = unique_seasons
+        completed = goal['id'] in tracker.completed
+        current_progress = tracker.progress(goal)
         
         status = "✅" if completed else "⏳"
         st.markdown(f"### {goal['icon']} {goal['title']} {status}")
@@ -490,79 +478,262 @@ elif st.session_state.page == 'goals':
         st.markdown(f"Progress: {current_progress}/{goal['requirement']}")
         st.markdown("---")
     
-    if st.button("← Back to Dashboard"):
-        st.session_state.page = 'dashboard'
-        st.rerun()
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
 
 elif st.session_state.page == 'weather':
-    st.markdown('<div class="main-header"><h1>🌤️ Weather Forecast</h1><p>7-day agricultural weather outlook</p></div>', unsafe_allow_html=True)
-    
-    st.markdown("""
-    <div class="recommendation-box">
-        <h3>📍 Canada - Agricultural Regions</h3>
-        <p>General weather patterns and recommendations for Canadian farming regions</p>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    st.markdown("### ☀️ Today's Conditions")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    st.markdown("""
-    - Temperature: 18°C - 24°C
-    - Conditions: Partly Cloudy
-    - Wind: 15 km/h NW
-    - Precipitation: 20% chance
-    """)
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    st.markdown("### 📅 Week Ahead")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    st.markdown("""
-    - Days 1-3: Warm and dry conditions ideal for fieldwork
-    - Days 4-5: Scattered showers expected, delay spraying operations
-    - Days 6-7: Clearing conditions, good for harvesting
-    """)
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    if st.button("← Back to Dashboard"):
-        st.session_state.page = 'dashboard'
-        st.rerun()
+    st.markdown('<div class="main-header"><h1>🌤️ Weather Outlook</h1><p>What to expect this week, from local climate records</p></div>', unsafe_allow_html=True)
+    
+    climate = engine.climate
+    if climate is None:
+        st.info("📭 No local climate records have been loaded yet. Ingest daily station CSVs with: python climate.py ingest <files>")
+    else:
+        assessed = st.session_state.current_assessment.get('province')
+        province = st.selectbox(
+            "📍 Province", PROVINCES,
+            index=PROVINCES.index(assessed) if assessed in PROVINCES else 0,
+            key='weather_province'
+        )
+        if not climate.covers(province):
+            st.info(f"📭 No climate stations have been loaded for {province}.")
+        else:
+            today = datetime.now().date()
+            normals = climate.normals(province)
+            years = climate.meta['years']
+            st.markdown(f"""
+            <div class="recommendation-box">
+                <h3>📍 {html.escape(province)}</h3>
+                <p>Normals from {normals['records']:,} days of station records{f", {years[0]}-{years[1]}" if years else ""}</p>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            week = climate.outlook(province, today)
+            st.markdown("### 📅 Week Ahead\n\n" + info_card([
+                f"{day['date']:%a %b %d}: {day['tmax']:.0f}°C / {day['tmin']:.0f}°C, "
+                f"{day['wet']:.0%} chance of rain, {day['frost']:.0%} frost risk"
+                for day in week
+            ]), unsafe_allow_html=True)
+            
+            last_spring, first_fall = climate.frost_dates(province)
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                gdd = climate.growing_degree_days(province, today.replace(month=1, day=1), today)
+                st.metric("🌡️ Growing Degree Days", f"{gdd:.0f}", help="Normal accumulation since January 1 (base 5°C)")
+            with col2:
+                rain = climate.precipitation(province, today, today + timedelta(days=29))
+                st.metric("🌧️ Next 30 Days", f"{rain:.0f} mm", help="Normal precipitation")
+            with col3:
+                if last_spring is None:
+                    st.metric("❄️ Frost-Free Season", "—")
+                else:
+                    st.metric("❄️ Frost-Free Season", f"{first_fall - last_spring} days")
+            
+            advice = []
+            frost_nights = [day for day in week if day['frost'] >= 0.3]
+            if frost_nights:
+                advice.append(f"Frost is likely on {len(frost_nights)} night(s) this week; protect seedlings and late crops")
+            wet_days = [day for day in week if day['wet'] >= 0.5]
+            if wet_days:
+                advice.append(f"Expect rain on about {len(wet_days)} day(s); plan spraying and fieldwork around them")
+            else:
+                advice.append("Drier days are typical this week, good for fieldwork and spraying")
+            if last_spring is not None:
+                advice.append(
+                    f"Last spring frost is usually around {date_from_day(last_spring, today.year):%b %d}, "
+                    f"first fall frost around {date_from_day(first_fall, today.year):%b %d}"
+                )
+            st.markdown("### 🌾 What It Means for Your Farm\n\n" + info_card(advice), unsafe_allow_html=True)
+    
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
 
 elif st.session_state.page == 'market':
     st.markdown('<div class="main-header"><h1>💰 Market Prices</h1><p>Current commodity prices in Canada</p></div>', unsafe_allow_html=True)
     
-    st.markdown("""
-    <div class="recommendation-box">
-        <h3>📈 Market Trends</h3>
-        <p>Commodity prices are updated weekly based on Canadian agricultural markets</p>
-    </div>
-    """, unsafe_allow_html=True)
+    market = get_market()
+    snapshots = {crop: market.snapshot(crop) for crop in CROPS}
+    priced = [crop for crop, snapshot in snapshots.items() if snapshot is not None]
+    if not priced:
+        st.info("📭 No price history has been loaded yet. Add prices with: python market.py ingest <files>")
+    else:
+        icons = get_suitability().icons
+        col1, col2 = st.columns(2)
+        for i, crop in enumerate(priced):
+            snapshot = snapshots[crop]
+            change = snapshot['change_week'] if snapshot['change_week'] is not None else snapshot['change_month']
+            with (col1 if i % 2 == 0 else col2):
+                st.metric(
+                    f"{icons.get(crop, '🌾')} {crop}", f"${snapshot['price']:,.0f}/tonne",
+                    f"{change * 100:.1f}%" if change is not None else None,
+                    help=f"As of {snapshot['date']:%b %d, %Y}; change over the last "
+                         f"{'week' if snapshot['change_week'] is not None else 'month'}"
+                )
+        
+        st.markdown("### 📈 Price History")
+        col1, col2 = st.columns([2, 3])
+        with col1:
+            crop = st.selectbox("Crop", priced, key='market_crop')
+        with col2:
+            years = st.radio("Range", [1, 5, 20], index=1, horizontal=True, format_func=lambda n: f"{n}Y", key='market_range')
+        snapshot = snapshots[crop]
+        since = snapshot['date'].replace(year=snapshot['date'].year - years, day=1)
+        dates, prices = market.chart(crop, since=since)
+        # A plain Vega-Lite spec renders in a couple of milliseconds; st.line_chart builds an Altair chart first
+        st.vega_lite_chart({
+            'data': {'values': [{'date': str(day), 'price': round(float(price), 2)} for day, price in zip(dates, prices)]},
+            'mark': 'line',
+            'encoding': {
+                'x': {'field': 'date', 'type': 'temporal', 'title': None},
+                'y': {'field': 'price', 'type': 'quantitative', 'title': '$/tonne', 'scale': {'zero': False}},
+            },
+        })
+        
+        averages = ' · '.join(
+            f"{days}-day average ${value:,.0f}" for days, value in snapshot['moving_averages'].items() if value is not None
+        )
+        details = [averages]
+        if snapshot['change_month'] is not None:
+            details.append(f"month {snapshot['change_month']:+.1%}")
+        if snapshot['volatility'] is not None:
+            details.append(f"volatility {snapshot['volatility']:.0%} a year")
+        st.caption(' · '.join(details))
+    
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
+
+elif st.session_state.page == 'community':
+    st.markdown('<div class="main-header"><h1>👥 Community Tips</h1><p>Shared wisdom from Canadian farmers</p></div>', unsafe_allow_html=True)
     
-    col1, col2 = st.columns(2)
+    knowledge = engine.knowledge
+    query = st.text_input("🔍 Search tips", key='community_query', placeholder="e.g. flea beetles, soil testing, frost")
+    col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("🌾 Wheat", "$320/tonne", "2.5%")
-        st.metric("🌾 Barley", "$280/tonne", "-0.5%")
+        province = st.selectbox("Province", ["Any"] + PROVINCES, key='community_province')
     with col2:
-        st.metric("💛 Canola", "$650/tonne", "1.8%")
-        st.metric("🌾 Oats", "$310/tonne", "3.2%")
-    
-    if st.button("← Back to Dashboard"):
-        st.session_state.page = 'dashboard'
-        st.rerun()
+        crop = st.selectbox("Crop", ["Any"] + CROPS, key='community_crop')
+    with col3:
+        season = st.selectbox("Season", ["Any"] + SEASONS, key='community_season')
+    
+    results = knowledge.search(
+        query,
+        province=province if province != "Any" else None,
+        crop=crop if crop != "Any" else None,
+        season=season if season != "Any" else None,
+    )
+    lines = []
+    for result in results:
+        # Other farmers' advice, so it isn't addressed to whoever is reading it
+        text = result['text'].replace(FARMER_NAME_PLACEHOLDER, 'farmer')
+        if result['source'] == 'community':
+            lines.append(f'"{text}" - {result["province"] or "Canadian"} farmer')
+        else:
+            context = ', '.join(value for value in (result['crop'], result['province'], result['season']) if value)
+            lines.append(f"{text} ({context}; given {result['count']}×)")
+    
+    if lines:
+        st.markdown(("### 🔎 Matching Tips" if query.strip() else "### 🔥 Top Tips") + "\n\n" + info_card(lines), unsafe_allow_html=True)
+    else:
+        st.info("No tips match your search yet. Try fewer words or a different filter.")
+    st.caption(f"Searching {knowledge.stats()['documents']:,} distinct tips from the community and past assessments")
+    
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
 
-elif st.session_state.page == 'community':
-    st.markdown('<div class="main-header"><h1>👥 Community Tips</h1><p>Shared wisdom from Canadian farmers</p></div>', unsafe_allow_html=True)
+elif st.session_state.page == 'bulk':
+    st.markdown('<div class="main-header"><h1>📦 Bulk Assessments</h1><p>Recommendations for every farm in a district at once</p></div>', unsafe_allow_html=True)
+    
+    st.markdown("Upload a CSV with the columns **farmer_name, province, season, crop_stage, crop**. "
+                "Rows are processed a few at a time and saved as they finish, so a run that is interrupted "
+                "picks up where it stopped when you upload the same file again.")
+    
+    uploaded = st.file_uploader("Farms CSV", type="csv")
+    if uploaded is not None:
+        data = uploaded.getvalue()
+        # Same file, same output, so reruns resume
+        output_path = os.path.join(settings.BULK_DIR, f"{hashlib.sha256(data).hexdigest()[:16]}.csv")
+        writer = CsvResultWriter(output_path)
+        text = data.decode('utf-8-sig')
+        total = count_rows(io.StringIO(text))
+        done = writer.done()
+        save = st.checkbox("Add results to each farmer's assessment history")
+        
+        if done >= total:
+            st.success(f"✅ All {total} rows are done.")
+        elif st.button(f"Resume ({done}/{total} done) →" if done else f"Run {total} assessments →", type="primary", use_container_width=True):
+            progress_bar = st.progress(done / total if total else 0.0)
+            status = st.empty()
+            
+            def show_progress(stats):
+                progress_bar.progress(min(stats.done / total, 1.0))
+                status.caption(f"{stats.done}/{total} rows · {stats.rate():.1f} rows/s · "
+                               f"{stats.rules} rules · {stats.fallback} fallback · {stats.invalid} invalid · {stats.deduplicated} shared")
+            
+            try:
+                stats = run_bulk(
+                    engine, read_rows(io.StringIO(text)), writer,
+                    workers=settings.BULK_WORKERS, skip=done, total=total, save=save, progress=show_progress
+                )
+            except ValueError as e:
+                st.error(f"⚠️ {e}")
+            else:
+                st.success(f"🎉 Finished: {stats.ok} from AI, {stats.rules} from the rule base, "
+                           f"{stats.fallback} with fallback advice, {stats.invalid} invalid rows.")
+                done = stats.done
+                if save:
+                    # The current farmer may be in the file
+                    st.session_state.goal_tracker = None
+        
+        if done and os.path.exists(output_path):
+            with open(output_path, 'rb') as f:
+                st.download_button("⬇️ Download results", f.read(), file_name=f"results-{uploaded.name}", mime="text/csv", use_container_width=True)
     
-    st.markdown("### 🔥 Top Tips This Week")
-    st.markdown('<div class="info-card">', unsafe_allow_html=True)
-    st.markdown("""
-    - "Early morning scouting is best for detecting pest issues before they spread" - Saskatchewan farmer
-    - "Keep detailed records of applications and yields for better planning next year" - Ontario farmer
-    - "Soil testing in fall gives you more time to plan amendments for spring" - Alberta farmer
-    - "Consider companion planting to naturally reduce pest pressure" - BC farmer
-    """)
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    if st.button("← Back to Dashboard"):
-        st.session_state.page = 'dashboard'
-        st.rerun()
-    
\ No newline at end of file
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
+
+elif st.session_state.page == 'diagnostics' and settings.DIAGNOSTICS_PAGE:
+    st.markdown('<div class="main-header"><h1>📈 Diagnostics</h1><p>Where recommendation time goes in this process</p></div>', unsafe_allow_html=True)
+    
+    if not metrics.ENABLED:
+        st.info("Metrics are turned off (SMART_FARMING_METRICS=0).")
+    else:
+        registry = metrics.metrics()
+        served = registry['smart_farming_recommendations_total']
+        total = served.total()
+        cache = engine.stats()['cache']
+        lookups = cache['hits_memory'] + cache['hits_disk'] + cache['misses']
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Recommendations served", total)
+        with col2:
+            st.metric("Fallback rate", f"{served.value(source='fallback') / total:.0%}" if total else "–")
+        with col3:
+            st.metric("Cache hit rate", f"{(lookups - cache['misses']) / lookups:.0%}" if lookups else "–")
+        
+        def latency_rows(histogram):
+            rows = []
+            for pairs, _, _, _ in histogram.samples():
+                labels = dict(pairs)
+                summary = histogram.summary(**labels)
+                rows.append(dict(labels, count=summary['count'], mean_ms=round(summary['mean'] * 1000, 1),
+                                 p50_ms=round(summary['p50'] * 1000, 1), p95_ms=round(summary['p95'] * 1000, 1)))
+            return rows
+        
+        st.markdown("### ⏱️ Recommendations by Source")
+        st.dataframe(latency_rows(registry['smart_farming_recommend_seconds']), use_container_width=True, hide_index=True)
+        st.markdown("### 🤖 OpenAI Calls")
+        openai_rows = latency_rows(registry['smart_farming_openai_request_seconds'])
+        if openai_rows:
+            st.dataframe(openai_rows, use_container_width=True, hide_index=True)
+            tokens = registry['smart_farming_openai_tokens_total']
+            st.caption(' · '.join(f"{dict(pairs)['call']} {dict(pairs)['kind']}: {value:,} tokens" for pairs, value in tokens.samples()))
+        else:
+            st.caption("No OpenAI calls yet in this process")
+        st.markdown("### 🖥️ Page Render Times")
+        st.dataframe(latency_rows(PAGE_SECONDS), use_container_width=True, hide_index=True)
+        with st.expander("Prometheus text"):
+            st.code(metrics.render(engine.metric_families()), language='text')
+    
+    st.button("← Back to Dashboard", on_click=go_to, args=('dashboard',))
+
+# Script run time for this interaction (fragment reruns don't get here)
+st.session_state.last_run_ms = (time.perf_counter() - RUN_STARTED) * 1000
+PAGE_SECONDS.observe(st.session_state.last_run_ms / 1000, page=st.session_state.page)
+if settings.METRICS_PATH and metrics.ENABLED:
+    metrics.maybe_write_textfile(settings.METRICS_PATH, settings.METRICS_WRITE_SECONDS, engine.metric_families)
+if settings.SHOW_RUN_TIMES:
+    st.sidebar.caption(f"⏱️ Rendered in {st.session_state.last_run_ms:.0f} ms")
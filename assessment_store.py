@@ -0,0 +1,171 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Columns that can be filtered or counted on; each has an index
+FIELDS = ('farmer_name', 'province', 'season', 'crop_stage', 'selected_crop')
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS assessments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        farmer_name TEXT NOT NULL,
+        province TEXT,
+        season TEXT,
+        crop_stage TEXT,
+        selected_crop TEXT,
+        timestamp TEXT NOT NULL,
+        recommendations TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_assessments_farmer ON assessments (farmer_name, id)',
+    'CREATE INDEX IF NOT EXISTS idx_assessments_province ON assessments (province)',
+    'CREATE INDEX IF NOT EXISTS idx_assessments_crop ON assessments (selected_crop, farmer_name)',
+    'CREATE INDEX IF NOT EXISTS idx_assessments_season ON assessments (season, farmer_name)',
+    'CREATE INDEX IF NOT EXISTS idx_assessments_timestamp ON assessments (timestamp)',
+]
+
+
+class AssessmentStore:
+    """SQLite (WAL) store of completed assessments with batched writes"""
+
+    def __init__(self, path, batch_size=50, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._flush_timer = None
+        self._lock = threading.RLock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def add(self, assessment):
+        """Queue an assessment; written with the next batch"""
+        row = (
+            assessment.get('farmer_name', ''),
+            assessment.get('province'),
+            assessment.get('season'),
+            assessment.get('crop_stage'),
+            assessment.get('selected_crop'),
+            assessment.get('timestamp', ''),
+            json.dumps(assessment.get('recommendations') or {}),
+        )
+        with self._lock:
+            self._pending.append(row)
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self.flush()
+            elif self._flush_timer is None:
+                # Written within flush_interval even if nothing else is added or read
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """Write every queued assessment in one transaction"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return
+            with self._db:
+                self._db.executemany(
+                    'INSERT INTO assessments (farmer_name, province, season, crop_stage, '
+                    'selected_crop, timestamp, recommendations) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    self._pending
+                )
+            self._pending = []
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            # Reads always see queued writes
+            self.flush()
+            return self._db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _where(farmer, **filters):
+        if farmer is not None:
+            filters['farmer_name'] = farmer
+        for field in filters:
+            if field not in FIELDS:
+                raise ValueError(f"unknown field: {field}")
+        if not filters:
+            return '', ()
+        return ' WHERE ' + ' AND '.join(f'{field} = ?' for field in filters), tuple(filters.values())
+
+    def count(self, farmer=None, **filters):
+        """Number of assessments, optionally for one farmer and matching field filters"""
+        where, params = self._where(farmer, **filters)
+        return self._query('SELECT COUNT(*) FROM assessments' + where, params)[0][0]
+
+    def distinct_values(self, field, farmer=None):
+        """Set of values seen in one column, optionally for one farmer"""
+        if field not in FIELDS:
+            raise ValueError(f"unknown field: {field}")
+        where, params = self._where(farmer)
+        where += (' AND ' if where else ' WHERE ') + f"{field} IS NOT NULL AND {field} != ''"
+        return {row[0] for row in self._query(f'SELECT DISTINCT {field} FROM assessments' + where, params)}
+
+    def profile_counts(self, since=None):
+        """Number of assessments per (province, season, crop_stage, selected_crop), optionally
+        only those with a timestamp from `since` (ISO format) on"""
+        where, params = (' WHERE timestamp >= ?', (since,)) if since else ('', ())
+        rows = self._query(
+            'SELECT province, season, crop_stage, selected_crop, COUNT(*) FROM assessments' + where +
+            ' GROUP BY province, season, crop_stage, selected_crop',
+            params
+        )
+        return {tuple(row[:4]): row[4] for row in rows}
+
+    def history(self, farmer=None, page=0, page_size=10):
+        """One page of assessments, newest first"""
+        where, params = self._where(farmer)
+        rows = self._query(
+            'SELECT id, farmer_name, province, season, crop_stage, selected_crop, timestamp, recommendations '
+            'FROM assessments' + where + ' ORDER BY id DESC LIMIT ? OFFSET ?',
+            params + (page_size, page * page_size)
+        )
+        return [self._row_to_assessment(row) for row in rows]
+
+    @staticmethod
+    def _row_to_assessment(row):
+        return {
+            'id': row[0],
+            'farmer_name': row[1],
+            'province': row[2],
+            'season': row[3],
+            'crop_stage': row[4],
+            'selected_crop': row[5],
+            'timestamp': row[6],
+            'recommendations': json.loads(row[7]) if row[7] else {},
+        }
+
+    def iter_assessments(self, batch_size=1000):
+        """Every assessment, oldest first, read in batches so the lock is never held for long"""
+        last_id = 0
+        while True:
+            rows = self._query(
+                'SELECT id, farmer_name, province, season, crop_stage, selected_crop, timestamp, recommendations '
+                'FROM assessments WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, batch_size)
+            )
+            for row in rows:
+                yield self._row_to_assessment(row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._db.close()
@@ -0,0 +1,120 @@
+"""Bytes per in-memory assessment: plain dicts versus CompactAssessment.
+
+    python -m benchmarks.bench_memory --assessments 10000 --farmers 500
+    python -m benchmarks.bench_memory --output bench_memory.json
+
+Builds the same assessments twice, once as the dicts the app used to keep in
+session state and once as CompactAssessment records sharing one TipTable,
+and measures each with tracemalloc; the table counts towards the compact
+figure. Two kinds of advice are measured: rule-based, whose tips are shared
+with the compiled rule table, and AI advice from benchmarks.stub_openai,
+decoded from JSON for every assessment as it is when it comes from OpenAI,
+the SQLite cache or the assessment store.
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.bench_pages import ROOT
+
+
+def traced_bytes(build):
+    """Python heap still held by what build() returns"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return after - before, kept
+
+
+def profiles(count, farmers):
+    from recommendations import all_profiles
+    profile_cycle = itertools.cycle(all_profiles())
+    return [
+        dict(next(profile_cycle), farmer_name=f"Farmer {i % farmers}", timestamp=datetime(2024, 5, 1, 8, i % 60).isoformat())
+        for i in range(count)
+    ]
+
+
+def shared_copy(assessments):
+    """New dicts and lists around the same tip strings, like rule-based advice"""
+    return [
+        dict(assessment, recommendations={category: list(tips) for category, tips in assessment['recommendations'].items()})
+        for assessment in assessments
+    ]
+
+
+def decoded_copy(assessments):
+    """Everything decoded afresh from JSON, like AI advice"""
+    return json.loads(json.dumps(assessments))
+
+
+def advice_sources():
+    """name -> (function(profile) returning that kind of recommendations, how the app gets a copy)"""
+    from benchmarks.stub_openai import fake_content
+    from recommendation_cache import anonymize, personalize
+    from recommendations import build_prompt
+    from rules import generate_fallback_recommendations
+
+    def ai(profile):
+        answer = fake_content([{'role': 'user', 'content': build_prompt(anonymize(profile))}])
+        return personalize(json.loads(answer), profile['farmer_name'])
+
+    return {'rules': (generate_fallback_recommendations, shared_copy), 'ai': (ai, decoded_copy)}
+
+
+def bench(source, fresh_copy, count, farmers):
+    from compact import CompactAssessment, TipTable
+
+    assessments = [dict(profile, recommendations=source(profile)) for profile in profiles(count, farmers)]
+    dict_bytes, _ = traced_bytes(lambda: fresh_copy(assessments))
+    table = TipTable()
+    inputs = fresh_copy(assessments)
+    # The table is new, so every distinct tip it stores is counted too
+    compact_bytes, _ = traced_bytes(lambda: [CompactAssessment(assessment, table) for assessment in inputs])
+    return {
+        'assessments': count,
+        'dict_bytes_per_assessment': round(dict_bytes / count),
+        'compact_bytes_per_assessment': round(compact_bytes / count),
+        'distinct_tips': len(table),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure memory per assessment, dict versus compact")
+    parser.add_argument('--assessments', type=int, default=10000, help="assessments to build")
+    parser.add_argument('--farmers', type=int, default=500, help="distinct farmer names among them")
+    parser.add_argument('--output', help="also write results to this JSON file")
+    args = parser.parse_args(argv)
+    sys.path.insert(0, ROOT)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'farmers': args.farmers,
+        },
+        'advice': {},
+    }
+    for name, (source, fresh_copy) in advice_sources().items():
+        result = results['advice'][name] = bench(source, fresh_copy, args.assessments, args.farmers)
+        print(f"{name:>6}: dict {result['dict_bytes_per_assessment']:6,} B  "
+              f"compact {result['compact_bytes_per_assessment']:6,} B  "
+              f"({result['distinct_tips']:,} distinct tips)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Script-run latency of every page in app.py, using Streamlit's headless AppTest.
+
+    python -m benchmarks.bench_pages --runs 30 --output bench_pages.json
+    python -m benchmarks.bench_pages --baseline bench_pages.json
+
+OpenAI is replaced by benchmarks.stub_openai and all data lives in a
+temporary directory, so no API key or network access is needed. The bulk
+page is timed with benchmarks/fixtures/bulk_farms.csv uploaded, and the
+diagnostics page is switched on for the run. Results are
+written as JSON; with --baseline the run fails if any p95 regressed by more
+than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'app.py')
+BULK_CSV = os.path.join(ROOT, 'benchmarks', 'fixtures', 'bulk_farms.csv')
+
+PAGES = ['dashboard', 'profile', 'crops', 'results', 'goals', 'weather', 'market', 'community', 'bulk', 'diagnostics']
+HISTORY_SIZES = [0, 100, 10000]
+
+PROFILE = {
+    'farmer_name': 'Bench Farmer',
+    'province': 'Saskatchewan',
+    'season': 'Spring',
+    'crop_stage': 'Planting',
+    'timestamp': '2024-05-01T08:00:00',
+}
+
+
+def new_app(**session):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.secrets['OPENAI_API_KEY'] = 'sk-benchmark'
+    for key, value in session.items():
+        at.session_state[key] = value
+    return at
+
+
+def click(at, label):
+    for button in at.button:
+        if label in button.label:
+            return button.click().run()
+    raise LookupError(f"no button labelled {label!r}")
+
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+
+def summarize(samples):
+    from benchmarks.stub_openai import percentile
+    return {
+        'runs': len(samples),
+        'p50_ms': round(percentile(samples, 50), 2),
+        'p95_ms': round(percentile(samples, 95), 2),
+        'max_ms': round(max(samples), 2),
+    }
+
+
+def bench_page(page, runs):
+    """Time repeated script runs of one page"""
+    from rules import generate_fallback_recommendations
+    assessment = dict(PROFILE, selected_crop='Wheat')
+    assessment['recommendations'] = generate_fallback_recommendations(assessment)
+    session = {'page': page, 'farmer_name': PROFILE['farmer_name'], 'current_assessment': assessment}
+    if page == 'crops':
+        session['current_assessment'] = dict(PROFILE)
+
+    at = new_app(**session)
+    at.run()  # warm-up: imports, cache_resource
+    check(at)
+    if page == 'bulk':
+        # Each rerun with a file uploaded hashes it, counts its rows and checks progress
+        with open(BULK_CSV, 'rb') as f:
+            at.file_uploader[0].set_value(('bulk_farms.csv', f.read(), 'text/csv'))
+        at.run()
+        check(at)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - started) * 1000)
+        check(at)
+    return summarize(samples)
+
+
+def seed_history(farmer, size):
+    import settings
+    from assessment_store import AssessmentStore
+    from recommendations import CROPS, SEASONS
+    from rules import generate_fallback_recommendations
+
+    store = AssessmentStore(settings.ASSESSMENT_DB_PATH, batch_size=1000)
+    for i in range(size):
+        assessment = dict(PROFILE, farmer_name=farmer, season=SEASONS[i % 4], selected_crop=CROPS[i % 3])
+        assessment['recommendations'] = generate_fallback_recommendations(assessment)
+        store.add(assessment)
+    store.close()
+
+
+def bench_flow(history_size, runs, profiles):
+    """Time profile -> crops -> results for a farmer with `history_size` past assessments"""
+    farmer = f"bench-{history_size}"
+    seed_history(farmer, history_size)
+
+    samples = []
+    for _ in range(runs):
+        profile = next(profiles)
+        at = new_app(farmer_name=farmer)
+        at.run()
+        check(at)
+        started = time.perf_counter()
+        click(at, "New Assessment")
+        at.text_input[0].input(farmer)
+        at.selectbox[0].select(profile['province'])
+        at.selectbox[1].select(profile['season'])
+        at.selectbox[2].select(profile['crop_stage'])
+        click(at, "Continue")
+        click(at, profile['selected_crop'])
+        click(at, "Get AI Recommendations")
+        samples.append((time.perf_counter() - started) * 1000)
+        check(at)
+        if at.session_state.page != 'results':
+            raise RuntimeError(f"flow ended on {at.session_state.page!r} instead of results")
+    return summarize(samples)
+
+
+def compare(results, baseline, tolerance):
+    """Describe every p95 that got worse than baseline by more than tolerance"""
+    regressions = []
+    for section in ('pages', 'flow'):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if previous and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append(
+                    f"{section}/{name}: p95 {previous['p95_ms']:.1f} ms -> {current['p95_ms']:.1f} ms"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark page script-run latency")
+    parser.add_argument('--runs', type=int, default=30, help="timed runs per page")
+    parser.add_argument('--flow-runs', type=int, default=10, help="timed flows per history size")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated OpenAI latency in seconds")
+    parser.add_argument('--output', default='bench_pages.json', help="where to write results")
+    parser.add_argument('--baseline', help="earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p95 slowdown vs baseline")
+    args = parser.parse_args(argv)
+
+    # Everything the app writes goes to a scratch directory
+    os.environ['SMART_FARMING_DATA_DIR'] = tempfile.mkdtemp(prefix='smart-farming-bench-')
+    os.environ['SMART_FARMING_DIAGNOSTICS'] = '1'
+    sys.path.insert(0, ROOT)
+    from benchmarks import stub_openai
+    from recommendations import all_profiles
+    import streamlit
+
+    stub_openai.install(latency=args.latency)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'streamlit': streamlit.__version__,
+            'runs': args.runs,
+            'flow_runs': args.flow_runs,
+            'latency': args.latency,
+        },
+        'pages': {},
+        'flow': {},
+    }
+    for page in PAGES:
+        results['pages'][page] = bench_page(page, args.runs)
+        print(f"{page:>10}: p50 {results['pages'][page]['p50_ms']:7.1f} ms  p95 {results['pages'][page]['p95_ms']:7.1f} ms")
+
+    profiles = all_profiles()
+    for size in HISTORY_SIZES:
+        results['flow'][str(size)] = bench_flow(size, args.flow_runs, profiles)
+        flow = results['flow'][str(size)]
+        print(f"flow @{size:>6}: p50 {flow['p50_ms']:7.1f} ms  p95 {flow['p95_ms']:7.1f} ms")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Concurrent farmers going through profile -> crops -> results in one process.
+
+    python -m benchmarks.load_test --concurrency 1,5,10,25 --flows 3 --latency 1.5
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8911/v1
+
+Each simulated farmer is a headless AppTest session on its own thread, all
+sharing one Streamlit runtime and its cache_resource singletons, like users
+of a single server process. The real openai client talks to the local
+stand-in in benchmarks.stub_openai_server (started in-process unless
+--base-url is given), so latency, errors and malformed answers can be dialled
+in. Every flow uses a different profile, so nothing is served from cache
+until all 800 have been seen.
+
+Reports, per concurrency level: throughput, flow latency p50/p95/p99, the
+share of recommendations that fell back to the rule base for some or all
+categories (from the engine's recommendation counter, since the warnings
+are gone by the time the results page renders), and resident memory per
+session (add --trace-memory for Python heap per session via tracemalloc,
+which slows the run down).
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.bench_pages import APP_PATH, ROOT, check, click
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc isn't available"""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def share_runtime(secrets):
+    """Make AppTest safe to run from many threads at once.
+
+    Every AppTest run swaps its own mock Runtime and st.secrets into module
+    globals and clears them afterwards, so concurrent sessions would pull
+    them out from under each other, and it compiles app.py afresh in a new
+    ScriptCache, which CPython 3.11 can't do from several threads at once.
+    Pin one runtime, one script cache and one set of secrets for the whole
+    process instead, which is also what a real server has.
+    """
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    st.secrets = Secrets()
+    st.secrets._secrets = dict(secrets)
+
+
+def new_session(farmer):
+    # No per-test secrets: AppTest would swap the global st.secrets on every run
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.session_state['farmer_name'] = farmer
+    return at
+
+
+class ProfileFeed:
+    """Hands out profiles to worker threads, never the same one twice until all are used"""
+
+    def __init__(self):
+        from recommendations import all_profiles
+        self._profiles = itertools.cycle(list(all_profiles()))
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return next(self._profiles)
+
+
+def run_flow(at, farmer, profile):
+    """One farmer's profile -> crops -> results; returns its duration in seconds"""
+    started = time.perf_counter()
+    click(at, "New Assessment")
+    at.text_input[0].input(farmer)
+    at.selectbox[0].select(profile['province'])
+    at.selectbox[1].select(profile['season'])
+    at.selectbox[2].select(profile['crop_stage'])
+    click(at, "Continue")
+    click(at, profile['selected_crop'])
+    click(at, "Get AI Recommendations")
+    elapsed = time.perf_counter() - started
+    check(at)
+    if at.session_state.page != 'results':
+        raise RuntimeError(f"flow ended on {at.session_state.page!r} instead of results")
+    return elapsed
+
+
+def session_worker(index, flows, profiles, results, sessions):
+    farmer = f"load-farmer-{index}"
+    try:
+        at = new_session(farmer)
+        at.run()
+        check(at)
+        sessions.append(at)
+        for _ in range(flows):
+            results.append(run_flow(at, farmer, profiles.next()))
+    except Exception as e:
+        results.append(e)
+
+
+def fallback_counts():
+    """(recommendations served, how many of them fell back) so far in this process"""
+    from engine import RECOMMENDATIONS
+    return RECOMMENDATIONS.total(), RECOMMENDATIONS.value(source='fallback') + RECOMMENDATIONS.value(source='partial')
+
+
+def run_level(concurrency, flows, profiles, trace_memory):
+    """Run `concurrency` sessions at once, each doing `flows` flows"""
+    from benchmarks.stub_openai import percentile
+
+    served_before, fallbacks_before = fallback_counts()
+    results = []
+    sessions = []  # kept alive until memory has been measured
+    rss_before = rss_bytes()
+    if trace_memory:
+        tracemalloc.start()
+
+    threads = [
+        threading.Thread(target=session_worker, args=(i, flows, profiles, results, sessions))
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    served_after, fallbacks_after = fallback_counts()
+
+    rss_after = rss_bytes()
+    heap = None
+    if trace_memory:
+        heap, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    completed = [r for r in results if not isinstance(r, Exception)]
+    latencies = [seconds * 1000 for seconds in completed]
+    served = served_after - served_before
+
+    summary = {
+        'sessions': concurrency,
+        'flows': len(completed),
+        'errors': len(errors),
+        'wall_s': round(wall, 2),
+        'throughput_flows_per_s': round(len(completed) / wall, 3) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 1) if latencies else None,
+        'fallback_rate': round((fallbacks_after - fallbacks_before) / served, 3) if served else None,
+        'rss_per_session_kb': (
+            round((rss_after - rss_before) / concurrency / 1024, 1)
+            if rss_before is not None and rss_after is not None else None
+        ),
+        'heap_per_session_kb': round(heap / concurrency / 1024, 1) if heap is not None else None,
+    }
+    if errors:
+        summary['first_error'] = repr(errors[0])
+    del sessions
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test against a local OpenAI stand-in")
+    parser.add_argument('--concurrency', default='1,5,10,25', help="comma-separated session counts")
+    parser.add_argument('--flows', type=int, default=3, help="flows per session at each level")
+    parser.add_argument('--base-url', help="use an already running stand-in instead of starting one")
+    parser.add_argument('--latency', type=float, default=1.0, help="stand-in mean latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.3, help="stand-in latency jitter in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="stand-in share of HTTP 500s")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="stand-in share of truncated JSON")
+    parser.add_argument('--trace-memory', action='store_true', help="also measure Python heap per session")
+    parser.add_argument('--output', default='bench_load.json', help="where to write results")
+    args = parser.parse_args(argv)
+
+    os.environ['SMART_FARMING_DATA_DIR'] = tempfile.mkdtemp(prefix='smart-farming-load-')
+    # Fallbacks are counted by the engine's metrics
+    os.environ['SMART_FARMING_METRICS'] = '1'
+    sys.path.insert(0, ROOT)
+    import streamlit
+    from benchmarks import stub_openai_server
+
+
+    config = None
+    base_url = args.base_url
+    if not base_url:
+        config = stub_openai_server.StubConfig(args.latency, args.jitter, args.error_rate, args.malformed_rate)
+        _, base_url = stub_openai_server.start(config=config)
+    share_runtime({'OPENAI_API_KEY': 'sk-load-test', 'OPENAI_API_BASE': base_url})
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'streamlit': streamlit.__version__,
+            'base_url': base_url,
+            'flows_per_session': args.flows,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'malformed_rate': args.malformed_rate,
+        },
+        'levels': [],
+    }
+    profiles = ProfileFeed()
+    # Untimed warm-up so imports and cache_resource singletons aren't billed to the first level
+    warm_up = []
+    session_worker('warm-up', 1, profiles, warm_up, [])
+    if isinstance(warm_up[0], Exception):
+        raise warm_up[0]
+    # Worker threads aren't script threads; don't warn about it on every call
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
+
+    for concurrency in [int(n) for n in args.concurrency.split(',')]:
+        level = run_level(concurrency, args.flows, profiles, args.trace_memory)
+        results['levels'].append(level)
+        print(
+            f"{concurrency:>4} sessions: {level['throughput_flows_per_s']:6.2f} flows/s  "
+            f"p50 {level['p50_ms']} ms  p95 {level['p95_ms']} ms  p99 {level['p99_ms']} ms  "
+            f"fallback {level['fallback_rate']}  rss/session {level['rss_per_session_kb']} KB"
+            + (f"  heap/session {level['heap_per_session_kb']} KB" if level['heap_per_session_kb'] is not None else '')
+            + (f"  errors {level['errors']}" if level['errors'] else '')
+        )
+
+    if config is not None:
+        results['stand_in'] = {'requests': config.requests, 'errors': config.errors, 'malformed': config.malformed}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+    return 1 if any(level['errors'] for level in results['levels']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
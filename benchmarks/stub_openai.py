@@ -0,0 +1,91 @@
+"""Deterministic, in-process stand-in for the openai module (0.x API).
+
+Answers ChatCompletion.create with well-formed recommendation JSON derived
+from the prompt, optionally after a fixed latency, so benchmarks can drive
+the app without an API key or network access.
+"""
+import hashlib
+import json
+import sys
+import time
+import types
+
+from recommendations import CATEGORIES
+
+
+class _Object(dict):
+    """dict with attribute access, like openai's OpenAIObject"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return _Object({k: _wrap(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_wrap(v) for v in value]
+    return value
+
+
+def fake_content(messages):
+    """Recommendation JSON that depends only on the prompt"""
+    prompt = messages[-1]['content']
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+    return json.dumps({
+        category: [f"{category.replace('_', ' ').capitalize()} tip {i} ({digest})" for i in range(1, 5)]
+        for category in CATEGORIES
+    })
+
+
+class ChatCompletion:
+    latency = 0.0
+    calls = 0
+
+    @classmethod
+    def create(cls, model=None, messages=(), stream=False, max_tokens=None, **kwargs):
+        cls.calls += 1
+        if cls.latency:
+            time.sleep(cls.latency)
+        content = fake_content(messages)
+        if stream:
+            return (
+                _wrap({'choices': [{'delta': {'content': content[i:i + 16]}}]})
+                for i in range(0, len(content), 16)
+            )
+        prompt_tokens = sum(len(m['content']) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return _wrap({
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        })
+
+
+def install(latency=0.0):
+    """Replace the openai module for this process; returns the stand-in"""
+    module = types.ModuleType('openai')
+    module.api_key = None
+    module.api_base = 'stub://openai'
+    module.ChatCompletion = ChatCompletion
+    ChatCompletion.latency = latency
+    ChatCompletion.calls = 0
+    sys.modules['openai'] = module
+    return module
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) by linear interpolation"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
@@ -0,0 +1,145 @@
+"""Local OpenAI-compatible HTTP stand-in for load testing.
+
+    python -m benchmarks.stub_openai_server --port 8911 --latency 1.5 --error-rate 0.05 --malformed-rate 0.05
+
+Serves POST /v1/chat/completions (plain and streamed) with recommendation
+JSON from benchmarks.stub_openai.fake_content. Latency, the share of
+requests answered with a 500, and the share answered with truncated JSON
+are configurable. Point the app at it with OPENAI_API_BASE in secrets.toml.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.stub_openai import fake_content
+
+
+class StubConfig:
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, malformed_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.malformed = 0
+
+    def draw(self):
+        """Pick this request's delay and fate"""
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+            if roll < self.error_rate:
+                self.errors += 1
+                return delay, 'error'
+            if roll < self.error_rate + self.malformed_rate:
+                self.malformed += 1
+                return delay, 'malformed'
+            return delay, 'ok'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f"unknown path {self.path}", 'type': 'invalid_request_error'}})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        delay, fate = self.config.draw()
+        if fate == 'error':
+            time.sleep(delay)
+            self._send_json(500, {'error': {'message': "stub server error", 'type': 'server_error'}})
+            return
+
+        content = fake_content(request.get('messages') or [{'content': ''}])
+        if fate == 'malformed':
+            content = content[:len(content) * 2 // 3]
+
+        if request.get('stream'):
+            self._stream(content, delay)
+            return
+
+        time.sleep(delay)
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', [])) // 4
+        completion_tokens = len(content) // 4
+        self._send_json(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _stream(self, content, delay):
+        """Server-sent events, spreading the latency across the chunks"""
+        chunks = [content[i:i + 24] for i in range(0, len(content), 24)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            event = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': chunk}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def start(port=0, config=None):
+    """Run the stand-in on a background thread; returns (server, base_url)"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config or StubConfig()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-openai', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in server")
+    parser.add_argument('--port', type=int, default=8911)
+    parser.add_argument('--latency', type=float, default=0.5, help="mean response time in seconds")
+    parser.add_argument('--jitter', type=float, default=0.2, help="+/- seconds around the mean")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="share of requests answered with truncated JSON")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.malformed_rate, args.seed)
+    server, base_url = start(args.port, config)
+    print(f"Stub OpenAI listening on {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""Run assessments for a whole CSV of farms.
+
+    python bulk.py farms.csv --output results.csv --workers 8
+    python bulk.py farms.csv --output results/ --format parquet
+
+The input needs farmer_name, province, season, crop_stage and crop columns.
+Rows stream through validation, de-duplication of identical profiles, the
+engine's cache and a bounded pool of generation threads, and are written out
+in input order as they finish, so memory stays flat however long the file
+is. Running the same command again after an interruption skips the rows that
+are already in the output.
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import RecommendationEngine, parse_profile
+from recommendation_cache import anonymize, personalize, profile_key
+from recommendations import CATEGORIES
+
+INPUT_COLUMNS = ('farmer_name', 'province', 'season', 'crop_stage', 'crop')
+OUTPUT_COLUMNS = ('row',) + INPUT_COLUMNS + ('status', 'message') + tuple(CATEGORIES)
+
+# Tips of one category share a cell
+TIP_SEPARATOR = ' | '
+
+
+def read_rows(lines):
+    """Input rows as dicts with normalized column names; `lines` is any iterable of CSV lines"""
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = [column for column in INPUT_COLUMNS if column not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"CSV is missing column(s): {', '.join(missing)}")
+    for row in reader:
+        yield {column: (row.get(column) or '').strip() for column in INPUT_COLUMNS}
+
+
+def count_rows(lines):
+    """Data rows in CSV lines, read as a stream; blank lines are skipped, as read_rows() skips them"""
+    return sum(1 for _ in csv.DictReader(lines))
+
+
+class CsvResultWriter:
+    """Appends result rows to a CSV file, flushing each one so a crash loses at most a row"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._writer = None
+
+    def done(self):
+        """Rows already written by an earlier run"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                # Drop a row torn by an interrupted write
+                f.truncate(data.rfind(b'\n') + 1)
+        with open(self.path, newline='', encoding='utf-8') as f:
+            return count_rows(f)
+
+    def open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_COLUMNS)
+        if is_new:
+            self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetResultWriter:
+    """Writes result rows as numbered Parquet part files in a directory (needs pyarrow)"""
+
+    def __init__(self, directory, part_rows=1000):
+        import pyarrow  # noqa: F401  fail early if it isn't installed
+        self.directory = directory
+        self.part_rows = part_rows
+        self._rows = []
+        self._parts = 0
+
+    def _part_files(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'part-*.parquet')))
+
+    def done(self):
+        import pyarrow.parquet as pq
+        parts = self._part_files()
+        self._parts = len(parts)
+        return sum(pq.read_metadata(part).num_rows for part in parts)
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._parts = len(self._part_files())
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.part_rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._rows:
+            return
+        table = pa.table({column: [row[column] for row in self._rows] for column in OUTPUT_COLUMNS})
+        path = os.path.join(self.directory, f'part-{self._parts:05d}.parquet')
+        # Written under a temporary name so a part is either complete or absent
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self._parts += 1
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+
+def open_writer(output, fmt):
+    if fmt == 'parquet':
+        return ParquetResultWriter(output)
+    return CsvResultWriter(output)
+
+
+class BulkStats:
+    def __init__(self, total=None, skipped=0):
+        self.total = total
+        self.skipped = skipped
+        self.written = 0
+        self.ok = 0
+        self.rules = 0
+        self.fallback = 0
+        self.invalid = 0
+        self.errors = 0
+        self.deduplicated = 0
+        self.started = time.monotonic()
+
+    @property
+    def done(self):
+        return self.skipped + self.written
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.written / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'done': self.done,
+            'skipped': self.skipped,
+            'written': self.written,
+            'ok': self.ok,
+            'rules': self.rules,
+            'fallback': self.fallback,
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'deduplicated': self.deduplicated,
+            'rows_per_second': round(self.rate(), 2),
+        }
+
+
+def _generate(engine, farmer_data):
+    warnings = []
+    recommendations, source = engine.recommend_with_source(farmer_data, warn=warnings.append)
+    return recommendations, source, warnings
+
+
+def _result_row(index, raw, status, message='', recommendations=None):
+    row = dict(raw, row=index + 1, status=status, message=message)
+    for category in CATEGORIES:
+        row[category] = TIP_SEPARATOR.join(str(tip) for tip in (recommendations or {}).get(category, []))
+    return row
+
+
+def run_bulk(engine, rows, writer, workers=8, window=64, skip=0, total=None, save=False, progress=None, progress_every=50):
+    """Generate and write results for `rows` in order; returns BulkStats.
+
+    At most `window` rows are held in memory. Rows whose profile matches one
+    still in the window share its generation instead of starting another.
+    """
+    stats = BulkStats(total, skipped=skip)
+    pending = deque()
+    in_window = {}  # profile key -> [future, rows waiting on it]
+
+    def emit():
+        index, raw, profile, outcome = pending.popleft()
+        if profile is None:
+            row = _result_row(index, raw, 'invalid', str(outcome))
+            stats.invalid += 1
+        else:
+            key = profile_key(profile)
+            entry = in_window[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del in_window[key]
+            try:
+                recommendations, source, warnings = outcome.result()
+            except Exception as e:
+                row = _result_row(index, raw, 'error', str(e))
+                stats.errors += 1
+            else:
+                recommendations = personalize(recommendations, profile['farmer_name'])
+                if warnings or source in ('fallback', 'partial'):
+                    row = _result_row(index, raw, 'fallback', ' '.join(warnings), recommendations)
+                    stats.fallback += 1
+                elif source == 'rules':
+                    # No API key, offline or rules-first: not an AI answer, but nothing failed either
+                    row = _result_row(index, raw, 'rules', '', recommendations)
+                    stats.rules += 1
+                else:
+                    row = _result_row(index, raw, 'ok', '', recommendations)
+                    stats.ok += 1
+                if save:
+                    engine.record(dict(profile, recommendations=recommendations))
+        writer.write(row)
+        stats.written += 1
+        if progress is not None and stats.written % progress_every == 0:
+            progress(stats)
+
+    writer.open()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk') as pool:
+            for index, raw in enumerate(rows):
+                if index < skip:
+                    continue
+                try:
+                    profile = parse_profile(dict(raw, selected_crop=raw['crop']))
+                except ValueError as e:
+                    pending.append((index, raw, None, e))
+                else:
+                    key = profile_key(profile)
+                    if key in in_window:
+                        in_window[key][1] += 1
+                        stats.deduplicated += 1
+                    else:
+                        # Generated without the name, so every farmer with this profile can share it
+                        in_window[key] = [pool.submit(_generate, engine, anonymize(profile)), 1]
+                    pending.append((index, raw, profile, in_window[key][0]))
+                while len(pending) >= window:
+                    emit()
+            while pending:
+                emit()
+    finally:
+        writer.close()
+        if save:
+            engine.store.flush()
+    if progress is not None:
+        progress(stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run assessments for every farm in a CSV")
+    parser.add_argument('input', help="CSV with farmer_name, province, season, crop_stage, crop")
+    parser.add_argument('--output', required=True, help="results CSV file, or directory for parquet")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--workers', type=int, default=8, help="concurrent generations")
+    parser.add_argument('--window', type=int, default=64, help="rows held in memory at once")
+    parser.add_argument('--save', action='store_true', help="also record each row in the assessment history")
+    parser.add_argument('--restart', action='store_true', help="ignore earlier output and start from the first row")
+    args = parser.parse_args(argv)
+
+    from precompute import load_api_key
+    api_key = load_api_key()
+    if not api_key:
+        print("OPENAI_API_KEY is not set; every row gets rule-based recommendations", file=sys.stderr)
+    engine = RecommendationEngine.from_settings(api_key, os.environ.get('OPENAI_API_BASE'), background=False)
+
+    try:
+        writer = open_writer(args.output, args.format)
+    except ImportError:
+        parser.error("--format parquet needs pyarrow: pip install pyarrow")
+    if args.restart and args.format == 'parquet':
+        for part in glob.glob(os.path.join(args.output, 'part-*.parquet')):
+            os.remove(part)
+    elif args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    skip = writer.done()
+    with open(args.input, newline='', encoding='utf-8-sig') as f:
+        total = count_rows(f)
+    if skip:
+        print(f"Resuming: {skip} of {total} rows already in {args.output}")
+
+    def report(stats):
+        print(f"\r{stats.done}/{stats.total} rows  {stats.rate():.1f} rows/s  "
+              f"{stats.rules} rules  {stats.fallback} fallback  {stats.invalid} invalid  {stats.deduplicated} shared", end='', flush=True)
+
+    with open(args.input, newline='', encoding='utf-8-sig') as f:
+        stats = run_bulk(engine, read_rows(f), writer, workers=args.workers, window=max(args.window, args.workers),
+                         skip=skip, total=total, save=args.save, progress=report)
+    print()
+    engine.close()
+    return 0 if not stats.errors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
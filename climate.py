@@ -0,0 +1,459 @@
+"""Local climate normals from historical station records.
+
+    python climate.py ingest daily/*.csv
+    python climate.py ingest ns_stations.csv --province "Nova Scotia"
+    python climate.py summary Saskatchewan --season Spring
+
+Ingestion reads daily station CSVs (Environment Canada's bulk downloads and
+climate-daily API exports both work, as does any CSV with station, province,
+date, tmax, tmin and precip columns) into one NumPy file per column, sorted by
+province. The app opens those files memory-mapped, so a province's query only
+touches that province's rows, and the daily normals derived from them (frost
+probability, growing degree days, precipitation) are computed once per
+province per process.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import settings
+from recommendations import PROVINCES, SEASONS
+
+# Bump when the store layout changes
+STORE_VERSION = 1
+
+COLUMNS = {
+    'station': np.int32,
+    'province': np.uint8,
+    'year': np.int16,
+    'doy': np.int16,
+    'tmax': np.float32,
+    'tmin': np.float32,
+    'precip': np.float32,
+}
+
+# Accepted CSV headers for each field, compared lowercased
+COLUMN_ALIASES = {
+    'station': ('station', 'station_id', 'climate id', 'climate_identifier', 'station name', 'station_name'),
+    'province': ('province', 'province_code', 'prov'),
+    'date': ('date', 'date/time', 'local_date'),
+    'tmax': ('tmax', 'max temp (°c)', 'max_temperature', 'max_temp'),
+    'tmin': ('tmin', 'min temp (°c)', 'min_temperature', 'min_temp'),
+    'precip': ('precip', 'total precip (mm)', 'total_precipitation', 'precipitation'),
+}
+
+PROVINCE_CODES = {
+    'AB': "Alberta", 'BC': "British Columbia", 'MB': "Manitoba",
+    'NB': "New Brunswick", 'NL': "Newfoundland and Labrador", 'NS': "Nova Scotia",
+    'ON': "Ontario", 'PE': "Prince Edward Island", 'QC': "Quebec", 'SK': "Saskatchewan",
+}
+
+# Days are numbered within a leap year (1-366) so Mar 1 is always day 61
+DAYS = 366
+_MONTH_START = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+# (first month, last month) of each season; winter runs over the new year
+SEASON_MONTHS = {'Spring': (3, 5), 'Summer': (6, 8), 'Fall': (9, 11), 'Winter': (12, 2)}
+
+# Growing degree days above 5°C, the usual base for cereals and canola
+GDD_BASE = 5.0
+
+# A day with at least this much precipitation counts as wet
+WET_DAY_MM = 1.0
+
+# Daily normals are averaged over a centred window of this many days
+SMOOTHING_DAYS = 15
+
+# Frost dates are where the smoothed frost probability crosses this
+FROST_DATE_PROBABILITY = 0.5
+
+
+def day_of_year(month, day):
+    return int(_MONTH_START[month - 1]) + day
+
+
+def date_from_day(doy, year):
+    """Date of day `doy` (as numbered by day_of_year) in `year`"""
+    month = int(np.searchsorted(_MONTH_START, doy - 1, side='right'))
+    day = doy - int(_MONTH_START[month - 1])
+    if month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        day = 28
+    return date(year, month, day)
+
+
+def _season_days(season):
+    first, last = SEASON_MONTHS[season]
+    start = day_of_year(first, 1)
+    end = day_of_year(last % 12 + 1, 1) - 1 if last < 12 else DAYS
+    return start, end
+
+
+def normalize_province(value):
+    """Province name from a full name in any case or a two-letter code; None if unknown"""
+    value = ' '.join((value or '').split())
+    if value.upper() in PROVINCE_CODES:
+        return PROVINCE_CODES[value.upper()]
+    for province in PROVINCES:
+        if province.lower() == value.lower():
+            return province
+    return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _field_names(fieldnames):
+    """CSV header -> field name for each field we know, first alias wins"""
+    lowered = {name.strip().lower(): name for name in fieldnames}
+    found = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                found[field] = lowered[alias]
+                break
+    return found
+
+
+def read_daily_csv(lines, province=None):
+    """(station, province, year, doy, tmax, tmin, precip) for each usable row of a daily CSV"""
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    names = _field_names(reader.fieldnames)
+    missing = [field for field in ('station', 'date', 'tmax', 'tmin', 'precip') if field not in names]
+    if 'province' not in names and province is None:
+        missing.append('province (or pass --province)')
+    if missing:
+        raise ValueError(f"CSV is missing column(s): {', '.join(missing)}")
+
+    for row in reader:
+        row_province = normalize_province(row[names['province']]) if 'province' in names else province
+        try:
+            day = datetime.strptime(row[names['date']].strip()[:10], '%Y-%m-%d')
+        except ValueError:
+            continue
+        if row_province is None:
+            continue
+        yield (
+            row[names['station']].strip(), row_province, day.year, day_of_year(day.month, day.day),
+            _float(row[names['tmax']]), _float(row[names['tmin']]), _float(row[names['precip']]),
+        )
+
+
+def ingest(paths, directory, province=None, log=print):
+    """Build a store in `directory` from daily CSV files, replacing any earlier build"""
+    if province is not None and normalize_province(province) is None:
+        raise ValueError(f"unknown province {province!r}")
+    province = normalize_province(province) if province else None
+
+    stations = {}
+    columns = {name: array(np.dtype(dtype).char) for name, dtype in COLUMNS.items()}
+    for path in paths:
+        before = len(columns['doy'])
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for station, row_province, year, doy, tmax, tmin, precip in read_daily_csv(f, province):
+                columns['station'].append(stations.setdefault(station, len(stations)))
+                columns['province'].append(PROVINCES.index(row_province))
+                columns['year'].append(year)
+                columns['doy'].append(doy)
+                columns['tmax'].append(tmax)
+                columns['tmin'].append(tmin)
+                columns['precip'].append(precip)
+        log(f"{path}: {len(columns['doy']) - before} days")
+
+    data = {name: np.frombuffer(column, dtype=COLUMNS[name]) for name, column in columns.items()}
+    # Province first so each province is one contiguous slice; lexsort is stable,
+    # so of two rows for the same station and day the later file wins
+    order = np.lexsort((data['doy'], data['year'], data['station'], data['province']))
+    data = {name: column[order] for name, column in data.items()}
+    if len(order):
+        same_day = ((data['station'][1:] == data['station'][:-1]) & (data['year'][1:] == data['year'][:-1])
+                    & (data['doy'][1:] == data['doy'][:-1]))
+        keep = np.append(~same_day, True)
+        data = {name: column[keep] for name, column in data.items()}
+
+    digest = hashlib.sha256()
+    for name in COLUMNS:
+        digest.update(data[name].tobytes())
+    fingerprint = digest.hexdigest()[:16]
+    bounds = np.searchsorted(data['province'], np.arange(len(PROVINCES) + 1))
+    valid_years = data['year'][np.isfinite(data['tmin'])]
+    meta = {
+        'version': STORE_VERSION,
+        'fingerprint': fingerprint,
+        'build': fingerprint,
+        'built_at': datetime.now().isoformat(),
+        'rows': int(len(data['doy'])),
+        'stations': list(stations),
+        'years': [int(valid_years.min()), int(valid_years.max())] if len(valid_years) else None,
+        'provinces': {
+            name: [int(bounds[i]), int(bounds[i + 1])]
+            for i, name in enumerate(PROVINCES) if bounds[i + 1] > bounds[i]
+        },
+    }
+
+    # Columns go into a new build directory; swapping meta.json over to it is
+    # atomic, so a running app never sees half an ingestion
+    build_dir = os.path.join(directory, 'builds', fingerprint)
+    os.makedirs(build_dir, exist_ok=True)
+    for name in COLUMNS:
+        np.save(os.path.join(build_dir, f'{name}.npy'), data[name])
+    meta_path = os.path.join(directory, 'meta.json')
+    # Processes still reading the build being replaced keep it until the next ingestion
+    keep = {fingerprint, _current_build(meta_path)}
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    for old in os.listdir(os.path.join(directory, 'builds')):
+        if old not in keep:
+            shutil.rmtree(os.path.join(directory, 'builds', old), ignore_errors=True)
+    log(f"Stored {meta['rows']} days from {len(stations)} stations in {directory}")
+    return meta
+
+
+def _current_build(meta_path):
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f).get('build')
+    except (OSError, ValueError):
+        return None
+
+
+def _smooth(sums, counts):
+    """Windowed mean over a circular year, weighting each day by how many records it has"""
+    kernel = np.ones(SMOOTHING_DAYS)
+    pad = SMOOTHING_DAYS // 2
+
+    def window(values):
+        wrapped = np.concatenate([values[-pad:], values, values[:pad]])
+        return np.convolve(wrapped, kernel, mode='valid')
+
+    totals = window(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0, window(sums) / totals, np.nan)
+
+
+class ClimateStore:
+    """Memory-mapped station records with per-province daily normals"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"climate store in {directory} has version {self.meta.get('version')}; re-run ingestion")
+        build_dir = os.path.join(directory, 'builds', self.meta['build'])
+        self.columns = {name: np.load(os.path.join(build_dir, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+        self.fingerprint = self.meta['fingerprint']
+        self._normals = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, directory):
+        """Store in `directory`, or None if nothing has been ingested there"""
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            return None
+        return cls(directory)
+
+    @property
+    def provinces(self):
+        return list(self.meta['provinces'])
+
+    def covers(self, province):
+        return province in self.meta['provinces']
+
+    def normals(self, province):
+        """Smoothed daily normals for a province as arrays indexed by day of year - 1:
+        tmax, tmin, precip (mm), gdd, frost (probability of a night at or below 0°C)
+        and wet (probability of a wet day); None if the province has no records"""
+        normals = self._normals.get(province)
+        if normals is not None or not self.covers(province):
+            return normals
+        with self._lock:
+            if province not in self._normals:
+                self._normals[province] = self._compute_normals(province)
+        return self._normals[province]
+
+    def _compute_normals(self, province):
+        start, stop = self.meta['provinces'][province]
+        doy = np.asarray(self.columns['doy'][start:stop]) - 1
+        tmax = np.asarray(self.columns['tmax'][start:stop], dtype=float)
+        tmin = np.asarray(self.columns['tmin'][start:stop], dtype=float)
+        precip = np.asarray(self.columns['precip'][start:stop], dtype=float)
+
+        def daily(values):
+            valid = np.isfinite(values)
+            sums = np.bincount(doy[valid], weights=values[valid], minlength=DAYS)
+            counts = np.bincount(doy[valid], minlength=DAYS).astype(float)
+            return _smooth(sums, counts)
+
+        both = np.isfinite(tmax) & np.isfinite(tmin)
+        gdd = np.where(both, np.maximum((tmax + tmin) / 2 - GDD_BASE, 0), np.nan)
+        frost = np.where(np.isfinite(tmin), (tmin <= 0).astype(float), np.nan)
+        wet = np.where(np.isfinite(precip), (precip >= WET_DAY_MM).astype(float), np.nan)
+        normals = {
+            'tmax': daily(tmax),
+            'tmin': daily(tmin),
+            'precip': daily(precip),
+            'gdd': daily(gdd),
+            'frost': daily(frost),
+            'wet': daily(wet),
+        }
+        normals['records'] = int(stop - start)
+        return normals
+
+    def _total(self, province, field, start, end):
+        """Sum of a daily normal from day `start` to day `end` inclusive, wrapping over the new year"""
+        values = self.normals(province)[field]
+        if start <= end:
+            return float(np.nansum(values[start - 1:end]))
+        return float(np.nansum(values[start - 1:]) + np.nansum(values[:end]))
+
+    def frost_probability(self, province, day):
+        """Chance of a frost on the night of `day` (a date), from the province's records"""
+        return float(self.normals(province)['frost'][day_of_year(day.month, day.day) - 1])
+
+    def growing_degree_days(self, province, start, end):
+        """Normal growing degree days (base 5°C) accumulated from `start` to `end` (dates)"""
+        return self._total(province, 'gdd', day_of_year(start.month, start.day), day_of_year(end.month, end.day))
+
+    def precipitation(self, province, start, end):
+        """Normal precipitation in mm from `start` to `end` (dates)"""
+        return self._total(province, 'precip', day_of_year(start.month, start.day), day_of_year(end.month, end.day))
+
+    def frost_dates(self, province, probability=FROST_DATE_PROBABILITY):
+        """(day of the last spring frost, day of the first fall frost) at the given probability,
+        as days of the year; (None, None) where frosts are that likely all year or never"""
+        frost = self.normals(province)['frost']
+        likely = frost >= probability
+        midsummer = day_of_year(7, 15) - 1
+        spring = np.flatnonzero(likely[:midsummer])
+        fall = np.flatnonzero(likely[midsummer:])
+        if likely[midsummer] or not len(spring) or not len(fall):
+            return None, None
+        return int(spring[-1]) + 1, int(fall[0]) + midsummer + 1
+
+    def outlook(self, province, start, days=7):
+        """Normals for each of the `days` days from `start` (a date)"""
+        normals = self.normals(province)
+        rows = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            index = day_of_year(day.month, day.day) - 1
+            rows.append({
+                'date': day,
+                'tmax': float(normals['tmax'][index]),
+                'tmin': float(normals['tmin'][index]),
+                'wet': float(normals['wet'][index]),
+                'frost': float(normals['frost'][index]),
+            })
+        return rows
+
+    def summary(self, province, season):
+        """A few lines of climate context for the recommendation prompt; empty without records"""
+        normals = self.normals(province)
+        if normals is None or season not in SEASON_MONTHS:
+            return []
+        start, end = _season_days(season)
+        if start <= end:
+            days = np.arange(start - 1, end)
+        else:
+            days = np.concatenate([np.arange(start - 1, DAYS), np.arange(0, end)])
+        lines = [
+            f"{season} normals: average high {np.nanmean(normals['tmax'][days]):.0f}°C, "
+            f"average low {np.nanmean(normals['tmin'][days]):.0f}°C, "
+            f"{self._total(province, 'precip', start, end):.0f} mm precipitation, "
+            f"{self._total(province, 'gdd', start, end):.0f} growing degree days (base 5°C)",
+            f"Chance of frost on a given {season.lower()} night: "
+            f"{normals['frost'][start - 1]:.0%} at the start of the season, {normals['frost'][end - 1]:.0%} at the end",
+        ]
+        last_spring, first_fall = self.frost_dates(province)
+        if last_spring is not None:
+            lines.append(
+                f"Frost-free season: last spring frost around {date_from_day(last_spring, 2001):%b %d}, "
+                f"first fall frost around {date_from_day(first_fall, 2001):%b %d} "
+                f"({first_fall - last_spring} days, {self._total(province, 'gdd', last_spring, first_fall):.0f} "
+                f"growing degree days)"
+            )
+        return lines
+
+    def stats(self):
+        return {
+            'rows': self.meta['rows'],
+            'stations': len(self.meta['stations']),
+            'provinces': len(self.meta['provinces']),
+            'years': self.meta['years'],
+        }
+
+
+_default = (None, None)
+_default_lock = threading.Lock()
+
+
+def default_store():
+    """Store in settings.CLIMATE_DIR, reopened whenever an ingestion replaces its meta.json;
+    None until data has been ingested"""
+    global _default
+    try:
+        mtime = os.stat(os.path.join(settings.CLIMATE_DIR, 'meta.json')).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _default_lock:
+        if _default[0] != mtime:
+            _default = (mtime, ClimateStore.open(settings.CLIMATE_DIR) if mtime is not None else None)
+        return _default[1]
+
+
+def with_climate(farmer_data, store):
+    """Copy of the profile with the province's climate summary under 'climate', for the prompt"""
+    if store is None or not store.covers(farmer_data.get('province')):
+        return farmer_data
+    lines = store.summary(farmer_data['province'], farmer_data.get('season'))
+    return dict(farmer_data, climate=lines) if lines else farmer_data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and query local climate normals")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="build the store from daily station CSVs")
+    ingest_parser.add_argument('files', nargs='+', help="daily CSV files")
+    ingest_parser.add_argument('--province', help="province for files without a province column")
+    ingest_parser.add_argument('--output', default=settings.CLIMATE_DIR, help="store directory")
+    summary_parser = commands.add_parser('summary', help="print the climate summary for a province")
+    summary_parser.add_argument('province')
+    summary_parser.add_argument('--season', choices=SEASONS, default=SEASONS[0])
+    summary_parser.add_argument('--store', default=settings.CLIMATE_DIR, help="store directory")
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        try:
+            ingest(args.files, args.output, province=args.province)
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+
+    store = ClimateStore.open(args.store)
+    province = normalize_province(args.province)
+    if store is None or not store.covers(province):
+        print(f"No climate records for {args.province} in {args.store}", file=sys.stderr)
+        return 1
+    for line in store.summary(province, args.season):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
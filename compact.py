@@ -0,0 +1,221 @@
+"""Compact in-memory assessments backed by one shared table of tips.
+
+A plain assessment dict holds its own copy of every tip, although most tips
+are the same for every farmer with the same profile (rule-based advice is
+identical word for word). CompactAssessment keeps the profile as small enum
+codes and the recommendations as ids into a TipTable shared by the whole
+process, which stores each distinct tip once with the farmer's name taken
+out and drops it again once no assessment refers to it, so the table only
+holds the advice that live sessions still show. It behaves like the dict it replaces, so code reading
+assessment['province'] or assessment.get('recommendations') is unchanged,
+and copy() gives back a plain dict for storage.
+"""
+import functools
+import sys
+import threading
+from array import array
+from collections.abc import MutableMapping
+
+from recommendation_cache import FARMER_NAME_PLACEHOLDER, depersonalize
+from recommendations import CATEGORIES, CROP_STAGES, CROPS, PROVINCES, SEASONS
+
+# Enum-coded profile fields; a code is index + 1, 0 meaning "not set"
+CODED_FIELDS = {
+    'province': PROVINCES,
+    'season': SEASONS,
+    'crop_stage': CROP_STAGES,
+    'selected_crop': CROPS,
+}
+
+# Bit offset of each coded field within CompactAssessment's one code integer
+_SHIFTS = {field: 8 * position for position, field in enumerate(CODED_FIELDS)}
+
+FIELDS = ('id', 'farmer_name', 'province', 'season', 'crop_stage', 'selected_crop', 'timestamp', 'recommendations')
+
+# Stands in for "no recommendations key", since None means "still streaming"
+_MISSING = object()
+
+
+class TipTable:
+    """Reference-counted table of distinct tip texts; a tip's id never changes while it is held"""
+
+    def __init__(self):
+        self._texts = []
+        self._refs = array('I')
+        self._ids = {}
+        self._free = []
+        # Released ids waiting to be counted down; appended to without the lock
+        self._released = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._drain()
+            return len(self._ids)
+
+    def intern(self, text):
+        """Id of a tip, adding it if it's new; each call holds the tip until a matching release()"""
+        with self._lock:
+            self._drain()
+            tip_id = self._ids.get(text)
+            if tip_id is None:
+                if self._free:
+                    tip_id = self._free.pop()
+                    self._texts[tip_id] = text
+                else:
+                    tip_id = len(self._texts)
+                    self._texts.append(text)
+                    self._refs.append(0)
+                self._ids[text] = tip_id
+            self._refs[tip_id] += 1
+        return tip_id
+
+    def release(self, tip_ids):
+        """Let go of tips from intern(); a tip nothing holds is dropped, and its id reused, the next
+        time the table is used. Takes no lock, so a finalizer may call it while this thread holds it"""
+        self._released.extend(tip_ids)
+
+    def _drain(self):
+        while self._released:
+            tip_id = self._released.pop()
+            self._refs[tip_id] -= 1
+            if not self._refs[tip_id]:
+                del self._ids[self._texts[tip_id]]
+                self._texts[tip_id] = None
+                self._free.append(tip_id)
+
+    def text(self, tip_id):
+        return self._texts[tip_id]
+
+    def stats(self):
+        with self._lock:
+            self._drain()
+            texts = list(self._ids)
+        return {'tips': len(texts), 'text_bytes': sum(sys.getsizeof(text) for text in texts)}
+
+
+@functools.lru_cache(maxsize=None)
+def default_tip_table():
+    """Tip table shared by every session in the process"""
+    return TipTable()
+
+
+class CompactAssessment(MutableMapping):
+    """An assessment dict stored as enum codes and shared tip ids"""
+
+    __slots__ = ('id', 'farmer_name', 'timestamp', '_codes', '_tips', '_table')
+
+    def __init__(self, assessment=None, table=None):
+        self.id = None
+        self.farmer_name = None
+        self.timestamp = None
+        self._codes = 0  # one byte per coded field, in CODED_FIELDS order
+        self._tips = _MISSING
+        self._table = table if table is not None else default_tip_table()
+        if assessment:
+            # The name first, so the tips are stored without it
+            if assessment.get('farmer_name') is not None:
+                self['farmer_name'] = assessment['farmer_name']
+            for field, value in assessment.items():
+                if field != 'farmer_name':
+                    self[field] = value
+
+    def _encode(self, recommendations):
+        """Tip counts per category followed by tip ids, or the value itself if it isn't plain tip lists"""
+        if (not isinstance(recommendations, dict) or recommendations.keys() != set(CATEGORIES)
+                or not all(isinstance(tips, list) and all(isinstance(tip, str) for tip in tips)
+                           for tips in recommendations.values())):
+            return dict(recommendations) if isinstance(recommendations, dict) else recommendations
+        name = self.farmer_name
+        encoded = array('I', [len(recommendations[category]) for category in CATEGORIES])
+        for category in CATEGORIES:
+            for tip in recommendations[category]:
+                encoded.append(self._table.intern(depersonalize(tip, name)))
+        return encoded
+
+    def _release(self):
+        if isinstance(self._tips, array):
+            self._table.release(self._tips[len(CATEGORIES):])
+
+    def _decode(self):
+        if not isinstance(self._tips, array):
+            return dict(self._tips) if isinstance(self._tips, dict) else self._tips
+        name = self.farmer_name
+        recommendations = {}
+        position = len(CATEGORIES)
+        for category, count in zip(CATEGORIES, self._tips):
+            texts = [self._table.text(tip_id) for tip_id in self._tips[position:position + count]]
+            recommendations[category] = [text.replace(FARMER_NAME_PLACEHOLDER, name) for text in texts] if name else texts
+            position += count
+        return recommendations
+
+    def __getitem__(self, field):
+        if field in CODED_FIELDS:
+            code = (self._codes >> _SHIFTS[field]) & 0xFF
+            if code:
+                return CODED_FIELDS[field][code - 1]
+        elif field == 'recommendations':
+            if self._tips is not _MISSING:
+                return self._decode()
+        elif field in ('id', 'farmer_name', 'timestamp'):
+            value = getattr(self, field)
+            if value is not None:
+                return value
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field in CODED_FIELDS:
+            choices = CODED_FIELDS[field]
+            if value is not None and value not in choices:
+                raise ValueError(f"{field} must be one of: {', '.join(choices)}")
+            code = choices.index(value) + 1 if value is not None else 0
+            self._codes = (self._codes & ~(0xFF << _SHIFTS[field])) | (code << _SHIFTS[field])
+        elif field == 'recommendations':
+            tips = self._encode(value)
+            self._release()
+            self._tips = tips
+        elif field == 'farmer_name':
+            recommendations = self.get('recommendations', _MISSING)
+            # Names repeat across a farmer's assessments, so keep one copy
+            self.farmer_name = sys.intern(value) if isinstance(value, str) else value
+            if recommendations is not _MISSING:
+                tips = self._encode(recommendations)
+                self._release()
+                self._tips = tips
+        elif field in ('id', 'timestamp'):
+            setattr(self, field, value)
+        else:
+            raise KeyError(f"assessments have no field {field!r}")
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+        if field == 'recommendations':
+            self._release()
+            self._tips = _MISSING
+        else:
+            self[field] = None
+
+    def __iter__(self):
+        return (field for field in FIELDS if field in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, field):
+        if field in CODED_FIELDS:
+            return bool((self._codes >> _SHIFTS[field]) & 0xFF)
+        if field == 'recommendations':
+            return self._tips is not _MISSING
+        return field in ('id', 'farmer_name', 'timestamp') and getattr(self, field) is not None
+
+    def __del__(self):
+        # Tips this assessment held leave the table with it
+        self._release()
+
+    def copy(self):
+        """The assessment as a plain dict, e.g. for the assessment store"""
+        return dict(self)
+
+    def __repr__(self):
+        return f'CompactAssessment({dict(self)!r})'
@@ -0,0 +1,404 @@
+"""Recommendation engine shared by the Streamlit app and the HTTP service.
+
+Owns everything behind a recommendation: the OpenAI client stack (rate
+limiter, circuit breaker, retries), precomputed and cached results,
+single-flight coalescing, fallbacks, stored assessments and goal progress.
+Nothing here depends on Streamlit; problems the farmer should hear about are
+passed to a `warn` callback instead of being shown directly.
+"""
+import threading
+import time
+from datetime import datetime
+
+import settings
+from assessment_store import AssessmentStore
+from climate import default_store as default_climate_store, with_climate
+from goals import GOALS, GoalTracker
+from knowledge_index import KnowledgeIndex
+from metrics import counter, histogram, timed
+from precompute import read_artifact
+from recommendation_cache import RecommendationCache, anonymize, personalize, profile_key
+from recommendations import (
+    CATEGORIES, CROP_STAGES, CROPS, PROVINCES, SEASONS, iter_parallel_recommendations, ping,
+    request_ai_recommendations, request_parallel_recommendations, stream_ai_recommendations
+)
+from resilience import CircuitBreaker, ResilientClient
+from response_parser import MalformedResponse, stats as response_stats
+from rules import default_table
+from scheduler import AdvisoryScheduler, watch_artifact
+from throttling import RateLimiter, SingleFlight, ThrottledClient
+
+MODES = ('ai', 'rules-first', 'offline')
+
+# Sources: precomputed, cache, rules (by mode or without an API key), ai, partial (some
+# categories fell back) and fallback (the AI failed outright)
+RECOMMENDATIONS = counter('smart_farming_recommendations_total', "Recommendations served, by source", ('source',))
+RECOMMEND_SECONDS = histogram('smart_farming_recommend_seconds', "Time to serve recommendations, by source", ('source',))
+SAVE_SECONDS = histogram('smart_farming_save_assessment_seconds', "Time to store an assessment and check its goals")
+
+PROFILE_CHOICES = {
+    'province': PROVINCES,
+    'season': SEASONS,
+    'crop_stage': CROP_STAGES,
+    'selected_crop': CROPS,
+}
+
+
+def parse_profile(data):
+    """Validated farmer_data from untrusted input (API requests, CSV rows); raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("profile must be a JSON object")
+    farmer_name = data.get('farmer_name')
+    if not isinstance(farmer_name, str) or not farmer_name.strip():
+        raise ValueError("farmer_name is required")
+    profile = {'farmer_name': farmer_name.strip()}
+    for field, choices in PROFILE_CHOICES.items():
+        if data.get(field) not in choices:
+            raise ValueError(f"{field} must be one of: {', '.join(choices)}")
+        profile[field] = data[field]
+    profile['timestamp'] = datetime.now().isoformat()
+    return profile
+
+
+def _ignore(message):
+    pass
+
+
+def build_openai_client(api_key, api_base=None, limiter=None):
+    """OpenAI behind the rate limiter and circuit breaker"""
+    import openai
+    openai.api_key = api_key
+    if api_base:
+        # e.g. a local stand-in server for load testing
+        openai.api_base = api_base
+    breaker = CircuitBreaker(
+        probe=lambda: ping(openai),
+        failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.BREAKER_RESET_SECONDS
+    )
+    return ResilientClient(
+        ThrottledClient(openai, limiter or RateLimiter(settings.RATE_LIMIT_RPM, settings.RATE_LIMIT_TPM)),
+        breaker,
+        deadline_seconds=settings.REQUEST_DEADLINE_SECONDS,
+        max_attempts=settings.REQUEST_MAX_ATTEMPTS
+    )
+
+
+class RecommendationEngine:
+    """Recommendations, assessments and goals for any front end; safe to share between threads"""
+
+    def __init__(self, client=None, cache=None, store=None, precomputed=None, single_flight=None, limiter=None,
+                 rules=None, mode='ai', climate=None, refreshed=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown recommendation mode {mode!r}; expected one of {', '.join(MODES)}")
+        self.client = client if mode != 'offline' else None
+        self.cache = cache or RecommendationCache()
+        self.store = store or AssessmentStore(':memory:')
+        self.precomputed = precomputed or {}
+        # When each precomputed advisory was generated (epoch seconds)
+        self.refreshed = refreshed or {}
+        self.scheduler = None
+        self.single_flight = single_flight or SingleFlight()
+        self.limiter = limiter
+        self.rules = rules or default_table()
+        self.mode = mode
+        # A store, or a function returning the current one
+        self._climate = climate
+        self._knowledge = None
+        self._knowledge_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, api_key=None, api_base=None, background=True):
+        """Engine wired up from settings.py; without an API key it only serves rule-based advice.
+        With `background`, precomputed advisories are kept fresh by a scheduler or reloaded when changed"""
+        mode = settings.RECOMMENDATION_MODE
+        limiter = RateLimiter(
+            settings.RATE_LIMIT_RPM,
+            settings.RATE_LIMIT_TPM,
+            max_wait_seconds=settings.RATE_LIMIT_MAX_WAIT_SECONDS
+        )
+        precomputed, refreshed = read_artifact(settings.ARTIFACT_PATH)
+        engine = cls(
+            client=build_openai_client(api_key, api_base, limiter) if api_key and mode != 'offline' else None,
+            cache=RecommendationCache(
+                settings.CACHE_PATH,
+                memory_entries=settings.CACHE_MEMORY_ENTRIES,
+                disk_entries=settings.CACHE_DISK_ENTRIES,
+                ttl_seconds=settings.CACHE_TTL_SECONDS
+            ),
+            store=AssessmentStore(settings.ASSESSMENT_DB_PATH, batch_size=settings.ASSESSMENT_BATCH_SIZE),
+            precomputed=precomputed,
+            single_flight=SingleFlight(settings.SINGLE_FLIGHT_WAIT_SECONDS),
+            limiter=limiter,
+            mode=mode,
+            climate=default_climate_store,
+            refreshed=refreshed,
+        )
+        if background and settings.ADVISORY_SCHEDULER and engine.client is not None:
+            AdvisoryScheduler.from_settings(engine).start()
+        elif background:
+            watch_artifact(engine, settings.ARTIFACT_PATH, settings.ARTIFACT_RELOAD_SECONDS)
+        return engine
+
+    @property
+    def climate(self):
+        """Climate store the prompts and weather page use, or None"""
+        return self._climate() if callable(self._climate) else self._climate
+
+    @property
+    def available(self):
+        """Whether new recommendations can currently be requested from OpenAI"""
+        return self.client is not None and self.client.breaker.closed
+
+    def fallback(self, farmer_data):
+        """Advice from the compiled rule base; no network call"""
+        return self.rules.resolve(farmer_data)
+
+    def _cache_key(self, farmer_data):
+        """Cache key for a profile, with the climate data its prompt is built from, so cached
+        answers are not served once the climate store has been re-ingested"""
+        climate = self.climate
+        key = profile_key(farmer_data)
+        return f'{key}|{climate.fingerprint}' if climate is not None else key
+
+    def _lookup(self, farmer_data):
+        """(recommendations, source) if the profile has already been generated, else (None, None)"""
+        recommendations, source = self.precomputed.get(profile_key(farmer_data)), 'precomputed'
+        if recommendations is None:
+            recommendations, source = self.cache.get(self._cache_key(farmer_data)), 'cache'
+        if recommendations is None and self.mode == 'rules-first' and self.rules.is_tailored(farmer_data):
+            # The rule base covers this profile well enough to skip OpenAI
+            return self.fallback(farmer_data), 'rules'
+        if recommendations is None:
+            return None, None
+        return personalize(recommendations, farmer_data['farmer_name']), source
+
+    def lookup(self, farmer_data):
+        """Already generated recommendations for this profile, or None"""
+        return self._lookup(farmer_data)[0]
+
+    def publish(self, precomputed, refreshed):
+        """Serve a new set of precomputed advisories"""
+        self.precomputed, self.refreshed = precomputed, refreshed
+
+    def _requested(self, farmer_data):
+        if self.scheduler is not None:
+            # Demand orders the scheduler's queue; stale advisories are refreshed behind the request
+            self.scheduler.requested(profile_key(farmer_data))
+
+    def upstream_profile(self, farmer_data):
+        """What OpenAI is asked about: the profile without the name, with local climate normals"""
+        return with_climate(anonymize(farmer_data), self.climate)
+
+    def fetch(self, farmer_data):
+        """One upstream generation for a profile; returns (recommendations, {category: error})"""
+        if settings.PARALLEL_CATEGORIES:
+            recommendations, errors = request_parallel_recommendations(
+                self.client, farmer_data, timeout=settings.CATEGORY_TIMEOUT_SECONDS
+            )
+        else:
+            recommendations = request_ai_recommendations(self.client, farmer_data)
+            errors = {
+                category: MalformedResponse(f"AI response has no usable {category}")
+                for category in CATEGORIES if category not in recommendations
+            }
+        if not errors:
+            self.cache.put(self._cache_key(farmer_data), recommendations)
+        return recommendations, errors
+
+    def recommend(self, farmer_data, warn=_ignore):
+        """Recommendations for a profile, falling back per category when OpenAI fails"""
+        return self.recommend_with_source(farmer_data, warn)[0]
+
+    def recommend_with_source(self, farmer_data, warn=_ignore):
+        """(recommendations, where they came from), the source being one of those counted in RECOMMENDATIONS"""
+        started = time.perf_counter()
+        self._requested(farmer_data)
+        recommendations, source = self._recommend(farmer_data, warn)
+        RECOMMENDATIONS.inc(source=source)
+        RECOMMEND_SECONDS.observe(time.perf_counter() - started, source=source)
+        return recommendations, source
+
+    def _recommend(self, farmer_data, warn):
+        # Advice only depends on the profile, so it is generated once per profile
+        # without the farmer's name and personalized on the way out
+        recommendations, source = self._lookup(farmer_data)
+        if recommendations is not None:
+            return recommendations, source
+
+        if not self.client:
+            return self.fallback(farmer_data), 'rules'
+
+        # Identical profiles requested at the same time share one upstream call
+        try:
+            recommendations, errors = self.single_flight.do(
+                profile_key(farmer_data), lambda: self.fetch(self.upstream_profile(farmer_data))
+            )
+        except MalformedResponse:
+            warn("⚠️ AI response was not in correct format. Using fallback recommendations.")
+            return self.fallback(farmer_data), 'fallback'
+        except Exception as e:
+            warn(f"⚠️ Error with AI: {str(e)}. Using fallback recommendations.")
+            return self.fallback(farmer_data), 'fallback'
+
+        recommendations = personalize(recommendations, farmer_data['farmer_name'])
+        if errors:
+            # Keep the categories that worked and only fall back for the rest
+            warn(f"⚠️ AI could not provide {', '.join(errors)}. Using fallback recommendations for those.")
+            fallback = self.fallback(farmer_data)
+            for category in errors:
+                recommendations[category] = fallback[category]
+            return recommendations, 'partial' if len(errors) < len(CATEGORIES) else 'fallback'
+        return recommendations, 'ai'
+
+    def should_stream(self, farmer_data):
+        """Whether a profile would be generated fresh, so it is worth streaming"""
+        return (self.available and self.lookup(farmer_data) is None
+                and not self.single_flight.in_flight(profile_key(farmer_data)))
+
+    def stream(self, farmer_data, warn=_ignore):
+        """Yield (category, tips) as they arrive from OpenAI, filling in fallbacks on failure"""
+        with self.single_flight.lead(profile_key(farmer_data)) as call:
+            if call is None:
+                # Someone else is already generating this profile; share their result
+                recommendations = self.recommend(farmer_data, warn)
+                for category in CATEGORIES:
+                    yield category, recommendations[category]
+                return
+
+            self._requested(farmer_data)
+            if settings.PARALLEL_CATEGORIES:
+                results = iter_parallel_recommendations(
+                    self.client, self.upstream_profile(farmer_data), timeout=settings.CATEGORY_TIMEOUT_SECONDS
+                )
+            else:
+                results = ((category, tips, None) for category, tips in stream_ai_recommendations(self.client, self.upstream_profile(farmer_data)))
+
+            started = time.perf_counter()
+            recommendations = {}
+            errors = {}
+            failed = False
+            try:
+                for category, tips, error in results:
+                    if error is not None:
+                        errors[category] = error
+                        continue
+                    recommendations[category] = tips
+                    yield category, personalize({category: tips}, farmer_data['farmer_name'])[category]
+            except Exception as e:
+                failed = True
+                warn(f"⚠️ Error with AI: {str(e)}. Using fallback recommendations.")
+                for category in CATEGORIES:
+                    if category not in recommendations:
+                        errors.setdefault(category, e)
+            call.result = (recommendations, errors)
+            source = 'ai' if not errors else 'partial' if len(errors) < len(CATEGORIES) else 'fallback'
+            RECOMMENDATIONS.inc(source=source)
+            RECOMMEND_SECONDS.observe(time.perf_counter() - started, source=source)
+
+            if not errors:
+                self.cache.put(self._cache_key(farmer_data), recommendations)
+                return
+            if len(errors) < len(CATEGORIES) and not failed:
+                # A failed stream has already been warned about
+                warn(f"⚠️ AI could not provide {', '.join(errors)}. Using fallback recommendations for those.")
+            fallback = self.fallback(farmer_data)
+            for category in errors:
+                yield category, fallback[category]
+
+    def goal_tracker(self, farmer):
+        """Goal progress for a farmer, seeded from their stored assessments"""
+        return GoalTracker.from_store(self.store, farmer) if farmer else GoalTracker()
+
+    def goals(self, farmer):
+        """Every goal with the farmer's progress towards it"""
+        tracker = self.goal_tracker(farmer)
+        return [
+            dict(goal, progress=tracker.progress(goal), completed=goal['id'] in tracker.completed)
+            for goal in GOALS
+        ]
+
+    @property
+    def knowledge(self):
+        """Search index of community tips and stored recommendations, built on first use"""
+        if self._knowledge is None:
+            with self._knowledge_lock:
+                if self._knowledge is None:
+                    self._knowledge = KnowledgeIndex.build(self.store, settings.COMMUNITY_TIPS_PATH)
+        return self._knowledge
+
+    def record(self, assessment):
+        """Store an assessment and make its tips searchable, without goal tracking"""
+        with self._knowledge_lock:
+            self.store.add(assessment)
+            if self._knowledge is not None:
+                # Not built yet means the build will read it from the store
+                self._knowledge.add_assessment(assessment)
+
+    @timed(SAVE_SECONDS)
+    def save_assessment(self, assessment, tracker=None):
+        """Store a completed assessment; returns the goals it completed"""
+        if tracker is None:
+            tracker = self.goal_tracker(assessment.get('farmer_name'))
+        self.record(assessment)
+        return tracker.record(assessment)
+
+    def history(self, farmer, page=0, page_size=settings.HISTORY_PAGE_SIZE):
+        return self.store.history(farmer, page=page, page_size=page_size)
+
+    def stats(self):
+        """Counters from every layer, for dashboards and health checks"""
+        stats = {
+            'cache': self.cache.stats(),
+            'single_flight': self.single_flight.stats(),
+            'precomputed_profiles': len(self.precomputed),
+            'rules': self.rules.stats(),
+            'mode': self.mode,
+        }
+        if self._knowledge is not None:
+            stats['knowledge'] = self._knowledge.stats()
+        if self.limiter is not None:
+            stats['rate_limiter'] = self.limiter.stats()
+        climate = self.climate
+        if climate is not None:
+            stats['climate'] = climate.stats()
+        if self.scheduler is not None:
+            stats['scheduler'] = self.scheduler.stats()
+        if self.client is not None:
+            stats['breaker'] = self.client.breaker.stats()
+            stats['responses'] = response_stats()
+        return stats
+
+    def metric_families(self):
+        """Counters the engine's parts keep themselves, in the form metrics.render() takes as extra"""
+        stats = self.stats()
+        cache = stats['cache']
+        families = [
+            ('smart_farming_cache_lookups_total', 'counter', "Recommendation cache lookups, by result", [
+                ([('result', 'memory')], cache['hits_memory']),
+                ([('result', 'disk')], cache['hits_disk']),
+                ([('result', 'miss')], cache['misses']),
+            ]),
+            ('smart_farming_coalesced_requests_total', 'counter', "Requests that shared another request's AI call",
+             [([], stats['single_flight']['coalesced'])]),
+        ]
+        if 'breaker' in stats:
+            families.append(('smart_farming_breaker_trips_total', 'counter', "Times the circuit breaker opened",
+                             [([], stats['breaker']['trips'])]))
+            families.append(('smart_farming_breaker_open', 'gauge', "1 while the circuit breaker is open",
+                             [([], int(stats['breaker']['state'] == 'open'))]))
+        if 'scheduler' in stats:
+            families.append(('smart_farming_advisories_refreshed_total', 'counter', "Advisories regenerated in the background",
+                             [([('result', 'ok')], stats['scheduler']['refreshed']),
+                              ([('result', 'failed')], stats['scheduler']['failed'])]))
+            families.append(('smart_farming_advisories_queued', 'gauge', "Advisories waiting to be regenerated",
+                             [([], stats['scheduler']['queued'])]))
+        if 'rate_limiter' in stats:
+            families.append(('smart_farming_rate_limit_queued_total', 'counter', "Requests that waited for rate-limit capacity",
+                             [([], stats['rate_limiter']['queued'])]))
+        return families
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.store.close()
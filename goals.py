@@ -0,0 +1,80 @@
+# Goals are data: each one names a metric, the requirement to reach and, for
+# some metrics, the field or filter it applies to.
+#   count     number of assessments, optionally only those matching `match`
+#   distinct  number of different values seen in `field`
+GOALS = [
+    {'id': 'first_assessment', 'icon': '🎯', 'title': 'First Steps', 'description': 'Complete your first assessment', 'requirement': 1, 'metric': 'count'},
+    {'id': 'five_assessments', 'icon': '📊', 'title': 'Getting Started', 'description': 'Complete 5 assessments', 'requirement': 5, 'metric': 'count'},
+    {'id': 'ten_assessments', 'icon': '🌟', 'title': 'Committed Farmer', 'description': 'Complete 10 assessments', 'requirement': 10, 'metric': 'count'},
+    {'id': 'all_crops', 'icon': '🌾', 'title': 'Crop Explorer', 'description': 'Try all 4 crop types', 'requirement': 4, 'metric': 'distinct', 'field': 'selected_crop'},
+    {'id': 'all_seasons', 'icon': '🔄', 'title': 'Year-Round', 'description': 'Get advice for all 4 seasons', 'requirement': 4, 'metric': 'distinct', 'field': 'season'},
+]
+
+# Fields whose distinct values are always tracked, for the dashboard counters
+TRACKED_FIELDS = ('selected_crop', 'season')
+
+
+def _matches(assessment, match):
+    return all(assessment.get(field) == value for field, value in match.items())
+
+
+class GoalTracker:
+    """Running goal progress, updated in O(1) per recorded assessment"""
+
+    def __init__(self, goals=GOALS):
+        self.goals = goals
+        self.total = 0
+        self.distinct = {field: set() for field in TRACKED_FIELDS}
+        self.matched = {}
+        self.completed = set()
+        for goal in goals:
+            if goal['metric'] == 'distinct':
+                self.distinct.setdefault(goal['field'], set())
+            elif goal['metric'] == 'count' and goal.get('match'):
+                self.matched[goal['id']] = 0
+            elif goal['metric'] != 'count':
+                raise ValueError(f"unknown goal metric: {goal['metric']}")
+
+    @classmethod
+    def from_store(cls, store, farmer, goals=GOALS):
+        """Tracker seeded from the farmer's stored history using aggregate queries"""
+        tracker = cls(goals)
+        tracker.total = store.count(farmer)
+        for field in tracker.distinct:
+            tracker.distinct[field] = store.distinct_values(field, farmer)
+        for goal in goals:
+            if goal['id'] in tracker.matched:
+                tracker.matched[goal['id']] = store.count(farmer, **goal['match'])
+        tracker._update_completed()
+        return tracker
+
+    def value(self, goal):
+        """Current value of a goal's metric"""
+        if goal['metric'] == 'distinct':
+            return len(self.distinct[goal['field']])
+        if goal.get('match'):
+            return self.matched[goal['id']]
+        return self.total
+
+    def progress(self, goal):
+        """Progress towards a goal, capped at its requirement"""
+        return min(self.value(goal), goal['requirement'])
+
+    def _update_completed(self):
+        newly_completed = []
+        for goal in self.goals:
+            if goal['id'] not in self.completed and self.value(goal) >= goal['requirement']:
+                self.completed.add(goal['id'])
+                newly_completed.append(goal)
+        return newly_completed
+
+    def record(self, assessment):
+        """Count a new assessment; returns the goals it completed"""
+        self.total += 1
+        for field, values in self.distinct.items():
+            if assessment.get(field):
+                values.add(assessment[field])
+        for goal in self.goals:
+            if goal['id'] in self.matched and _matches(assessment, goal['match']):
+                self.matched[goal['id']] += 1
+        return self._update_completed()
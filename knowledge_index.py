@@ -0,0 +1,395 @@
+"""Search over community tips and every recommendation tip ever given.
+
+Each distinct tip (per category, province, crop and season) is one document
+in an in-memory inverted index; the same tip recommended again only bumps
+its count. Postings are NumPy arrays that grow in place, so indexing a saved
+assessment costs a few appends.
+
+Queries are ranked with BM25. Short postings lists are scored outright. Long
+ones (common words such as "soil") also keep a copy sorted by each
+document's BM25 weight, and are read from the top down, a few hundred
+entries at a time, until no unread document could still make the top
+results (Fagin's threshold algorithm). Documents added since that copy was
+sorted are always scored, and the copy is re-sorted once they pile up, so
+results stay exact while most queries touch a tiny part of the index. When
+the top would lie deep in the lists, as with several very common words or
+very selective filters, the lists are summed in full into one dense score
+array instead.
+Browsing without a query works the same way over documents ordered by how
+often each tip has been given.
+"""
+import functools
+import json
+import math
+import re
+import threading
+from array import array
+
+import numpy as np
+
+from recommendation_cache import depersonalize
+from recommendations import CATEGORIES, CROPS, PROVINCES, SEASONS
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Postings lists up to this long are scored in full
+SHORT_POSTINGS = 8192
+
+# Re-sort a long postings list when this share of it arrived after the last sort
+RESORT_SHARE = 0.2
+
+# Entries read from each sorted list per round, per result asked for; each round reads four times more
+DEPTH_PER_RESULT = 32
+
+# Past this depth (flat scores or very selective filters), score the whole postings lists instead
+MAX_DEPTH = 65536
+
+# Facet -> values; a document stores 0 for "not known", else index + 1
+FACETS = {'province': PROVINCES, 'crop': CROPS, 'season': SEASONS}
+
+STOPWORDS = frozenset(
+    'a an and are as at be before by for from has have in into is it its of on or that the their this '
+    'to was were will with your you'.split()
+)
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords, with plural -s dropped so "pests" finds "pest" """
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _bm25_weight(tfs, lengths, average_length):
+    tfs = tfs.astype(np.float32)
+    return tfs * (K1 + 1) / (tfs + K1 * (1 - B + B * lengths / average_length))
+
+
+class _Column:
+    """A NumPy array that can be appended to in amortized O(1)"""
+
+    def __init__(self, dtype, capacity=4):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = np.empty(max(needed, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def view(self):
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+
+class _Postings:
+    """Doc ids (ascending) and term frequencies for one term, plus the weight-sorted copy"""
+
+    def __init__(self):
+        self.ids = _Column(np.int32)
+        self.tfs = _Column(np.uint16)
+        self.sorted_ids = None
+        self.sorted_weights = None
+        self.sorted_count = 0  # postings covered by the sorted copy
+        self.average_length = None  # BM25 length normalization the weights were computed with
+
+    def __len__(self):
+        return len(self.ids)
+
+    def weights(self, docs, lengths):
+        """This term's BM25 weight in each of `docs` (0 where it doesn't occur)"""
+        ids = self.ids.view()
+        positions = np.minimum(np.searchsorted(ids, docs), len(ids) - 1)
+        present = ids[positions] == docs
+        weights = np.zeros(len(docs), dtype=np.float32)
+        weights[present] = _bm25_weight(self.tfs.view()[positions[present]], lengths[docs[present]],
+                                        self.average_length)
+        return weights
+
+
+class KnowledgeIndex:
+    """Inverted index of tips with BM25 ranking and province/crop/season facets"""
+
+    def __init__(self):
+        self.texts = []
+        self.sources = []
+        self._doc_ids = {}  # (text, category, province, crop, season) -> doc id
+        self._categories = _Column(np.uint8)
+        self._facets = {facet: _Column(np.uint8) for facet in FACETS}
+        self._counts = _Column(np.int32)
+        self._lengths = _Column(np.uint16)
+        self._total_length = 0
+        self._terms = {}  # term -> _Postings
+        self.tips = 0
+        # Documents by count, and those added or given again since it was sorted
+        self._popular = None
+        self._changed = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def _code(facet, value):
+        values = FACETS[facet]
+        return values.index(value) + 1 if value in values else 0
+
+    def add_tips(self, tips):
+        """Index tips given as dicts with text and optionally category, province, crop, season,
+        source and count; returns how many were new documents"""
+        with self._lock:
+            new_docs = []
+            postings = {}
+            bumped = {}
+            for tip in tips:
+                text = ' '.join(str(tip['text']).split())
+                if not text:
+                    continue
+                count = int(tip.get('count', 1))
+                self.tips += count
+                key = (text, tip.get('category'), tip.get('province'), tip.get('crop'), tip.get('season'))
+                doc = self._doc_ids.get(key)
+                if doc is not None:
+                    bumped[doc] = bumped.get(doc, 0) + count
+                    continue
+                doc = self._doc_ids[key] = len(self.texts) + len(new_docs)
+                tokens = tokenize(text)
+                new_docs.append((key, tip.get('source', 'assessment'), count, len(tokens)))
+                frequencies = {}
+                for token in tokens:
+                    frequencies[token] = frequencies.get(token, 0) + 1
+                for token, tf in frequencies.items():
+                    ids, tfs = postings.setdefault(token, (array('i'), array('H')))
+                    ids.append(doc)
+                    tfs.append(tf)
+
+            first_new = len(self.texts)
+            for key, source, _, _ in new_docs:
+                self.texts.append(key[0])
+                self.sources.append(source)
+            if new_docs:
+                self._categories.extend([CATEGORIES.index(key[1]) + 1 if key[1] in CATEGORIES else 0 for key, *_ in new_docs])
+                for position, facet in enumerate(FACETS, start=2):
+                    self._facets[facet].extend([self._code(facet, key[position]) for key, *_ in new_docs])
+                self._counts.extend([count for _, _, count, _ in new_docs])
+                self._lengths.extend([min(length, 65535) for *_, length in new_docs])
+                self._total_length += sum(length for *_, length in new_docs)
+            for token, (ids, tfs) in postings.items():
+                if token not in self._terms:
+                    self._terms[token] = _Postings()
+                self._terms[token].ids.extend(ids)
+                self._terms[token].tfs.extend(tfs)
+            if bumped:
+                counts = self._counts.view()
+                for doc, count in bumped.items():
+                    counts[doc] += count
+            if self._popular is not None:
+                self._changed.update(range(first_new, len(self.texts)))
+                self._changed.update(bumped)
+            return len(new_docs)
+
+    def add_assessment(self, assessment):
+        """Index every tip of a saved assessment, with the farmer's name taken back out"""
+        name = assessment.get('farmer_name')
+        tips = []
+        for category, category_tips in (assessment.get('recommendations') or {}).items():
+            if not isinstance(category_tips, list):
+                continue
+            for text in category_tips:
+                tips.append({
+                    'text': depersonalize(str(text), name),
+                    'category': category,
+                    'province': assessment.get('province'),
+                    'crop': assessment.get('selected_crop'),
+                    'season': assessment.get('season'),
+                })
+        return self.add_tips(tips)
+
+    def _keep(self, docs, filters):
+        """Mask of `docs` matching every (column, code) filter"""
+        keep = np.ones(len(docs), dtype=bool)
+        for column, code in filters:
+            keep &= column.view()[docs] == code
+        return keep
+
+    def _sorted(self, postings):
+        """Bring a long postings list's weight-sorted copy up to date if too much is missing from it"""
+        unsorted = len(postings) - postings.sorted_count
+        if postings.sorted_ids is None or unsorted > RESORT_SHARE * len(postings):
+            ids = postings.ids.view()
+            postings.average_length = self._total_length / len(self.texts) or 1.0
+            weights = _bm25_weight(postings.tfs.view(), self._lengths.view()[ids], postings.average_length)
+            order = np.argsort(-weights, kind='stable')
+            postings.sorted_ids = ids[order]
+            postings.sorted_weights = weights[order]
+            postings.sorted_count = len(ids)
+        return postings
+
+    def _rank_terms(self, terms, filters, limit):
+        """(doc ids, BM25 scores) of every document that could be in the top `limit`"""
+        doc_count = len(self.texts)
+        lengths = self._lengths.view()
+        average_length = self._total_length / doc_count or 1.0
+        short, long = [], []
+        for term in terms:
+            postings = self._terms.get(term)
+            if postings is not None:
+                (short if len(postings) <= SHORT_POSTINGS else long).append(postings)
+        if not short and not long:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        for postings in short:
+            postings.average_length = average_length
+        long = [self._sorted(postings) for postings in long]
+        idf = {
+            id(postings): math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for postings in short + long
+        }
+
+        # Every document of a short list, and every one a long list got since its sort, is scored
+        always = [postings.ids.view() for postings in short]
+        always += [postings.ids.view()[postings.sorted_count:] for postings in long]
+        depth = max(DEPTH_PER_RESULT * limit, 256)
+        while True:
+            if depth >= MAX_DEPTH:
+                return self._score_all(short + long, idf, filters, limit)
+            heads = [postings.sorted_ids[:depth] for postings in long]
+            parts = [part[self._keep(part, filters)] for part in always + heads] if filters else always + heads
+            docs = np.unique(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+            scores = np.zeros(len(docs), dtype=np.float32)
+            for postings in short + long:
+                scores += idf[id(postings)] * postings.weights(docs, lengths)
+            if all(depth >= postings.sorted_count for postings in long):
+                return docs, scores
+            # No unread document can score more than the weights at the current depth
+            bound = sum(idf[id(postings)] * postings.sorted_weights[depth] for postings in long
+                        if depth < postings.sorted_count)
+            if len(docs) >= limit and np.partition(scores, len(scores) - limit)[len(scores) - limit] >= bound:
+                return docs, scores
+            depth *= 4
+
+    def _score_all(self, postings_lists, idf, filters, limit):
+        """(doc ids, BM25 scores) of every document that could be in the top `limit`,
+        from whole postings lists summed into one dense array"""
+        lengths = self._lengths.view()
+        totals = np.zeros(len(self.texts), dtype=np.float32)
+        for postings in postings_lists:
+            ids, tfs = postings.ids.view(), postings.tfs.view()
+            if filters:
+                keep = self._keep(ids, filters)
+                ids, tfs = ids[keep], tfs[keep]
+            # Doc ids are unique within a list, so each weight is added once
+            totals[ids] += idf[id(postings)] * _bm25_weight(tfs, lengths[ids], postings.average_length)
+        docs = np.flatnonzero(totals).astype(np.int32)
+        scores = totals[docs]
+        if len(docs) > limit:
+            # Everything tied with the last of the top `limit` stays, for search() to order
+            top = scores >= np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            docs, scores = docs[top], scores[top]
+        return docs, scores
+
+    def _rank_popular(self, filters, limit):
+        """(doc ids, counts) of every document that could be among the `limit` most given"""
+        counts = self._counts.view()
+        if self._popular is None or len(self._changed) > max(1024, RESORT_SHARE * len(self.texts)):
+            self._popular = np.argsort(-counts, kind='stable').astype(np.int32)
+            self._changed = set()
+        changed = np.fromiter(self._changed, dtype=np.int32, count=len(self._changed))
+        found = [changed[self._keep(changed, filters)]]
+        needed = limit
+        block = max(DEPTH_PER_RESULT * limit, 256)
+        start = 0
+        # Unchanged documents keep their sorted place, so the first `limit` that pass the filters
+        # beat every later one
+        while needed > 0 and start < len(self._popular):
+            docs = self._popular[start:start + block]
+            docs = docs[self._keep(docs, filters) & ~np.isin(docs, changed)]
+            found.append(docs[:needed])
+            needed -= len(found[-1])
+            start += block
+            block *= 4
+        docs = np.concatenate(found)
+        return docs, counts[docs].astype(np.float32)
+
+    def search(self, query='', province=None, crop=None, season=None, category=None, limit=10):
+        """Best matching tips, as dicts with text, category, province, crop, season, source,
+        count and score; without a query, the most often given tips for the facets"""
+        filters = [
+            (self._facets[facet], self._code(facet, value))
+            for facet, value in (('province', province), ('crop', crop), ('season', season)) if value
+        ]
+        if category:
+            filters.append((self._categories, CATEGORIES.index(category) + 1 if category in CATEGORIES else 0))
+        terms = list(dict.fromkeys(tokenize(query or '')))
+        with self._lock:
+            if not self.texts:
+                return []
+            if terms:
+                docs, scores = self._rank_terms(terms, filters, limit)
+            else:
+                docs, scores = self._rank_popular(filters, limit)
+            counts = self._counts.view()
+            if len(docs) > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+                docs, scores = docs[top], scores[top]
+            # Ties go to the tip given more often, then the older one
+            order = np.lexsort((docs, -counts[docs], -scores))
+            categories = self._categories.view()
+            results = []
+            for doc, score in zip(docs[order].tolist(), scores[order].tolist()):
+                result = {
+                    'text': self.texts[doc],
+                    'source': self.sources[doc],
+                    'count': int(counts[doc]),
+                    'score': round(score, 4),
+                    'category': CATEGORIES[categories[doc] - 1] if categories[doc] else None,
+                }
+                for facet, values in FACETS.items():
+                    code = self._facets[facet].view()[doc]
+                    result[facet] = values[code - 1] if code else None
+                results.append(result)
+            return results
+
+    def stats(self):
+        return {'documents': len(self.texts), 'tips': self.tips, 'terms': len(self._terms)}
+
+    @classmethod
+    def build(cls, store=None, community_path=None):
+        """Index of the community tips file plus every assessment in `store`"""
+        index = cls()
+        if community_path:
+            index.add_tips(load_community_tips(community_path))
+        if store is not None:
+            for assessment in store.iter_assessments():
+                index.add_assessment(assessment)
+        # Sort the long postings lists now rather than in the first searches that use them
+        for postings in index._terms.values():
+            if len(postings) > SHORT_POSTINGS:
+                index._sorted(postings)
+        return index
+
+
+@functools.lru_cache(maxsize=None)
+def load_community_tips(path):
+    """Community tips from a JSON list of {text, province, category, ...}"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            tips = json.load(f)
+    except FileNotFoundError:
+        return ()
+    return tuple(dict(tip, source='community') for tip in tips)
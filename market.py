@@ -0,0 +1,332 @@
+"""Commodity price history with rolling analytics for the market page.
+
+    python market.py ingest prices.csv
+    python market.py ingest 32100077.csv --geo Canada
+    python market.py show Wheat
+
+Each crop's prices are an append-only binary file of (day, price) records
+under settings.MARKET_DIR. Ingesting a CSV only appends ticks newer than the
+last one stored, so the same export can be loaded again as it grows. Moving
+averages, weekly and monthly change and volatility are kept in rolling
+windows that each new tick updates in constant time; on startup they are
+rebuilt from the last few months of ticks rather than the whole history.
+Charts read a fixed number of evenly spaced ticks from the memory-mapped
+file, so a 20-year chart costs the same as a one-year one.
+"""
+import argparse
+import csv
+import math
+import os
+import sys
+import threading
+from collections import deque
+from datetime import date, datetime
+
+import numpy as np
+
+import settings
+from recommendations import CROPS
+
+# One record per tick: days since 1970-01-01 and the price in $/tonne
+TICK = np.dtype([('day', '<i4'), ('price', '<f8')])
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+WEEK_DAYS = 7
+# Four weeks, so monthly series compare consecutive months
+MONTH_DAYS = 28
+MOVING_AVERAGE_DAYS = (7, 28, 91)
+
+# Running sums are recomputed after this many pushes (still O(1) amortized)
+RESUM_EVERY = 1024
+
+# Accepted CSV headers for each field, compared lowercased; StatCan's farm
+# product price tables use REF_DATE, GEO, "Farm products" and VALUE
+COLUMN_ALIASES = {
+    'date': ('date', 'ref_date'),
+    'crop': ('crop', 'commodity', 'farm products'),
+    'price': ('price', 'value'),
+    'geo': ('geo', 'region'),
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m')
+
+
+def to_day(value):
+    """Days since 1970-01-01 for a date"""
+    return value.toordinal() - _EPOCH
+
+
+def from_day(day):
+    return date.fromordinal(int(day) + _EPOCH)
+
+
+def match_crop(value):
+    """The crop a commodity name refers to ("Canola (including rapeseed)" -> Canola), or None"""
+    value = (value or '').lower()
+    for crop in CROPS:
+        if value.startswith(crop.lower()):
+            return crop
+    return None
+
+
+def _parse_date(value):
+    value = (value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+class RollingWindow:
+    """Values from the last `days` days with running sums; each push is O(1) amortized.
+
+    `before` is the newest tick that has dropped out of the window, i.e. the
+    latest value at least `days` old.
+    """
+
+    def __init__(self, days):
+        self.days = days
+        self.items = deque()
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.before = None
+        self._pushes = 0
+
+    def push(self, day, value):
+        self.items.append((day, value))
+        self.sum += value
+        self.sumsq += value * value
+        while self.items[0][0] <= day - self.days:
+            self.before = self.items.popleft()
+            self.sum -= self.before[1]
+            self.sumsq -= self.before[1] * self.before[1]
+        self._pushes += 1
+        if self._pushes % RESUM_EVERY == 0:
+            # Re-add from scratch now and then so rounding errors can't build up over years of ticks
+            self.sum = math.fsum(value for _, value in self.items)
+            self.sumsq = math.fsum(value * value for _, value in self.items)
+
+    @property
+    def count(self):
+        return len(self.items)
+
+    def mean(self):
+        return self.sum / len(self.items) if self.items else None
+
+    def std(self):
+        n = len(self.items)
+        if n < 2:
+            return None
+        return math.sqrt(max(self.sumsq - self.sum * self.sum / n, 0.0) / (n - 1))
+
+
+class PriceSeries:
+    """Rolling aggregates for one crop's ticks, fed in date order"""
+
+    def __init__(self):
+        self.last = None  # (day, price)
+        self.averages = {days: RollingWindow(days) for days in MOVING_AVERAGE_DAYS}
+        self.week = RollingWindow(WEEK_DAYS)
+        self.month = RollingWindow(MONTH_DAYS)
+        # Log returns scaled to one day, so irregular ticks can share a volatility
+        self.returns = RollingWindow(MONTH_DAYS)
+        # How many of the stored ticks have been pushed
+        self.stored = 0
+
+    def push(self, day, price):
+        if self.last is not None:
+            gap = day - self.last[0]
+            self.returns.push(day, math.log(price / self.last[1]) / math.sqrt(gap))
+        for window in self.averages.values():
+            window.push(day, price)
+        self.week.push(day, price)
+        self.month.push(day, price)
+        self.last = (day, price)
+
+    def _change(self, window):
+        # Compare with the price one window ago, unless the series skipped a whole window since
+        if self.last is None or window.before is None or window.before[0] < self.last[0] - 2 * window.days:
+            return None
+        return self.last[1] / window.before[1] - 1
+
+    def snapshot(self):
+        if self.last is None:
+            return None
+        daily_volatility = self.returns.std()
+        return {
+            'date': from_day(self.last[0]),
+            'price': self.last[1],
+            'change_week': self._change(self.week),
+            'change_month': self._change(self.month),
+            'moving_averages': {days: window.mean() for days, window in self.averages.items()},
+            # Annualized, as is usual for commodity prices
+            'volatility': daily_volatility * math.sqrt(365) if daily_volatility is not None else None,
+        }
+
+
+class MarketStore:
+    """Append-only price files for every crop, with live rolling aggregates"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._series = {}
+        self._sizes = {}
+        self._ticks = {}
+        self._lock = threading.RLock()
+
+    def path(self, crop):
+        return os.path.join(self.directory, f'{crop.lower()}.prices')
+
+    def _ticks_on_disk(self, crop):
+        """The crop's ticks, memory-mapped; reopened only when the file has grown"""
+        try:
+            size = os.path.getsize(self.path(crop))
+        except OSError:
+            size = 0
+        size -= size % TICK.itemsize  # ignore a record torn by an interrupted append
+        if self._sizes.get(crop) != size:
+            self._ticks[crop] = (
+                np.memmap(self.path(crop), dtype=TICK, mode='r', shape=(size // TICK.itemsize,)) if size
+                else np.zeros(0, dtype=TICK)
+            )
+            self._sizes[crop] = size
+        return self._ticks[crop]
+
+    def series(self, crop):
+        """Rolling aggregates for a crop, caught up with anything appended since the last call"""
+        with self._lock:
+            ticks = self._ticks_on_disk(crop)
+            series = self._series.get(crop)
+            if series is None:
+                series = self._series[crop] = PriceSeries()
+                if len(ticks):
+                    # Only the last few months matter to the windows; the two ticks before
+                    # them give the oldest return and the oldest change reference
+                    start = int(np.searchsorted(ticks['day'], ticks['day'][-1] - max(MOVING_AVERAGE_DAYS), 'right'))
+                    tail = ticks[max(start - 2, 0):]
+                    for day, price in zip(tail['day'].tolist(), tail['price'].tolist()):
+                        series.push(day, price)
+                series.stored = len(ticks)
+            elif series.stored < len(ticks):
+                # Appended by another process (e.g. the ingest CLI)
+                new = ticks[series.stored:]
+                for day, price in zip(new['day'].tolist(), new['price'].tolist()):
+                    series.push(day, price)
+                series.stored = len(ticks)
+            return series
+
+    def append(self, crop, ticks):
+        """Append (date, price) ticks newer than the last stored one; returns how many were added"""
+        with self._lock:
+            series = self.series(crop)
+            last_day = series.last[0] if series.last else None
+            records = []
+            for day, price in sorted((to_day(d), float(p)) for d, p in ticks):
+                if price <= 0 or (last_day is not None and day <= last_day):
+                    continue
+                records.append((day, price))
+                last_day = day
+            if not records:
+                return 0
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(crop), 'ab') as f:
+                f.write(np.array(records, dtype=TICK).tobytes())
+            for day, price in records:
+                series.push(day, price)
+            series.stored += len(records)
+        return len(records)
+
+    def ingest_csv(self, lines, geo=None):
+        """Append the new ticks in a price CSV; returns {crop: ticks added}"""
+        reader = csv.DictReader(lines)
+        if reader.fieldnames is None:
+            return {}
+        lowered = {name.strip().lower(): name for name in reader.fieldnames}
+        names = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in lowered:
+                    names[field] = lowered[alias]
+                    break
+        missing = [field for field in ('date', 'crop', 'price') if field not in names]
+        if missing:
+            raise ValueError(f"CSV is missing column(s): {', '.join(missing)}")
+        if geo is not None and 'geo' not in names:
+            raise ValueError("CSV has no GEO column to filter on")
+
+        by_crop = {}
+        for row in reader:
+            if geo is not None and row[names['geo']].strip() != geo:
+                continue
+            crop = match_crop(row[names['crop']])
+            day = _parse_date(row[names['date']])
+            try:
+                price = float(row[names['price']])
+            except (TypeError, ValueError):
+                continue
+            if crop is not None and day is not None:
+                # A later row for the same day replaces an earlier one
+                by_crop.setdefault(crop, {})[day] = price
+        return {crop: self.append(crop, ticks.items()) for crop, ticks in by_crop.items()}
+
+    def snapshot(self, crop):
+        """Latest price and rolling aggregates for a crop, or None without history"""
+        return self.series(crop).snapshot()
+
+    def chart(self, crop, since=None, points=400):
+        """(dates, prices) for charting: at most `points` evenly spaced ticks from `since` on,
+        always including the latest; reads only those ticks from disk"""
+        with self._lock:
+            ticks = self._ticks_on_disk(crop)
+        start = int(np.searchsorted(ticks['day'], to_day(since))) if since is not None and len(ticks) else 0
+        count = len(ticks) - start
+        if count <= 0:
+            return np.zeros(0, dtype='datetime64[D]'), np.zeros(0)
+        index = np.unique(np.linspace(start, len(ticks) - 1, min(points, count)).round().astype(int))
+        sample = ticks[index]
+        return sample['day'].astype('datetime64[D]'), np.asarray(sample['price'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and inspect commodity price history")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="append new prices from CSV files")
+    ingest_parser.add_argument('files', nargs='+', help="CSV files with date, crop and price columns")
+    ingest_parser.add_argument('--geo', help="only rows with this GEO value (e.g. Canada)")
+    show_parser = commands.add_parser('show', help="print the latest price and rolling aggregates")
+    show_parser.add_argument('crops', nargs='*', default=CROPS)
+    parser.add_argument('--store', default=settings.MARKET_DIR, help="store directory")
+    args = parser.parse_args(argv)
+    store = MarketStore(args.store)
+
+    if args.command == 'ingest':
+        for path in args.files:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                try:
+                    added = store.ingest_csv(f, geo=args.geo)
+                except ValueError as e:
+                    parser.error(f"{path}: {e}")
+            print(f"{path}: " + (', '.join(f"{crop} +{n}" for crop, n in added.items()) or "no prices"))
+        return 0
+
+    for crop in args.crops:
+        snapshot = store.snapshot(crop)
+        if snapshot is None:
+            print(f"{crop}: no prices")
+            continue
+        fields = [f"${snapshot['price']:,.2f}/tonne on {snapshot['date']}"]
+        for label, key in (('week', 'change_week'), ('month', 'change_month')):
+            if snapshot[key] is not None:
+                fields.append(f"{label} {snapshot[key]:+.1%}")
+        fields += [f"{days}d avg ${value:,.2f}" for days, value in snapshot['moving_averages'].items()]
+        if snapshot['volatility'] is not None:
+            fields.append(f"volatility {snapshot['volatility']:.1%}")
+        print(f"{crop}: " + ', '.join(fields))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Counters, histograms and timers for the recommendation flow, exported as Prometheus text.
+
+    REQUESTS = counter('smart_farming_openai_requests_total', "OpenAI calls", ('call',))
+    LATENCY = histogram('smart_farming_openai_request_seconds', "OpenAI call latency", ('call',))
+
+    REQUESTS.inc(call='full')
+    with LATENCY.time(call='full'):
+        ...
+    @timed(LATENCY, call='full')
+    def ...
+
+Metrics live in one registry per process; declaring a name again returns
+the existing metric, so a module that is re-executed (like app.py on every
+Streamlit rerun) keeps its counts. render() produces the text format that
+service.py serves at /metrics and write_textfile() saves for node_exporter's
+textfile collector. Numbers that other objects already keep, such as cache
+hits, are passed to render() as extra families rather than counted twice.
+
+With SMART_FARMING_METRICS off, every update returns straight away and
+timed() hands back the function undecorated.
+"""
+import bisect
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+import settings
+
+ENABLED = settings.METRICS_ENABLED
+
+# Seconds; from a cache hit to an OpenAI call that nearly hit its deadline
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_last_write = 0.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labels) or '(none)'}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+
+class Counter(_Metric):
+    """A count that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        """Sum over every label combination"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(list(zip(self.labels, key)), value) for key, value in sorted(self._values.items())]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one past every bound), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing how long its block took, in seconds"""
+        return _Timer(self, labels) if ENABLED else nullcontext()
+
+    def summary(self, **labels):
+        """count, mean and estimated p50/p95 for one label combination, or None before any observation"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if entry is None:
+                return None
+            counts, total, count = list(entry[0]), entry[1], entry[2]
+        return {
+            'count': count,
+            'mean': total / count,
+            'p50': self._quantile(counts, count, 0.5),
+            'p95': self._quantile(counts, count, 0.95),
+        }
+
+    def _quantile(self, counts, count, q):
+        """Linear interpolation within the bucket holding the q-th observation, as Prometheus does"""
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return 0.0
+
+    def samples(self):
+        """(labels, per-bucket counts, sum, count) for every label combination"""
+        with self._lock:
+            return [(list(zip(self.labels, key)), list(entry[0]), entry[1], entry[2])
+                    for key, entry in sorted(self._values.items())]
+
+
+def _declare(cls, name, help, labels, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+            raise ValueError(f"metric {name} is already declared differently")
+        return metric
+
+
+def counter(name, help, labels=()):
+    return _declare(Counter, name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _declare(Histogram, name, help, labels, buckets=buckets)
+
+
+def timed(histogram, **labels):
+    """Decorator observing each call's duration; a no-op when metrics are off"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(histogram, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def metrics():
+    """Every declared metric, by name"""
+    with _registry_lock:
+        return dict(sorted(_registry.items()))
+
+
+def render(extra=()):
+    """Prometheus text exposition of every metric, plus `extra` families given as
+    (name, kind, help, [(label pairs, value), ...])"""
+    lines = []
+    for metric in metrics().values():
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if metric.kind == 'counter':
+            for pairs, value in metric.samples():
+                lines.append(f'{metric.name}{_label_text(pairs)} {_number(value)}')
+            continue
+        for pairs, counts, total, count in metric.samples():
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f'{metric.name}_bucket{_label_text(pairs + [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{metric.name}_sum{_label_text(pairs)} {_number(total)}')
+            lines.append(f'{metric.name}_count{_label_text(pairs)} {count}')
+    for name, kind, help, samples in extra:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for pairs, value in samples:
+            lines.append(f'{name}{_label_text(pairs)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, extra=()):
+    """Write render() to `path` atomically, so a scraper never reads half a file"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render(extra))
+    os.replace(tmp_path, path)
+
+
+def maybe_write_textfile(path, interval, extra=lambda: ()):
+    """write_textfile() if `interval` seconds have passed since the last write; `extra` is called only then"""
+    global _last_write
+    now = time.monotonic()
+    with _registry_lock:
+        if _last_write and now - _last_write < interval:
+            return False
+        _last_write = now
+    write_textfile(path, extra())
+    return True
@@ -0,0 +1,208 @@
+"""Generate recommendations for every profile ahead of time.
+
+    python precompute.py --workers 4
+
+Finished profiles are appended to a checkpoint file as they complete, so an
+interrupted run picks up where it stopped. Once every profile is done the
+checkpoint is compiled into a versioned artifact that the app loads at startup.
+"""
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import settings
+from climate import default_store as default_climate_store, with_climate
+from recommendation_cache import anonymize, profile_key
+from recommendations import CATEGORIES, MODEL, all_profiles, build_prompt, request_ai_recommendations
+from response_parser import MalformedResponse
+
+# Bump when the artifact layout changes
+ARTIFACT_VERSION = 1
+
+
+def prompt_fingerprint():
+    """Short hash of the prompt template and climate data, so artifacts go stale when either changes"""
+    climate = default_climate_store()
+    return _prompt_fingerprint(climate.fingerprint if climate is not None else '')
+
+
+@functools.lru_cache(maxsize=None)
+def _prompt_fingerprint(climate_fingerprint):
+    sample = anonymize({'province': '{province}', 'season': '{season}',
+                        'crop_stage': '{crop_stage}', 'selected_crop': '{crop}'})
+    return hashlib.sha256((MODEL + build_prompt(sample) + climate_fingerprint).encode('utf-8')).hexdigest()[:16]
+
+
+def checkpoint_path(artifact_path):
+    return artifact_path + '.partial.jsonl'
+
+
+def read_checkpoint(path):
+    """Recommendations already generated by an earlier (possibly interrupted) run"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write leaves a torn last line
+                continue
+            if entry.get('prompt') == prompt_fingerprint():
+                done[entry['key']] = entry['recommendations']
+    return done
+
+
+def write_artifact(path, entries, refreshed=None):
+    """Write entries as a gzipped JSON artifact with a shared tip table; `refreshed` maps keys to
+    when they were generated (epoch seconds), defaulting to now"""
+    tips = []
+    tip_ids = {}
+    packed = {}
+    for key, recommendations in entries.items():
+        row = []
+        for category in CATEGORIES:
+            ids = []
+            for tip in recommendations.get(category, []):
+                if tip not in tip_ids:
+                    tip_ids[tip] = len(tips)
+                    tips.append(tip)
+                ids.append(tip_ids[tip])
+            row.append(ids)
+        packed[key] = row
+
+    generated_at = datetime.now()
+    refreshed = refreshed or {}
+    artifact = {
+        'version': ARTIFACT_VERSION,
+        'prompt': prompt_fingerprint(),
+        'generated_at': generated_at.isoformat(),
+        'categories': CATEGORIES,
+        'tips': tips,
+        'entries': packed,
+        'refreshed': {
+            key: datetime.fromtimestamp(refreshed[key]).isoformat() if key in refreshed else generated_at.isoformat()
+            for key in packed
+        },
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Unique per process, so the scheduler and a manual run never share a temp file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(artifact, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def read_artifact(path):
+    """(recommendations by profile key, when each was generated in epoch seconds); empty if missing
+    or made with another prompt"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            artifact = json.load(f)
+    except (OSError, ValueError):
+        return {}, {}
+    if artifact.get('version') != ARTIFACT_VERSION or artifact.get('prompt') != prompt_fingerprint():
+        return {}, {}
+
+    tips = artifact['tips']
+    categories = artifact['categories']
+    entries = {
+        key: {category: [tips[i] for i in ids] for category, ids in zip(categories, row)}
+        for key, row in artifact['entries'].items()
+    }
+    # Artifacts written before per-profile times were kept date from the whole run
+    refreshed = artifact.get('refreshed', {})
+    return entries, {
+        key: datetime.fromisoformat(refreshed.get(key, artifact['generated_at'])).timestamp() for key in entries
+    }
+
+
+def load_api_key():
+    """OpenAI key from the environment, falling back to Streamlit's secrets.toml"""
+    if os.environ.get('OPENAI_API_KEY'):
+        return os.environ['OPENAI_API_KEY']
+    secrets_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.streamlit', 'secrets.toml')
+    if os.path.exists(secrets_path):
+        import tomllib
+        with open(secrets_path, 'rb') as f:
+            return tomllib.load(f).get('OPENAI_API_KEY')
+    return None
+
+
+def generate_profile(client, farmer_data):
+    """Recommendations for one profile; a partial answer fails so the next run retries it"""
+    recommendations = request_ai_recommendations(client, farmer_data)
+    missing = [category for category in CATEGORIES if category not in recommendations]
+    if missing:
+        raise MalformedResponse(f"AI response has no usable {', '.join(missing)}")
+    return recommendations
+
+
+def precompute(client, artifact_path, workers=4, limit=None, log=print):
+    """Generate every missing profile with bounded concurrency, then write the artifact"""
+    partial_path = checkpoint_path(artifact_path)
+    done = read_checkpoint(partial_path)
+    pending = [p for p in all_profiles() if profile_key(p) not in done]
+    if limit is not None:
+        pending = pending[:limit]
+    log(f"{len(done)} profiles already done, {len(pending)} to generate")
+    climate = default_climate_store()
+
+    failures = 0
+    started = time.time()
+    os.makedirs(os.path.dirname(os.path.abspath(partial_path)), exist_ok=True)
+    with open(partial_path, 'a', encoding='utf-8') as checkpoint, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(generate_profile, client, with_climate(anonymize(profile), climate)): profile_key(profile)
+            for profile in pending
+        }
+        for n, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                recommendations = future.result()
+            except Exception as e:
+                failures += 1
+                log(f"[{n}/{len(pending)}] {key}: failed ({e})")
+                continue
+            done[key] = recommendations
+            checkpoint.write(json.dumps({'key': key, 'prompt': prompt_fingerprint(),
+                                         'recommendations': recommendations}) + '\n')
+            checkpoint.flush()
+            log(f"[{n}/{len(pending)}] {key}: ok ({time.time() - started:.0f}s)")
+
+    total = sum(1 for _ in all_profiles())
+    if len(done) < total:
+        log(f"{total - len(done)} profiles still missing ({failures} failed); rerun to resume")
+        return False
+
+    write_artifact(artifact_path, done)
+    os.remove(partial_path)
+    log(f"Wrote {len(done)} profiles to {artifact_path}")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute recommendations for every profile")
+    parser.add_argument('--output', default=settings.ARTIFACT_PATH, help="artifact path")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent OpenAI requests")
+    parser.add_argument('--limit', type=int, default=None, help="generate at most this many profiles")
+    args = parser.parse_args(argv)
+
+    import openai
+    openai.api_key = load_api_key()
+    if not openai.api_key:
+        parser.error("OPENAI_API_KEY is not set and .streamlit/secrets.toml has no key")
+
+    return 0 if precompute(openai, args.output, workers=args.workers, limit=args.limit) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Profile fields that decide the advice; the farmer's name is not one of them
+KEY_FIELDS = ('province', 'season', 'crop_stage', 'selected_crop')
+
+# Stands in for the farmer's name in cached advice until it is served
+FARMER_NAME_PLACEHOLDER = '{{farmer_name}}'
+
+
+def profile_key(farmer_data):
+    """Normalized cache key for a farmer profile"""
+    parts = []
+    for field in KEY_FIELDS:
+        value = farmer_data.get(field) or ''
+        parts.append(' '.join(str(value).split()).lower())
+    return '|'.join(parts)
+
+
+def anonymize(farmer_data):
+    """Copy of the profile with the farmer's name swapped for the placeholder"""
+    return dict(farmer_data, farmer_name=FARMER_NAME_PLACEHOLDER)
+
+
+def personalize(recommendations, farmer_name):
+    """Fill the farmer's name back into cached recommendations"""
+    name = farmer_name or 'farmer'
+    personalized = {}
+    for category, tips in recommendations.items():
+        if isinstance(tips, list):
+            tips = [tip.replace(FARMER_NAME_PLACEHOLDER, name) if isinstance(tip, str) else tip for tip in tips]
+        personalized[category] = tips
+    return personalized
+
+
+def depersonalize(text, farmer_name):
+    """A tip with the farmer's name swapped back for the placeholder, wherever it stands as a
+    word of its own (so "Al" is taken out of "Al, ..." but not out of "Alberta")"""
+    if not farmer_name:
+        return text
+    return re.sub(rf'(?<!\w){re.escape(farmer_name)}(?!\w)', FARMER_NAME_PLACEHOLDER, text)
+
+
+class RecommendationCache:
+    """Two-tier (in-process LRU + SQLite) cache of recommendations keyed by profile"""
+
+    def __init__(self, path=None, memory_entries=1024, disk_entries=10000, ttl_seconds=7 * 24 * 3600):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS recommendations ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS idx_recommendations_accessed ON recommendations (accessed_at)')
+            self._db.commit()
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, recommendations):
+        self._memory[key] = (created_at, recommendations)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """Cached recommendations for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return entry[1]
+                del self._memory[key]
+                self.evictions += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, created_at FROM recommendations WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        recommendations = json.loads(row[0])
+                        self._db.execute('UPDATE recommendations SET accessed_at = ? WHERE key = ?', (now, key))
+                        self._db.commit()
+                        self._remember(key, row[1], recommendations)
+                        self.hits_disk += 1
+                        return recommendations
+                    self._db.execute('DELETE FROM recommendations WHERE key = ?', (key,))
+                    self._db.commit()
+                    self.evictions += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, key, recommendations):
+        """Store recommendations in both tiers, evicting the least recently used"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, recommendations)
+            if self._db is None:
+                return
+            self._db.execute(
+                'INSERT OR REPLACE INTO recommendations (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(recommendations), now, now)
+            )
+            if self.ttl_seconds:
+                cursor = self._db.execute('DELETE FROM recommendations WHERE created_at < ?', (now - self.ttl_seconds,))
+                self.evictions += cursor.rowcount
+            cursor = self._db.execute(
+                'DELETE FROM recommendations WHERE key IN ('
+                'SELECT key FROM recommendations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.disk_entries,)
+            )
+            self.evictions += cursor.rowcount
+            self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            disk_size = 0
+            if self._db is not None:
+                disk_size = self._db.execute('SELECT COUNT(*) FROM recommendations').fetchone()[0]
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                'hits_memory': self.hits_memory,
+                'hits_disk': self.hits_disk,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                'memory_size': len(self._memory),
+                'disk_size': disk_size,
+            }
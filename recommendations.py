@@ -0,0 +1,235 @@
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+from metrics import counter, histogram
+from response_parser import MalformedResponse, parse_recommendations, record, valid_tips
+from streaming_json import IncrementalObjectParser
+
+# Options offered by the profile form and the crops page
+PROVINCES = [
+    "Alberta", "British Columbia", "Manitoba",
+    "New Brunswick", "Newfoundland and Labrador", "Nova Scotia",
+    "Ontario", "Prince Edward Island", "Quebec", "Saskatchewan"
+]
+SEASONS = ["Spring", "Summer", "Fall", "Winter"]
+CROP_STAGES = ["Pre-Planting", "Planting", "Growing", "Harvesting", "Post-Harvest"]
+CROPS = ["Wheat", "Canola", "Barley", "Oats"]
+
+# Advice categories, in the order the results page shows them
+CATEGORIES = ['weather_advice', 'pest_advice', 'soil_advice', 'sustainability_tips']
+
+# What each category asks for when categories are requested separately
+CATEGORY_DESCRIPTIONS = {
+    'weather_advice': "Weather-Based Advice (3-4 specific tips)",
+    'pest_advice': "Pest & Disease Management (3-4 actionable items)",
+    'soil_advice': "Soil & Fertilizer Guidance (3-4 recommendations)",
+    'sustainability_tips': "Sustainable Farming Tips (3-4 practices)",
+}
+
+MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "You are an expert Canadian agricultural advisor. Always respond with valid JSON only."
+
+OPENAI_SECONDS = histogram(
+    'smart_farming_openai_request_seconds',
+    "OpenAI completion time including retries and rate-limit waits; for streams, until the response starts",
+    ('call', 'outcome')
+)
+OPENAI_TOKENS = counter(
+    'smart_farming_openai_tokens_total',
+    "Tokens used as reported by OpenAI; streamed completions count one token per chunk",
+    ('call', 'kind')
+)
+
+
+def all_profiles():
+    """Every profile the app can ask about (without a farmer name)"""
+    for province, season, crop_stage, crop in itertools.product(PROVINCES, SEASONS, CROP_STAGES, CROPS):
+        yield {'province': province, 'season': season, 'crop_stage': crop_stage, 'selected_crop': crop}
+
+
+def _climate_section(farmer_data):
+    """Local climate lines (see climate.with_climate) for the prompt, if the profile has any"""
+    lines = farmer_data.get('climate')
+    if not lines:
+        return ''
+    return "\nLocal Climate Normals:\n" + ''.join(f"- {line}\n" for line in lines)
+
+
+def build_prompt(farmer_data):
+    """User prompt asking for all four advice categories"""
+    return f"""As an expert agricultural advisor for Canadian farming, provide specific recommendations for:
+
+Farmer Profile:
+- Name: {farmer_data['farmer_name']}
+- Province: {farmer_data['province']}
+- Season: {farmer_data['season']}
+- Crop Stage: {farmer_data['crop_stage']}
+- Selected Crop: {farmer_data['selected_crop']}
+{_climate_section(farmer_data)}
+Please provide detailed recommendations in the following categories:
+1. Weather-Based Advice (3-4 specific tips)
+2. Pest & Disease Management (3-4 actionable items)
+3. Soil & Fertilizer Guidance (3-4 recommendations)
+4. Sustainable Farming Tips (3-4 practices)
+
+Format your response as JSON with keys: weather_advice, pest_advice, soil_advice, sustainability_tips (each containing an array of strings). Only return the JSON, no other text."""
+
+
+def build_category_prompt(farmer_data, category):
+    """User prompt asking for a single advice category"""
+    return f"""As an expert agricultural advisor for Canadian farming, provide specific recommendations for:
+
+Farmer Profile:
+- Name: {farmer_data['farmer_name']}
+- Province: {farmer_data['province']}
+- Season: {farmer_data['season']}
+- Crop Stage: {farmer_data['crop_stage']}
+- Selected Crop: {farmer_data['selected_crop']}
+{_climate_section(farmer_data)}
+Category: {CATEGORY_DESCRIPTIONS[category]}
+
+Format your response as JSON with the single key {category} containing an array of strings. Only return the JSON, no other text."""
+
+
+def _messages(farmer_data, prompt=None):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt or build_prompt(farmer_data)}
+    ]
+
+
+def ping(client):
+    """Cheapest possible completion, used to check that OpenAI is reachable"""
+    client.ChatCompletion.create(
+        model=MODEL,
+        messages=[{"role": "user", "content": "ping"}],
+        max_tokens=1,
+        request_timeout=10
+    )
+
+
+def _complete(client, call, **kwargs):
+    """client.ChatCompletion.create, timed and with its token usage counted"""
+    started = time.perf_counter()
+    try:
+        response = client.ChatCompletion.create(model=MODEL, temperature=0.7, **kwargs)
+    except Exception:
+        OPENAI_SECONDS.observe(time.perf_counter() - started, call=call, outcome='error')
+        raise
+    OPENAI_SECONDS.observe(time.perf_counter() - started, call=call, outcome='ok')
+    usage = getattr(response, 'usage', None) if not kwargs.get('stream') else None
+    if usage:
+        OPENAI_TOKENS.inc(usage['prompt_tokens'], call=call, kind='prompt')
+        OPENAI_TOKENS.inc(usage['completion_tokens'], call=call, kind='completion')
+    return response
+
+
+def request_ai_recommendations(client, farmer_data):
+    """Ask OpenAI for recommendations; categories missing or malformed in the answer are left out.
+    Raises on API errors or when no category is usable"""
+    response = _complete(client, 'full', messages=_messages(farmer_data), max_tokens=1500)
+
+    recommendations, _ = parse_recommendations(response.choices[0].message.content, CATEGORIES)
+    return recommendations
+
+
+def request_category(client, farmer_data, category, timeout=None):
+    """Ask OpenAI for the tips of one category; raises on API or format errors"""
+    response = _complete(
+        client, 'category',
+        messages=_messages(farmer_data, build_category_prompt(farmer_data, category)),
+        max_tokens=500,
+        request_timeout=timeout
+    )
+
+    recommendations, _ = parse_recommendations(response.choices[0].message.content, [category])
+    return recommendations[category]
+
+
+def iter_parallel_recommendations(client, farmer_data, timeout=20):
+    """Request every category concurrently, yielding (category, tips, error) as they finish.
+
+    Categories that fail or miss the timeout are yielded last with tips=None
+    and the error, so the caller can substitute fallback text for just those.
+    """
+    pool = ThreadPoolExecutor(max_workers=len(CATEGORIES))
+    futures = {
+        pool.submit(request_category, client, farmer_data, category, timeout): category
+        for category in CATEGORIES
+    }
+    pending = dict(futures)
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            category = pending.pop(future)
+            try:
+                yield category, future.result(), None
+            except Exception as e:
+                yield category, None, e
+    except TimeoutError:
+        pass
+    finally:
+        # Don't keep the caller waiting on categories that ran out of time
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    for category in pending.values():
+        yield category, None, TimeoutError(f"{category} timed out after {timeout}s")
+
+
+def request_parallel_recommendations(client, farmer_data, timeout=20):
+    """All categories requested concurrently; returns (recommendations, {category: error})"""
+    recommendations = {}
+    errors = {}
+    for category, tips, error in iter_parallel_recommendations(client, farmer_data, timeout):
+        if error is None:
+            recommendations[category] = tips
+        else:
+            errors[category] = error
+    return recommendations, errors
+
+
+def stream_ai_recommendations(client, farmer_data):
+    """Stream recommendations from OpenAI, yielding (category, tips) as each array completes.
+
+    Raises if the stream fails or ends before every category has arrived.
+    """
+    response = _complete(client, 'stream', messages=_messages(farmer_data), max_tokens=1500, stream=True)
+
+    parser = IncrementalObjectParser()
+    content = []
+    yielded = set()
+    for chunk in response:
+        text = chunk['choices'][0]['delta'].get('content')
+        if not text:
+            continue
+        content.append(text)
+        OPENAI_TOKENS.inc(call='stream', kind='completion')
+        if parser is None:
+            continue
+        try:
+            completed = parser.feed(text)
+        except ValueError:
+            # Not valid JSON as it stands (a trailing comma, say); the rest is parsed once it has all arrived
+            parser = None
+            continue
+        for key, value in completed:
+            tips = valid_tips(value) if key in CATEGORIES else None
+            if tips is not None:
+                yielded.add(key)
+                yield key, tips
+        if parser.done:
+            break
+
+    missing = [category for category in CATEGORIES if category not in yielded]
+    if not missing:
+        record('clean')
+        return
+    # Recover what the incremental parser couldn't from the whole answer
+    try:
+        recommendations, missing = parse_recommendations(''.join(content), missing)
+    except MalformedResponse:
+        recommendations = {}
+    for category, tips in recommendations.items():
+        yield category, tips
+    if missing:
+        raise MalformedResponse(f"AI response ended without {', '.join(missing)}")
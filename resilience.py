@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+
+# openai.error classes worth retrying; anything else (bad request, auth) fails fast
+RETRYABLE_ERRORS = {
+    'APIError', 'APIConnectionError', 'RateLimitError', 'ServiceUnavailableError',
+    'Timeout', 'TimeoutError',
+}
+
+
+def is_retryable(error):
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while the circuit breaker is open"""
+
+
+class Deadline:
+    """A point in time a request has to finish by"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class CircuitBreaker:
+    """Stops sending traffic upstream after repeated failures.
+
+    After `failure_threshold` consecutive failures the breaker opens and every
+    call fails fast. A background thread then runs `probe` every
+    `reset_timeout` seconds and closes the breaker once a probe succeeds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, probe=None, failure_threshold=5, reset_timeout=30):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+        self._prober = None
+
+    @property
+    def closed(self):
+        return self.state == self.CLOSED
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._trip()
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.trips += 1
+        self.opened_at = time.time()
+        if self.probe is not None and (self._prober is None or not self._prober.is_alive()):
+            self._prober = threading.Thread(target=self._probe_until_closed, name='circuit-probe', daemon=True)
+            self._prober.start()
+
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.reset_timeout)
+            with self._lock:
+                self.state = self.HALF_OPEN
+            try:
+                self.probe()
+            except Exception:
+                with self._lock:
+                    self.state = self.OPEN
+                continue
+            with self._lock:
+                self.state = self.CLOSED
+                self.failures = 0
+                self.opened_at = None
+            return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'trips': self.trips,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'opened_at': self.opened_at,
+            }
+
+
+class _ChatCompletion:
+    def __init__(self, create):
+        self.create = create
+
+
+class ResilientClient:
+    """Wraps an OpenAI client with a circuit breaker and deadline-aware, jittered retries"""
+
+    def __init__(self, client, breaker, deadline_seconds=30, max_attempts=3, backoff_seconds=0.5):
+        self._client = client
+        self.breaker = breaker
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.retries = 0
+        self.ChatCompletion = _ChatCompletion(self._create)
+
+    def _create(self, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError("AI service is temporarily unavailable")
+
+        deadline = Deadline(self.deadline_seconds)
+        requested_timeout = kwargs.get('request_timeout')
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = deadline.remaining()
+            if requested_timeout:
+                timeout = min(timeout, requested_timeout)
+            try:
+                response = self._client.ChatCompletion.create(**dict(kwargs, request_timeout=timeout))
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.breaker.record_failure()
+                # Full jitter; only retry if the wait still leaves time for the call
+                delay = random.uniform(0, self.backoff_seconds * 2 ** (attempt - 1))
+                if (attempt >= self.max_attempts or not self.breaker.closed
+                        or deadline.remaining() - delay < self.backoff_seconds):
+                    raise
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            if kwargs.get('stream'):
+                return self._watch_stream(response)
+            return response
+
+    def _watch_stream(self, chunks):
+        """Pass a stream through, counting a connection lost after the first chunk as a failure"""
+        try:
+            yield from chunks
+        except Exception:
+            self.breaker.record_failure()
+            raise
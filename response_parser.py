@@ -0,0 +1,183 @@
+"""Tolerant parsing of the recommendation JSON the model sends back.
+
+Answers are often nearly right: wrapped in a ``` fence or a sentence of
+prose, cut off by max_tokens inside the last array, or left with a trailing
+comma. Rather than throw the whole paid completion away, the JSON object is
+cut out of the surrounding text and, if it still doesn't parse, repaired:
+trailing commas are dropped, an unfinished last element is cut off and open
+arrays and objects are closed. Each expected category is then kept if it
+holds a list of tips, so one bad category only costs that category.
+
+Every parse is counted by outcome (see stats()):
+    clean      the answer was valid JSON as it stood
+    extracted  valid once fences or prose around it were removed
+    repaired   valid only after repair
+    failed     no expected category could be recovered
+and partial counts answers that were usable but lacked some categories.
+"""
+import json
+import re
+import threading
+
+from metrics import counter, histogram
+
+OUTCOMES = ('clean', 'extracted', 'repaired', 'failed', 'partial')
+
+_FENCE = re.compile(r'```[A-Za-z]*\s*(.*?)(?:```|$)', re.S)
+_TRAILING_COMMA = re.compile(r',\s*[\]}]')
+_CLOSERS = {'[': ']', '{': '}'}
+
+RESPONSES = counter('smart_farming_ai_responses_total', "AI answers parsed, by outcome", ('outcome',))
+PARSE_SECONDS = histogram(
+    'smart_farming_ai_response_parse_seconds', "Time to extract, repair and validate an AI answer",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+)
+
+# Kept whether or not metrics are on; RESPONSES mirrors it for /metrics
+_counts = dict.fromkeys(OUTCOMES, 0)
+_counts_lock = threading.Lock()
+
+
+class MalformedResponse(ValueError):
+    """Model output with nothing usable in it"""
+
+
+def record(outcome):
+    with _counts_lock:
+        _counts[outcome] += 1
+    RESPONSES.inc(outcome=outcome)
+
+
+def stats():
+    """Parse outcomes since the process started"""
+    with _counts_lock:
+        return dict(_counts)
+
+
+def _scan(text, start):
+    """Index just past the bracket closing the one at `start`, or len(text) if it never closes"""
+    depth = 0
+    in_string = escape = False
+    for position in range(start, len(text)):
+        ch = text[position]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '[{':
+            depth += 1
+        elif ch in ']}':
+            depth -= 1
+            if depth == 0:
+                return position + 1
+    return len(text)
+
+
+def extract(content):
+    """The JSON object (or array) in model output, from inside a ``` fence if there is one; None if there is none"""
+    fence = _FENCE.search(content)
+    if fence and ('{' in fence.group(1) or '[' in fence.group(1)):
+        content = fence.group(1)
+    starts = [position for position in (content.find('{'), content.find('[')) if position >= 0]
+    if not starts:
+        return None
+    start = min(starts)
+    return content[start:_scan(content, start)]
+
+
+def repair(text):
+    """`text` with trailing commas dropped and, if it was cut off, everything after its last complete
+    value removed and the brackets still open closed"""
+    out = []
+    stack = []
+    # Length of `out` and the open brackets just after the last complete value
+    safe = (0, [])
+    in_string = escape = False
+    for position, ch in enumerate(text):
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if stack and stack[-1] == '[':
+                    safe = (len(out), list(stack))
+            continue
+        if ch == ',':
+            if _TRAILING_COMMA.match(text, position):
+                continue
+            safe = (len(out), list(stack))
+        elif ch == '"':
+            in_string = True
+        elif ch in '[{':
+            stack.append(ch)
+        elif ch in ']}':
+            if not stack:
+                break
+            stack.pop()
+            out.append(ch)
+            safe = (len(out), list(stack))
+            continue
+        out.append(ch)
+    if not in_string and not stack:
+        return ''.join(out)
+    length, still_open = safe
+    return ''.join(out[:length]) + ''.join(_CLOSERS[bracket] for bracket in reversed(still_open))
+
+
+def _load(content):
+    """(parsed JSON, outcome) for model output, or (None, 'failed')"""
+    try:
+        return json.loads(content), 'clean'
+    except ValueError:
+        pass
+    text = extract(content)
+    if text is None:
+        return None, 'failed'
+    try:
+        return json.loads(text), 'extracted'
+    except ValueError:
+        pass
+    try:
+        return json.loads(repair(text)), 'repaired'
+    except ValueError:
+        return None, 'failed'
+
+
+def valid_tips(value):
+    """The tips in a category's value (its non-empty strings), or None if it has none"""
+    if not isinstance(value, list):
+        return None
+    tips = [tip.strip() for tip in value if isinstance(tip, str) and tip.strip()]
+    return tips or None
+
+
+def parse_recommendations(content, categories):
+    """(recommendations, missing) from model output: every expected category that holds tips, and
+    the ones that are absent or unusable; raises MalformedResponse if none are usable"""
+    with PARSE_SECONDS.time():
+        parsed, outcome = _load(content)
+    if isinstance(parsed, list) and len(categories) == 1:
+        # Asked for one category, the model sometimes answers with just its array
+        parsed = {categories[0]: parsed}
+    recommendations = {}
+    if isinstance(parsed, dict):
+        for category in categories:
+            tips = valid_tips(parsed.get(category))
+            if tips is not None:
+                recommendations[category] = tips
+    if not recommendations:
+        record('failed')
+        raise MalformedResponse(f"AI response has no usable {', '.join(categories)}")
+    record(outcome)
+    missing = [category for category in categories if category not in recommendations]
+    if missing:
+        record('partial')
+    return recommendations, missing
@@ -0,0 +1,156 @@
+"""Agronomic rule base, compiled into a decision table over every profile.
+
+Rules live in data/agronomy_rules.json. Each one gives tips for one advice
+category and may restrict the profiles it applies to with `when`, mapping
+province, season, crop_stage and/or crop to a value or a list of values.
+For a profile, matching rules are applied most specific first (more `when`
+fields), then by higher `priority`, then in file order. Tips are merged down
+that order up to `max_tips` per category; a rule with `"replace": true`
+stops less specific rules from adding to its category. Tips may use the
+{province}, {season}, {crop_stage} and {crop} placeholders.
+"""
+import functools
+import json
+import string
+
+import settings
+from recommendation_cache import profile_key
+from recommendations import CATEGORIES, CROP_STAGES, CROPS, PROVINCES, SEASONS, all_profiles
+
+# Rule condition field -> allowed values
+RULE_FIELDS = {
+    'province': PROVINCES,
+    'season': SEASONS,
+    'crop_stage': CROP_STAGES,
+    'crop': CROPS,
+}
+
+
+def _template_values(farmer_data):
+    return {
+        'province': farmer_data.get('province', ''),
+        'season': farmer_data.get('season', ''),
+        'crop_stage': farmer_data.get('crop_stage', ''),
+        'crop': farmer_data.get('selected_crop', ''),
+    }
+
+
+def _check_rule(rule):
+    """Normalized copy of a rule from the JSON file; raises ValueError if it is malformed"""
+    rule_id = rule.get('id') or '?'
+    if rule.get('category') not in CATEGORIES:
+        raise ValueError(f"rule {rule_id}: category must be one of {', '.join(CATEGORIES)}")
+    tips = rule.get('tips')
+    if not tips or not all(isinstance(tip, str) for tip in tips):
+        raise ValueError(f"rule {rule_id}: tips must be a non-empty list of strings")
+    for tip in tips:
+        for _, field, _, _ in string.Formatter().parse(tip):
+            if field is not None and field not in RULE_FIELDS:
+                raise ValueError(f"rule {rule_id}: unknown placeholder {{{field}}}")
+
+    when = {}
+    for field, values in (rule.get('when') or {}).items():
+        if field not in RULE_FIELDS:
+            raise ValueError(f"rule {rule_id}: unknown condition field {field}")
+        values = [values] if isinstance(values, str) else list(values)
+        unknown = [value for value in values if value not in RULE_FIELDS[field]]
+        if unknown:
+            raise ValueError(f"rule {rule_id}: unknown {field} {', '.join(unknown)}")
+        when[field] = frozenset(values)
+
+    return {
+        'id': rule_id,
+        'when': when,
+        'priority': int(rule.get('priority', 0)),
+        'category': rule['category'],
+        'tips': list(tips),
+        'replace': bool(rule.get('replace', False)),
+    }
+
+
+def load_rules(path):
+    """Rules and max tips per category from a rule file"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return [_check_rule(rule) for rule in data['rules']], data.get('max_tips', 4)
+
+
+class DecisionTable:
+    """Rule-based recommendations for every profile, resolved once up front"""
+
+    def __init__(self, rules, max_tips=4, min_tailored=2):
+        self.rules = rules
+        self.max_tips = max_tips
+        self.min_tailored = min_tailored
+        # Precedence order: most specific, then highest priority, then file order
+        self._ordered = sorted(
+            enumerate(rules), key=lambda item: (-len(item[1]['when']), -item[1]['priority'], item[0])
+        )
+        self._ordered = [rule for _, rule in self._ordered]
+        self._table = {}
+        for profile in all_profiles():
+            self._table[profile_key(profile)] = self._resolve(profile)
+
+    @classmethod
+    def from_file(cls, path, min_tailored=2):
+        rules, max_tips = load_rules(path)
+        return cls(rules, max_tips=max_tips, min_tailored=min_tailored)
+
+    @staticmethod
+    def _matches(rule, values):
+        return all(values[field] in allowed for field, allowed in rule['when'].items())
+
+    def _resolve(self, farmer_data):
+        """(recommendations, tailored) for one profile by walking the rules"""
+        values = _template_values(farmer_data)
+        recommendations = {category: [] for category in CATEGORIES}
+        tailored = {category: 0 for category in CATEGORIES}
+        closed = set()
+        for rule in self._ordered:
+            category = rule['category']
+            if category in closed or not self._matches(rule, values):
+                continue
+            tips = recommendations[category]
+            for template in rule['tips']:
+                tip = template.format_map(values)
+                if len(tips) < self.max_tips and tip not in tips:
+                    tips.append(tip)
+                    if rule['when']:
+                        tailored[category] += 1
+            if rule['replace'] or len(tips) >= self.max_tips:
+                closed.add(category)
+        return recommendations, min(tailored.values()) >= self.min_tailored
+
+    def _entry(self, farmer_data):
+        entry = self._table.get(profile_key(farmer_data))
+        if entry is None:
+            # Not one of the known profiles (e.g. free-text values); resolve it directly
+            entry = self._resolve(farmer_data)
+        return entry
+
+    def resolve(self, farmer_data):
+        """Rule-based recommendations for a profile"""
+        recommendations, _ = self._entry(farmer_data)
+        return {category: list(tips) for category, tips in recommendations.items()}
+
+    def is_tailored(self, farmer_data):
+        """Whether every category has at least min_tailored tips from rules with conditions, not just generic ones"""
+        return self._entry(farmer_data)[1]
+
+    def stats(self):
+        return {
+            'rules': len(self.rules),
+            'profiles': len(self._table),
+            'tailored_profiles': sum(1 for _, tailored in self._table.values() if tailored),
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def default_table():
+    """Decision table compiled from settings.RULES_PATH, once per process"""
+    return DecisionTable.from_file(settings.RULES_PATH, min_tailored=settings.RULES_MIN_TAILORED_TIPS)
+
+
+def generate_fallback_recommendations(farmer_data):
+    """Rule-based recommendations, used whenever the AI can't or needn't be asked"""
+    return default_table().resolve(farmer_data)
@@ -0,0 +1,275 @@
+"""Background regeneration of the precomputed advisories.
+
+    python scheduler.py           # worker: refresh stale advisories every night
+    python scheduler.py --once    # refresh every stale advisory now, then exit
+
+Advice changes slowly, so farmers are served the advisory in the artifact
+precompute.py wrote, and advisories are regenerated once they are older than
+ADVISORY_MAX_AGE_HOURS. Every night between the off-peak hours each stale or
+missing profile is queued, the most requested first: assessments saved in the
+last ADVISORY_DEMAND_DAYS plus requests this process has served. During the
+day only advisories a farmer has just been served stale are regenerated, in
+the background, so nobody waits on OpenAI for them.
+
+A regenerated advisory is served from memory straight away, and the artifact
+is rewritten (atomically) every ADVISORY_PUBLISH_EVERY profiles; processes
+without a scheduler reload it with watch_artifact(). Set SMART_FARMING_SCHEDULER
+to run it inside the app or the HTTP service, or run this worker next to them.
+Only a scheduler in the serving process sees stale advice being served; the
+worker refreshes nightly.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import settings
+from precompute import generate_profile, read_artifact, write_artifact
+from recommendation_cache import KEY_FIELDS, profile_key
+from recommendations import all_profiles
+
+# Queue ranks: advisories just served stale go before the nightly pass
+URGENT, NIGHTLY = 0, 1
+
+# A profile that failed to regenerate isn't retried on request for this long
+RETRY_SECONDS = 3600
+
+
+class AdvisoryScheduler:
+    """Regenerates stale advisories on a background thread, most requested profiles first"""
+
+    def __init__(self, engine, artifact_path, max_age_hours=24, off_peak=(1, 5), publish_every=25,
+                 demand_days=30, log=print):
+        self.engine = engine
+        self.artifact_path = artifact_path
+        self.max_age = max_age_hours * 3600
+        self.off_peak = off_peak
+        self.publish_every = publish_every
+        self.demand_days = demand_days
+        self.log = log
+        self.profiles = {profile_key(profile): profile for profile in all_profiles()}
+        self.requests = Counter()
+        self.refreshed = 0
+        self.failed = 0
+        self.published = 0
+        self.last_pass = None
+        self._saved_demand = {}
+        self._failed_at = {}
+        # Heap of (rank, -demand, sequence, key); _queued holds each key's live entry,
+        # so entries superseded by a higher priority are skipped when popped
+        self._queue = []
+        self._queued = {}
+        self._sequence = itertools.count()
+        self._unwritten = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, engine):
+        return cls(
+            engine,
+            settings.ARTIFACT_PATH,
+            max_age_hours=settings.ADVISORY_MAX_AGE_HOURS,
+            off_peak=(settings.OFF_PEAK_START_HOUR, settings.OFF_PEAK_END_HOUR),
+            publish_every=settings.ADVISORY_PUBLISH_EVERY,
+            demand_days=settings.ADVISORY_DEMAND_DAYS,
+        )
+
+    def in_off_peak(self, now=None):
+        start, end = self.off_peak
+        hour = (now or datetime.now()).hour
+        # A window such as 22 to 5 wraps past midnight
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def is_stale(self, key, now=None):
+        """Whether an advisory is missing or older than the maximum age"""
+        refreshed = self.engine.refreshed.get(key)
+        return refreshed is None or (now or time.time()) - refreshed >= self.max_age
+
+    def requested(self, key):
+        """Count a request for a profile; if its advisory is being served stale, regenerate it soon"""
+        with self._lock:
+            self.requests[key] += 1
+            failed_at = self._failed_at.get(key)
+        if (key in self.engine.precomputed and self.is_stale(key)
+                and (failed_at is None or time.time() - failed_at >= RETRY_SECONDS)):
+            self._push(key, URGENT)
+
+    def _push(self, key, rank):
+        with self._lock:
+            current = self._queued.get(key)
+            if current is not None and current[0] <= rank:
+                return
+            priority = (rank, -(self._saved_demand.get(key, 0) + self.requests[key]))
+            self._queued[key] = priority
+            heapq.heappush(self._queue, priority + (next(self._sequence), key))
+        self._wake.set()
+
+    def _pop(self, urgent_only=False):
+        with self._lock:
+            while self._queue:
+                rank, demand, _, key = self._queue[0]
+                if self._queued.get(key) != (rank, demand):
+                    heapq.heappop(self._queue)
+                    continue
+                if urgent_only and rank != URGENT:
+                    return None
+                heapq.heappop(self._queue)
+                del self._queued[key]
+                return key
+            return None
+
+    def queue_stale(self):
+        """Queue every stale or missing advisory, ordered by demand; returns how many"""
+        since = (datetime.now() - timedelta(days=self.demand_days)).isoformat()
+        saved = self.engine.store.profile_counts(since)
+        with self._lock:
+            self._saved_demand = {profile_key(dict(zip(KEY_FIELDS, fields))): count for fields, count in saved.items()}
+            self._failed_at.clear()
+        stale = [key for key in self.profiles if self.is_stale(key)]
+        for key in stale:
+            self._push(key, NIGHTLY)
+        self.last_pass = datetime.now().date()
+        return len(stale)
+
+    def refresh(self, key):
+        """Regenerate one advisory and serve it; False if generation failed"""
+        try:
+            recommendations = generate_profile(self.engine.client, self.engine.upstream_profile(self.profiles[key]))
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+                self._failed_at[key] = time.time()
+            self.log(f"{key}: failed ({e})")
+            return False
+        # Copies swapped in whole, so requests never see a half-updated dict
+        precomputed = dict(self.engine.precomputed)
+        precomputed[key] = recommendations
+        refreshed = dict(self.engine.refreshed)
+        refreshed[key] = time.time()
+        self.engine.publish(precomputed, refreshed)
+        self.refreshed += 1
+        self._unwritten += 1
+        if self._unwritten >= self.publish_every:
+            self.write()
+        return True
+
+    def write(self):
+        """Write the advisories being served to the artifact, atomically"""
+        write_artifact(self.artifact_path, self.engine.precomputed, self.engine.refreshed)
+        self._unwritten = 0
+        self.published += 1
+
+    def run(self):
+        """Refresh advisories until stop(); the body of the background thread"""
+        while not self._stopped.is_set():
+            self._wake.clear()
+            off_peak = self.in_off_peak()
+            if off_peak and self.last_pass != datetime.now().date():
+                self.log(f"Nightly pass: {self.queue_stale()} advisories to refresh")
+            key = self._pop(urgent_only=not off_peak) if self.engine.available else None
+            if key is None:
+                if self._unwritten:
+                    self.write()
+                # Woken early when a farmer is served a stale advisory
+                self._wake.wait(timeout=60)
+                continue
+            self.refresh(key)
+
+    def run_once(self):
+        """Refresh every stale advisory now, whatever the hour; True if none failed"""
+        self.log(f"{self.queue_stale()} advisories to refresh")
+        failed = self.failed
+        while (key := self._pop()) is not None:
+            if self.refresh(key):
+                self.log(f"[{self.refreshed}] {key}: ok")
+        if self._unwritten:
+            self.write()
+        return self.failed == failed
+
+    def start(self):
+        """Serve requests through this scheduler and start refreshing in the background"""
+        self.engine.scheduler = self
+        self._thread = threading.Thread(target=self.run, name='advisory-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._unwritten:
+            self.write()
+
+    def stats(self):
+        with self._lock:
+            queued = len(self._queued)
+        return {
+            'queued': queued,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'published': self.published,
+            'last_pass': self.last_pass.isoformat() if self.last_pass else None,
+        }
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def watch_artifact(engine, path, interval=60):
+    """Reload the engine's advisories whenever another process rewrites the artifact"""
+    def watch():
+        seen = _mtime(path)
+        while True:
+            time.sleep(interval)
+            mtime = _mtime(path)
+            if mtime != seen:
+                seen = mtime
+                engine.publish(*read_artifact(path))
+
+    thread = threading.Thread(target=watch, name='artifact-watcher', daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the precomputed advisories fresh")
+    parser.add_argument('--once', action='store_true', help="refresh every stale advisory now, then exit")
+    args = parser.parse_args(argv)
+
+    from engine import RecommendationEngine
+    from precompute import load_api_key
+    engine = RecommendationEngine.from_settings(load_api_key(), os.environ.get('OPENAI_API_BASE'), background=False)
+    if engine.client is None:
+        parser.error("regenerating advisories needs OpenAI: set OPENAI_API_KEY and don't use SMART_FARMING_MODE=offline")
+
+    scheduler = AdvisoryScheduler.from_settings(engine)
+    try:
+        if args.once:
+            return 0 if scheduler.run_once() else 1
+        start, end = scheduler.off_peak
+        scheduler.log(f"Refreshing advisories older than {settings.ADVISORY_MAX_AGE_HOURS}h "
+                      f"between {start:02d}:00 and {end:02d}:00")
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+        engine.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Headless recommendation API for field tablets and the SMS gateway.
+
+    uvicorn service:app --host 0.0.0.0 --port 8000
+
+A plain ASGI application around the same RecommendationEngine the Streamlit
+app uses, so both share the precomputed artifact, cache, rate limits and
+assessment history. Endpoints:
+
+    GET  /healthz                       liveness plus AI availability
+    POST /v1/recommendations            one profile
+    POST /v1/recommendations/batch      {"profiles": [...]}, handled concurrently
+    GET  /v1/goals?farmer=<name>        goal progress
+    GET  /metrics                       Prometheus metrics (see metrics.py)
+
+A profile is a JSON object with farmer_name, province, season, crop_stage and
+selected_crop; add "save": true to record it as an assessment. The engine is
+blocking, so each profile runs on a pool of SERVICE_CONCURRENCY worker
+threads and batches wait for a free one.
+"""
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import metrics
+import settings
+from engine import RecommendationEngine, parse_profile
+from precompute import load_api_key
+
+MAX_BODY_BYTES = 5 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RecommendationService:
+    """ASGI app; the engine is built on startup, or on first request without lifespan support"""
+
+    def __init__(self, engine=None, concurrency=settings.SERVICE_CONCURRENCY):
+        self.engine = engine
+        self.concurrency = concurrency
+        self._executor = None
+
+    def _start(self):
+        if self.engine is None:
+            self.engine = RecommendationEngine.from_settings(load_api_key(), os.environ.get('OPENAI_API_BASE'))
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='recommend')
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        self._start()
+        try:
+            status, payload = await self._route(scope, receive)
+        except HTTPError as e:
+            status, payload = e.status, {'error': e.message}
+        except Exception:
+            logger.exception("error handling %s %s", scope['method'], scope['path'])
+            status, payload = 500, {'error': "internal server error"}
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), b'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), b'application/json'
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                if self.engine is not None:
+                    self.engine.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _route(self, scope, receive):
+        method, path = scope['method'], scope['path'].rstrip('/')
+        if path == '/healthz' and method == 'GET':
+            return 200, {'status': 'ok', 'ai_available': self.engine.available}
+        if path == '/metrics' and method == 'GET':
+            return 200, metrics.render(self.engine.metric_families())
+        if path == '/v1/goals' and method == 'GET':
+            farmer = parse_qs(scope.get('query_string', b'').decode('utf-8')).get('farmer', [''])[0]
+            if not farmer:
+                raise HTTPError(400, "farmer query parameter is required")
+            return 200, {'farmer_name': farmer, 'goals': await self._run(self.engine.goals, farmer)}
+        if path == '/v1/recommendations' and method == 'POST':
+            return await self._recommend(await self._read_json(receive))
+        if path == '/v1/recommendations/batch' and method == 'POST':
+            return 200, await self._batch(await self._read_json(receive))
+        if path in ('/healthz', '/metrics', '/v1/goals', '/v1/recommendations', '/v1/recommendations/batch'):
+            raise HTTPError(405, f"{method} not allowed on {path}")
+        raise HTTPError(404, f"no route for {path}")
+
+    async def _read_json(self, receive):
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise HTTPError(413, f"request body is larger than {MAX_BODY_BYTES} bytes")
+            chunks.append(chunk)
+            more_body = message.get('more_body', False)
+        try:
+            return json.loads(b''.join(chunks) or b'null')
+        except json.JSONDecodeError as e:
+            raise HTTPError(400, f"invalid JSON: {e}")
+
+    def _generate(self, profile, save):
+        warnings = []
+        recommendations = self.engine.recommend(profile, warn=warnings.append)
+        result = {'profile': profile, 'recommendations': recommendations, 'warnings': warnings}
+        if save:
+            completed = self.engine.save_assessment(dict(profile, recommendations=recommendations))
+            result['completed_goals'] = [goal['id'] for goal in completed]
+        return result
+
+    async def _recommend(self, data):
+        """(status, result) for one profile; problems come back as {'error': ...}"""
+        try:
+            profile = parse_profile(data)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        try:
+            return 200, await self._run(self._generate, profile, bool(data.get('save')))
+        except Exception as e:
+            # One bad profile mustn't take the rest of a batch down with it
+            logger.exception("error generating recommendations")
+            return 500, {'error': f"could not generate recommendations: {e}"}
+
+    async def _batch(self, data):
+        profiles = data.get('profiles') if isinstance(data, dict) else None
+        if not isinstance(profiles, list):
+            raise HTTPError(400, "body must be {\"profiles\": [...]}")
+        if len(profiles) > settings.SERVICE_MAX_BATCH:
+            raise HTTPError(413, f"at most {settings.SERVICE_MAX_BATCH} profiles per batch")
+        # Duplicate profiles coalesce in the engine's single-flight and cache
+        results = [result for _, result in await asyncio.gather(*(self._recommend(profile) for profile in profiles))]
+        return {
+            'results': results,
+            'errors': sum(1 for result in results if 'error' in result),
+        }
+
+
+app = RecommendationService()
@@ -0,0 +1,119 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+# Runtime data (caches, databases, artifacts) lives here, outside of git
+DATA_DIR = os.environ.get(
+    'SMART_FARMING_DATA_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+)
+
+# Recommendation cache
+CACHE_PATH = os.path.join(DATA_DIR, 'recommendation_cache.db')
+CACHE_MEMORY_ENTRIES = _env_int('SMART_FARMING_CACHE_MEMORY_ENTRIES', 1024)
+CACHE_DISK_ENTRIES = _env_int('SMART_FARMING_CACHE_DISK_ENTRIES', 10000)
+CACHE_TTL_SECONDS = _env_int('SMART_FARMING_CACHE_TTL_SECONDS', 7 * 24 * 3600)
+
+# Precomputed recommendations for every profile (see precompute.py)
+ARTIFACT_PATH = os.environ.get('SMART_FARMING_ARTIFACT_PATH', os.path.join(DATA_DIR, 'recommendations.json.gz'))
+
+# Background refresh of the artifact (see scheduler.py). With the scheduler on, a process regenerates
+# advisories older than ADVISORY_MAX_AGE_HOURS: all of them, most requested first, between the
+# off-peak hours (local time), and at any hour those a farmer asks for, serving the old one meanwhile.
+# Processes without it reload the artifact when it changes, checking every ARTIFACT_RELOAD_SECONDS.
+ADVISORY_SCHEDULER = _env_flag('SMART_FARMING_SCHEDULER', False)
+ADVISORY_MAX_AGE_HOURS = _env_int('SMART_FARMING_ADVISORY_MAX_AGE_HOURS', 24)
+OFF_PEAK_START_HOUR = _env_int('SMART_FARMING_OFF_PEAK_START', 1)
+OFF_PEAK_END_HOUR = _env_int('SMART_FARMING_OFF_PEAK_END', 5)
+# Advisories regenerated between writes of the artifact file; each is served from memory at once
+ADVISORY_PUBLISH_EVERY = _env_int('SMART_FARMING_ADVISORY_PUBLISH_EVERY', 25)
+# Demand is counted from assessments saved in the last this many days
+ADVISORY_DEMAND_DAYS = _env_int('SMART_FARMING_ADVISORY_DEMAND_DAYS', 30)
+ARTIFACT_RELOAD_SECONDS = _env_int('SMART_FARMING_ARTIFACT_RELOAD_SECONDS', 60)
+
+# Stream new recommendations onto the results page category by category
+STREAM_RECOMMENDATIONS = _env_flag('SMART_FARMING_STREAM', True)
+
+# Request the four advice categories as separate, concurrent completions
+PARALLEL_CATEGORIES = _env_flag('SMART_FARMING_PARALLEL', False)
+CATEGORY_TIMEOUT_SECONDS = _env_int('SMART_FARMING_CATEGORY_TIMEOUT', 20)
+
+# Upstream OpenAI limits; bursts beyond these queue for up to the max wait
+RATE_LIMIT_RPM = _env_int('SMART_FARMING_RATE_LIMIT_RPM', 500)
+RATE_LIMIT_TPM = _env_int('SMART_FARMING_RATE_LIMIT_TPM', 90000)
+RATE_LIMIT_MAX_WAIT_SECONDS = _env_int('SMART_FARMING_RATE_LIMIT_MAX_WAIT', 30)
+
+# Each OpenAI request must finish within the deadline, retries included;
+# after repeated failures the circuit breaker sends traffic to the fallback
+REQUEST_DEADLINE_SECONDS = _env_int('SMART_FARMING_REQUEST_DEADLINE', 30)
+REQUEST_MAX_ATTEMPTS = _env_int('SMART_FARMING_REQUEST_MAX_ATTEMPTS', 3)
+BREAKER_FAILURE_THRESHOLD = _env_int('SMART_FARMING_BREAKER_FAILURES', 5)
+BREAKER_RESET_SECONDS = _env_int('SMART_FARMING_BREAKER_RESET', 30)
+# Longest a request waits for an identical one already in flight before giving up on it
+SINGLE_FLIGHT_WAIT_SECONDS = _env_int('SMART_FARMING_SINGLE_FLIGHT_WAIT', 60)
+
+# Completed assessments; writes are batched and flushed before any read
+ASSESSMENT_DB_PATH = os.environ.get('SMART_FARMING_ASSESSMENT_DB', os.path.join(DATA_DIR, 'assessments.db'))
+ASSESSMENT_BATCH_SIZE = _env_int('SMART_FARMING_ASSESSMENT_BATCH_SIZE', 50)
+HISTORY_PAGE_SIZE = 5
+
+# Agronomic rule base (see rules.py). RECOMMENDATION_MODE is one of
+#   ai           ask OpenAI for anything not precomputed or cached; rules are the fallback
+#   rules-first  serve rule advice without asking OpenAI when every category has at
+#                least RULES_MIN_TAILORED_TIPS tips from rules with conditions
+#   offline      never call OpenAI; rules only
+RULES_PATH = os.environ.get(
+    'SMART_FARMING_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'agronomy_rules.json')
+)
+RULES_MIN_TAILORED_TIPS = _env_int('SMART_FARMING_RULES_MIN_TAILORED_TIPS', 2)
+RECOMMENDATION_MODE = os.environ.get('SMART_FARMING_MODE', 'ai')
+
+# Province climate/soil and crop requirements for ranking crops (see suitability.py)
+SUITABILITY_PATH = os.environ.get(
+    'SMART_FARMING_SUITABILITY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'crop_suitability.json')
+)
+
+# Local climate normals ingested from station CSVs (see climate.py)
+CLIMATE_DIR = os.environ.get('SMART_FARMING_CLIMATE_DIR', os.path.join(DATA_DIR, 'climate'))
+
+# Commodity price history for the market page (see market.py)
+MARKET_DIR = os.environ.get('SMART_FARMING_MARKET_DIR', os.path.join(DATA_DIR, 'market'))
+
+# Tips shown and searched on the community page alongside stored recommendations (see knowledge_index.py)
+COMMUNITY_TIPS_PATH = os.environ.get(
+    'SMART_FARMING_COMMUNITY_TIPS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'community_tips.json')
+)
+
+# Results of bulk CSV runs started from the app (see bulk.py)
+BULK_DIR = os.path.join(DATA_DIR, 'bulk')
+BULK_WORKERS = _env_int('SMART_FARMING_BULK_WORKERS', 8)
+
+# Show the script run time of each interaction in the sidebar
+SHOW_RUN_TIMES = _env_flag('SMART_FARMING_SHOW_RUN_TIMES', False)
+
+# Instrumentation (see metrics.py); when off, recording a metric does nothing
+METRICS_ENABLED = _env_flag('SMART_FARMING_METRICS', True)
+# Prometheus text file the app rewrites at most every METRICS_WRITE_SECONDS, e.g. for
+# node_exporter's textfile collector; the HTTP service serves the same at /metrics
+METRICS_PATH = os.environ.get('SMART_FARMING_METRICS_PATH')
+METRICS_WRITE_SECONDS = _env_int('SMART_FARMING_METRICS_WRITE_SECONDS', 15)
+# Add a 📈 Diagnostics page showing the metrics to the app's sidebar
+DIAGNOSTICS_PAGE = _env_flag('SMART_FARMING_DIAGNOSTICS', False)
+
+# HTTP service (service.py): profiles generated at once, and the largest batch accepted
+SERVICE_CONCURRENCY = _env_int('SMART_FARMING_SERVICE_CONCURRENCY', 16)
+SERVICE_MAX_BATCH = _env_int('SMART_FARMING_SERVICE_MAX_BATCH', 500)
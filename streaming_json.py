@@ -0,0 +1,109 @@
+import json
+
+# Parser states
+_START, _KEY, _IN_KEY, _COLON, _VALUE_START, _VALUE, _AFTER_VALUE, _DONE = range(8)
+
+
+class IncrementalObjectParser:
+    """Parses a streamed JSON object, yielding each top-level member once it is complete.
+
+    Text before the opening brace (prose, a ``` fence) is skipped, so the parser
+    can be fed raw model output chunk by chunk.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self._buf = ''
+        self._pos = 0
+        self._state = _START
+        self._key = None
+        self._key_start = 0
+        self._value_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self):
+        return self._state == _DONE
+
+    def _complete(self, end):
+        value = json.loads(self._buf[self._value_start:end])
+        self.members[self._key] = value
+        return self._key, value
+
+    def feed(self, chunk):
+        """Add more text; returns the (key, value) members completed by it"""
+        self._buf += chunk
+        completed = []
+        buf = self._buf
+        pos = self._pos
+        while pos < len(buf) and self._state != _DONE:
+            ch = buf[pos]
+            state = self._state
+            if state == _START:
+                if ch == '{':
+                    self._state = _KEY
+            elif state == _KEY:
+                if ch == '"':
+                    self._key_start = pos
+                    self._escape = False
+                    self._state = _IN_KEY
+                elif ch == '}':
+                    self._state = _DONE
+            elif state == _IN_KEY:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._key = json.loads(buf[self._key_start:pos + 1])
+                    self._state = _COLON
+            elif state == _COLON:
+                if ch == ':':
+                    self._state = _VALUE_START
+            elif state == _VALUE_START:
+                if not ch.isspace():
+                    self._value_start = pos
+                    self._depth = 0
+                    self._in_string = False
+                    self._escape = False
+                    self._state = _VALUE
+                    # Let the value scanner see this character too
+                    continue
+            elif state == _VALUE:
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == '\\':
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                        if self._depth == 0:
+                            completed.append(self._complete(pos + 1))
+                            self._state = _AFTER_VALUE
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in '[{':
+                    self._depth += 1
+                elif ch in ']}':
+                    if self._depth == 0:
+                        # A bare scalar (number, true, null) ended by the closing brace
+                        completed.append(self._complete(pos))
+                        self._state = _DONE
+                    else:
+                        self._depth -= 1
+                        if self._depth == 0:
+                            completed.append(self._complete(pos + 1))
+                            self._state = _AFTER_VALUE
+                elif ch == ',' and self._depth == 0:
+                    completed.append(self._complete(pos))
+                    self._state = _KEY
+            elif state == _AFTER_VALUE:
+                if ch == ',':
+                    self._state = _KEY
+                elif ch == '}':
+                    self._state = _DONE
+            pos += 1
+        self._pos = pos
+        return completed
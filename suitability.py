@@ -0,0 +1,123 @@
+"""Crop suitability for every province, season and crop stage.
+
+Province climate and soil, and each crop's requirements, come from
+data/crop_suitability.json. Four factors are scored between 0 and 1 as NumPy
+arrays over the whole province x crop matrix:
+
+    frost_free_days      margin between the province's frost-free days and the crop's minimum
+    growing_degree_days  heat units against what the crop needs (and can stand)
+    moisture             growing-season rainfall against the crop's preferred range
+    soil                 the crop's preference for the province's soil zone
+
+Their weighted sum is scaled by planting timing (season x crop stage x crop),
+giving a 0-100 score for every profile. Scores, rankings and notes are all
+computed once when the table is built; serving a ranking is a dict lookup.
+To offer a new crop, add it to CROPS and to the crops in the data file.
+"""
+import json
+
+import numpy as np
+
+from recommendations import CROP_STAGES, CROPS, PROVINCES, SEASONS
+
+FACTORS = ('frost_free_days', 'growing_degree_days', 'moisture', 'soil')
+
+# Below this score the crop's weakest factor is named in its note
+GOOD_MATCH = 80
+
+# Score multiplier for planting a crop outside its usual planting seasons
+OFF_SEASON_TIMING = 0.6
+
+
+def _factor_note(factor, too_hot):
+    if factor == 'growing_degree_days':
+        return "too much summer heat" if too_hot else "too little summer heat"
+    return {
+        'frost_free_days': "a short frost-free season",
+        'moisture': "growing-season rainfall",
+        'soil': "the local soil zone",
+    }[factor]
+
+
+class SuitabilityTable:
+    """Precomputed crop scores and rankings for every province x season x crop stage"""
+
+    def __init__(self, data):
+        provinces = data['provinces']
+        crops = data['crops']
+        missing = [p for p in PROVINCES if p not in provinces] + [c for c in CROPS if c not in crops]
+        if missing:
+            raise ValueError(f"suitability data has no entry for {', '.join(missing)}")
+        self.crops = list(crops)
+        self.icons = {crop: crops[crop].get('icon', '🌱') for crop in self.crops}
+        weights = np.array([data['weights'][factor] for factor in FACTORS], dtype=float)
+        weights /= weights.sum()
+
+        # Province columns, shape (P,)
+        frost_free = np.array([provinces[p]['frost_free_days'] for p in PROVINCES], dtype=float)
+        heat = np.array([provinces[p]['growing_degree_days'] for p in PROVINCES], dtype=float)
+        rain = np.array([provinces[p]['growing_season_precip_mm'] for p in PROVINCES], dtype=float)
+        zones = sorted({zone for crop in crops.values() for zone in crop['soil']})
+        zone_index = np.array([zones.index(provinces[p]['soil_zone']) for p in PROVINCES])
+
+        # Crop columns, shape (C,)
+        min_frost_free = np.array([crops[c]['min_frost_free_days'] for c in self.crops], dtype=float)
+        heat_needed = np.array([crops[c]['growing_degree_days'] for c in self.crops], dtype=float)
+        heat_max = np.array([crops[c].get('max_growing_degree_days', np.inf) for c in self.crops], dtype=float)
+        rain_low = np.array([crops[c]['precip_mm'][0] for c in self.crops], dtype=float)
+        rain_high = np.array([crops[c]['precip_mm'][1] for c in self.crops], dtype=float)
+        soil_preference = np.array([[crops[c]['soil'].get(zone, 0.5) for zone in zones] for c in self.crops])
+
+        # Factor scores, shape (P, C, F)
+        heat_ratio = heat[:, None] / heat_needed[None, :]
+        rain_pc = rain[:, None]
+        factors = np.stack([
+            np.clip(0.5 + (frost_free[:, None] - min_frost_free[None, :]) / 40, 0, 1),
+            np.clip((heat_ratio - 0.8) / 0.3, 0, 1)
+            * np.clip(1 - np.maximum(heat[:, None] - heat_max[None, :], 0) / 1000, 0, 1),
+            np.where(rain_pc < rain_low, rain_pc / rain_low, np.where(rain_pc > rain_high, rain_high / rain_pc, 1.0)),
+            soil_preference[:, zone_index].T,
+        ], axis=-1)
+        climate = factors @ weights  # (P, C)
+
+        # Planting timing, shape (S, T, C): planting needs this season to be a planting
+        # season, pre-planting this season or the next one; later stages aren't affected
+        in_window = np.array([[season in crops[c]['planting_seasons'] for c in self.crops] for season in SEASONS])
+        next_in_window = np.roll(in_window, -1, axis=0)
+        timing = np.ones((len(SEASONS), len(CROP_STAGES), len(self.crops)))
+        timing[:, CROP_STAGES.index('Planting'), :] = np.where(in_window, 1.0, OFF_SEASON_TIMING)
+        timing[:, CROP_STAGES.index('Pre-Planting'), :] = np.where(in_window | next_in_window, 1.0, OFF_SEASON_TIMING)
+
+        # Scores and rankings, shape (P, S, T, C)
+        self.scores = np.rint(100 * climate[:, None, None, :] * timing[None, :, :, :]).astype(int)
+        order = np.argsort(-self.scores, axis=-1, kind='stable')
+        weakest = factors.argmin(axis=-1)  # (P, C)
+
+        self._rankings = {}
+        for p, province in enumerate(PROVINCES):
+            for s, season in enumerate(SEASONS):
+                for t, crop_stage in enumerate(CROP_STAGES):
+                    ranking = []
+                    for c in order[p, s, t]:
+                        score = int(self.scores[p, s, t, c])
+                        if timing[s, t, c] < 1:
+                            note = f"Not usually planted in {season.lower()}"
+                        elif score >= GOOD_MATCH:
+                            note = f"Well suited to {province}"
+                        else:
+                            note = f"Limited by {_factor_note(FACTORS[weakest[p, c]], heat[p] > heat_max[c])}"
+                        ranking.append({'crop': self.crops[c], 'icon': self.icons[self.crops[c]], 'score': score, 'note': note})
+                    self._rankings[(province, season, crop_stage)] = ranking
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def ranking(self, province, season, crop_stage):
+        """Crops best first, as dicts with crop, icon, score (0-100) and note"""
+        ranking = self._rankings.get((province, season, crop_stage))
+        if ranking is None:
+            # Unknown profile: every crop, unscored, in table order
+            return [{'crop': crop, 'icon': self.icons[crop], 'score': None, 'note': ''} for crop in self.crops]
+        return ranking
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Modules live at the repository root; keep runtime data out of the working tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SMART_FARMING_DATA_DIR', tempfile.mkdtemp(prefix='smart-farming-tests-'))
@@ -0,0 +1,58 @@
+import os
+
+import climate
+import settings
+from engine import RecommendationEngine
+
+
+def write_csv(path, province, tmin):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('station,province,date,tmax,tmin,precip\n')
+        for day in range(1, 29):
+            f.write(f'1,{province},2020-02-{day:02d},{tmin + 8},{tmin},0.5\n')
+    return path
+
+
+def test_default_store_is_reopened_after_an_ingestion(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'climate')
+    monkeypatch.setattr(settings, 'CLIMATE_DIR', directory)
+    engine = RecommendationEngine(climate=climate.default_store)
+    assert engine.climate is None
+
+    climate.ingest([write_csv(tmp_path / 'ab.csv', 'AB', -10)], directory, log=lambda message: None)
+    first = engine.climate
+    assert first.provinces == ['Alberta']
+    assert climate.default_store() is first
+
+    climate.ingest([write_csv(tmp_path / 'sk.csv', 'SK', -12)], directory, log=lambda message: None)
+    second = engine.climate
+    assert second is not first
+    assert second.provinces == ['Saskatchewan']
+    assert engine.stats()['climate']['provinces'] == 1
+    # The build the first store maps is kept for readers that haven't reopened yet
+    assert sorted(os.listdir(os.path.join(directory, 'builds'))) == sorted({first.fingerprint, second.fingerprint})
+    assert first.normals('Alberta') is not None
+
+
+def test_ingestion_removes_builds_older_than_the_previous_one(tmp_path):
+    directory = str(tmp_path / 'climate')
+    fingerprints = [
+        climate.ingest([write_csv(tmp_path / f'{tmin}.csv', 'MB', tmin)], directory, log=lambda message: None)['build']
+        for tmin in (-5, -6, -7)
+    ]
+    assert sorted(os.listdir(os.path.join(directory, 'builds'))) == sorted(fingerprints[1:])
+
+
+def test_cached_answers_are_not_served_after_a_new_ingestion(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'climate')
+    monkeypatch.setattr(settings, 'CLIMATE_DIR', directory)
+    climate.ingest([write_csv(tmp_path / 'ab.csv', 'AB', -10)], directory, log=lambda message: None)
+    engine = RecommendationEngine(climate=climate.default_store)
+    farm = {'farmer_name': 'Ana', 'province': 'Alberta', 'season': 'Winter', 'crop_stage': 'Planting',
+            'selected_crop': 'Wheat'}
+    advice = {'weather_advice': ['Expect -10°C nights']}
+    engine.cache.put(engine._cache_key(farm), advice)
+    assert engine.lookup(farm) == advice
+
+    climate.ingest([write_csv(tmp_path / 'ab2.csv', 'AB', -25)], directory, log=lambda message: None)
+    assert engine.lookup(farm) is None
@@ -0,0 +1,73 @@
+from compact import CompactAssessment, TipTable
+from recommendations import CATEGORIES
+
+
+def assessment(name, tip):
+    return {
+        'farmer_name': name, 'province': 'Alberta', 'season': 'Spring',
+        'crop_stage': 'Planting', 'selected_crop': 'Wheat', 'timestamp': '2026-05-01T08:00:00',
+        'recommendations': {category: [f'{tip} for {name}', 'Rotate crops'] for category in CATEGORIES},
+    }
+
+
+def test_compact_assessment_reads_back_as_the_dict_it_replaces():
+    table = TipTable()
+    original = assessment('Ana', 'Scout early')
+    compact = CompactAssessment(original, table)
+    assert compact.copy() == original
+    # The name is taken out, so farmers with the same advice share its tips
+    CompactAssessment(assessment('Ben', 'Scout early'), table)
+    assert len(table) == 2
+
+
+def test_tips_leave_the_table_with_the_last_assessment_holding_them():
+    table = TipTable()
+    first = CompactAssessment(assessment('Ana', 'Scout early'), table)
+    second = CompactAssessment(assessment('Ben', 'Scout early'), table)
+    first['recommendations'] = assessment('Ana', 'Seed shallow')['recommendations']
+    assert len(table) == 3
+    del second
+    assert len(table) == 2
+    del first['recommendations']
+    assert len(table) == 0
+    assert table.stats() == {'tips': 0, 'text_bytes': 0}
+
+
+def test_table_does_not_grow_with_assessments_that_are_gone():
+    table = TipTable()
+    for number in range(1000):
+        current = CompactAssessment(assessment('Ana', f'Generated tip {number}'), table)
+    assert len(table) == 2
+    assert len(table._texts) <= 4
+    assert current['recommendations']['soil_advice'] == ['Generated tip 999 for Ana', 'Rotate crops']
+
+
+def test_renaming_keeps_the_tips_held_once():
+    table = TipTable()
+    compact = CompactAssessment(assessment('Ana', 'Scout early'), table)
+    compact['farmer_name'] = 'Bea'
+    assert len(table) == 2
+    assert compact['recommendations']['pest_advice'][0] == 'Scout early for Ana'
+    del compact
+    assert len(table) == 0
+
+
+def test_names_inside_other_words_are_left_in_the_shared_tips():
+    table = TipTable()
+    ann = assessment('Ann', 'Sow Annual ryegrass')
+    anna = assessment('Anna', 'Sow Annual ryegrass')
+    first, second = CompactAssessment(ann, table), CompactAssessment(anna, table)
+    assert first.copy() == ann
+    assert second.copy() == anna
+    assert 'Sow Annual ryegrass for {{farmer_name}}' in table._ids
+    # One copy of each tip for both farmers
+    assert len(table) == 2
+
+
+def test_release_does_not_wait_for_the_table_lock():
+    # As when the garbage collector finalizes an assessment in the middle of intern()
+    table = TipTable()
+    compact = CompactAssessment(assessment('Ana', 'Scout early'), table)
+    with table._lock:
+        del compact
+    assert len(table) == 0
@@ -0,0 +1,21 @@
+import engine as engine_module
+import settings
+from engine import RecommendationEngine
+from recommendations import CATEGORIES
+
+FARM = {'farmer_name': 'Ana', 'province': 'Alberta', 'season': 'Spring', 'crop_stage': 'Planting', 'selected_crop': 'Wheat'}
+
+
+def test_stream_failing_part_way_warns_once(monkeypatch):
+    def stream_ai_recommendations(client, farmer_data):
+        yield CATEGORIES[0], ['Seed after the frost']
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(settings, 'PARALLEL_CATEGORIES', False)
+    monkeypatch.setattr(engine_module, 'stream_ai_recommendations', stream_ai_recommendations)
+    warnings = []
+    streamed = dict(RecommendationEngine(client=object()).stream(FARM, warnings.append))
+
+    assert streamed[CATEGORIES[0]] == ['Seed after the frost']
+    assert all(streamed[category] for category in CATEGORIES)
+    assert warnings == ["⚠️ Error with AI: connection reset. Using fallback recommendations."]
@@ -0,0 +1,26 @@
+from knowledge_index import KnowledgeIndex
+from recommendation_cache import FARMER_NAME_PLACEHOLDER, depersonalize
+
+
+def saved(name, tips):
+    return {'farmer_name': name, 'province': 'Alberta', 'season': 'Spring', 'selected_crop': 'Oats',
+            'recommendations': {'weather_advice': tips}}
+
+
+def test_name_is_only_taken_out_where_it_stands_as_a_word():
+    assert depersonalize("Al, early seeding pays off in Alberta", 'Al') == \
+        f"{FARMER_NAME_PLACEHOLDER}, early seeding pays off in Alberta"
+    assert depersonalize("Oats like cool weather, Oat.", 'Oat') == f"Oats like cool weather, {FARMER_NAME_PLACEHOLDER}."
+    assert depersonalize("Alberta", '') == "Alberta"
+
+
+def test_farmer_whose_name_is_inside_a_province_keeps_the_province_searchable():
+    index = KnowledgeIndex()
+    index.add_assessment(saved('Al', ["Al, early seeding into moisture pays off in Alberta"]))
+    index.add_assessment(saved('Bea', ["Bea, early seeding into moisture pays off in Alberta"]))
+    results = index.search('alberta')
+    assert [result['text'] for result in results] == [
+        f"{FARMER_NAME_PLACEHOLDER}, early seeding into moisture pays off in Alberta"
+    ]
+    # Both farmers got the same advice, so it is one document given twice
+    assert results[0]['count'] == 2
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from response_parser import MalformedResponse, parse_recommendations, stats
+
+CATEGORIES = ['weather_advice', 'pest_advice']
+ANSWER = {'weather_advice': ['Seed after the frost', 'Watch for hail'], 'pest_advice': ['Scout for flea beetles']}
+
+
+def parse(content, categories=CATEGORIES):
+    """(recommendations, missing, outcomes counted by the parse)"""
+    before = stats()
+    recommendations, missing = parse_recommendations(content, categories)
+    after = stats()
+    return recommendations, missing, {outcome for outcome in after if after[outcome] != before[outcome]}
+
+
+@pytest.mark.parametrize('content, outcome', [
+    (json.dumps(ANSWER), 'clean'),
+    ('```json\n' + json.dumps(ANSWER, indent=2) + '\n```', 'extracted'),
+    ('Here are your recommendations:\n' + json.dumps(ANSWER) + '\nGood luck this season!', 'extracted'),
+    ('{"weather_advice": ["Seed after the frost", "Watch for hail",], "pest_advice": ["Scout for flea beetles",],}',
+     'repaired'),
+])
+def test_whole_answers_are_recovered(content, outcome):
+    recommendations, missing, outcomes = parse(content)
+    assert recommendations == ANSWER
+    assert missing == []
+    assert outcomes == {outcome}
+
+
+def test_truncated_answer_keeps_the_complete_tips():
+    content = json.dumps(ANSWER)
+    # Cut off by max_tokens part way through the last tip
+    recommendations, missing, outcomes = parse(content[:content.index('flea') + 4])
+    assert recommendations == {'weather_advice': ANSWER['weather_advice']}
+    assert missing == ['pest_advice']
+    assert outcomes == {'repaired', 'partial'}
+
+
+def test_bare_list_answers_a_single_category():
+    recommendations, missing, outcomes = parse('["Scout for flea beetles", "Check traps weekly"]', ['pest_advice'])
+    assert recommendations == {'pest_advice': ['Scout for flea beetles', 'Check traps weekly']}
+    assert outcomes == {'clean'}
+
+
+def test_unusable_categories_are_reported_missing():
+    content = json.dumps({'weather_advice': ['Seed after the frost', '  ', 7], 'pest_advice': 'none'})
+    recommendations, missing, outcomes = parse(content)
+    assert recommendations == {'weather_advice': ['Seed after the frost']}
+    assert missing == ['pest_advice']
+    assert outcomes == {'clean', 'partial'}
+
+
+@pytest.mark.parametrize('content', ['Sorry, I cannot help with that.', '{"soil_advice": ["Test the soil"]}', ''])
+def test_answers_with_nothing_usable_fail(content):
+    before = stats()['failed']
+    with pytest.raises(MalformedResponse):
+        parse_recommendations(content, CATEGORIES)
+    assert stats()['failed'] == before + 1
+
+
+def test_outcomes_are_counted_with_metrics_turned_off(monkeypatch):
+    import metrics
+    from response_parser import RESPONSES
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    exported = RESPONSES.value(outcome='repaired')
+    _, _, outcomes = parse('{"weather_advice": ["Seed after the frost",], "pest_advice": ["Scout for flea beetles"]}')
+    assert outcomes == {'repaired'}
+    assert RESPONSES.value(outcome='repaired') == exported
@@ -0,0 +1,93 @@
+import re
+
+import pytest
+
+from recommendations import CATEGORIES, CROPS, all_profiles
+from rules import DecisionTable, _check_rule, default_table
+
+# Other crops a tip may name without being advice about them
+OTHER_CROP_MENTIONS = ('barley yellow dwarf', 'volunteer cereals and canola')
+
+
+def profile(province='Alberta', season='Spring', crop_stage='Planting', crop='Wheat'):
+    return {'farmer_name': 'Ana', 'province': province, 'season': season, 'crop_stage': crop_stage, 'selected_crop': crop}
+
+
+def table(*rules, max_tips=4):
+    return DecisionTable([_check_rule(rule) for rule in rules], max_tips=max_tips)
+
+
+def test_every_profile_gets_filled_in_tips_for_every_category():
+    rules = default_table()
+    for farm in all_profiles():
+        recommendations = rules.resolve(farm)
+        for category in CATEGORIES:
+            assert recommendations[category], (farm, category)
+            assert not any('{' in tip for tip in recommendations[category]), (farm, category)
+
+
+def test_no_profile_gets_advice_about_another_crop():
+    rules = default_table()
+    for farm in all_profiles():
+        for tips in rules.resolve(farm).values():
+            for tip in tips:
+                text = tip.lower()
+                for mention in OTHER_CROP_MENTIONS:
+                    text = text.replace(mention, '')
+                for crop in CROPS:
+                    if crop != farm['selected_crop']:
+                        assert not re.search(r'\b' + crop.lower(), text), (farm, tip)
+
+
+def test_prairie_spring_frost_advice_matches_the_crop():
+    rules = default_table()
+    canola = rules.resolve(profile('Saskatchewan', crop='Canola'))['weather_advice']
+    wheat = rules.resolve(profile('Saskatchewan', crop='Wheat'))['weather_advice']
+    assert any('frost-sensitive canola' in tip for tip in canola)
+    assert any(tip.startswith('Wheat tolerates light spring frost') for tip in wheat)
+    assert not any('canola' in tip.lower() for tip in wheat)
+    # Outside the prairies neither applies
+    ontario = rules.resolve(profile('Ontario', crop='Canola'))['weather_advice']
+    assert not any('frost-sensitive canola' in tip for tip in ontario)
+
+
+def test_malt_barley_harvest_timing_is_weather_advice():
+    recommendations = default_table().resolve(profile(season='Fall', crop_stage='Harvesting', crop='Barley'))
+    assert any('malt barley' in tip for tip in recommendations['weather_advice'])
+    assert not any('malt barley' in tip for tip in recommendations['soil_advice'])
+
+
+def test_more_specific_rules_come_first_and_replace_stops_general_ones():
+    rules = table(
+        {'id': 'general', 'category': 'weather_advice', 'tips': ['general tip']},
+        {'id': 'province', 'when': {'province': 'Alberta'}, 'category': 'weather_advice', 'tips': ['{province} tip']},
+        {'id': 'crop', 'when': {'province': 'Alberta', 'crop': ['Wheat', 'Oats']}, 'replace': True,
+         'category': 'pest_advice', 'tips': ['{crop} pest tip']},
+        {'id': 'pests', 'category': 'pest_advice', 'tips': ['general pest tip']},
+    )
+    alberta_wheat = rules.resolve(profile())
+    assert alberta_wheat['weather_advice'] == ['Alberta tip', 'general tip']
+    assert alberta_wheat['pest_advice'] == ['Wheat pest tip']
+    ontario_wheat = rules.resolve(profile('Ontario'))
+    assert ontario_wheat['weather_advice'] == ['general tip']
+    assert ontario_wheat['pest_advice'] == ['general pest tip']
+
+
+def test_priority_breaks_ties_and_tips_stop_at_max():
+    rules = table(
+        {'id': 'low', 'when': {'season': 'Spring'}, 'category': 'soil_advice', 'tips': ['low 1', 'low 2']},
+        {'id': 'high', 'when': {'season': 'Spring'}, 'priority': 5, 'category': 'soil_advice', 'tips': ['high 1', 'high 2']},
+        max_tips=3,
+    )
+    assert rules.resolve(profile())['soil_advice'] == ['high 1', 'high 2', 'low 1']
+
+
+@pytest.mark.parametrize('rule', [
+    {'id': 'bad-category', 'category': 'market_advice', 'tips': ['x']},
+    {'id': 'bad-field', 'when': {'soil': 'Clay'}, 'category': 'soil_advice', 'tips': ['x']},
+    {'id': 'bad-value', 'when': {'crop': 'Corn'}, 'category': 'soil_advice', 'tips': ['x']},
+    {'id': 'bad-placeholder', 'category': 'soil_advice', 'tips': ['{farm}']},
+])
+def test_malformed_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        _check_rule(rule)
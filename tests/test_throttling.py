@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from throttling import SingleFlight, SingleFlightTimeout
+
+
+def wait_for_leader(flight, key):
+    while not flight.in_flight(key):
+        time.sleep(0.001)
+
+
+def follow(flight, key, fn, results):
+    def run():
+        try:
+            results.append(flight.do(key, fn))
+        except BaseException as e:
+            results.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_waiters_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait()
+        return 'advice'
+
+    results = []
+    leader = follow(flight, 'key', fetch, results)
+    wait_for_leader(flight, 'key')
+    waiter = follow(flight, 'key', fetch, results)
+    release.set()
+    leader.join()
+    waiter.join()
+    assert results == ['advice', 'advice']
+    assert len(calls) == 1
+
+
+def test_waiters_get_the_leaders_error():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait()
+        raise ValueError("upstream failed")
+
+    results = []
+    leader = follow(flight, 'key', fetch, results)
+    wait_for_leader(flight, 'key')
+    waiter = follow(flight, 'key', fetch, results)
+    release.set()
+    leader.join()
+    waiter.join()
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_abandoned_stream_leader_lets_a_waiter_fetch():
+    flight = SingleFlight()
+
+    def stream():
+        with flight.lead('key') as call:
+            yield 'first'
+            call.result = 'streamed'
+
+    generator = stream()
+    assert next(generator) == 'first'
+    results = []
+    waiter = follow(flight, 'key', lambda: 'fetched by waiter', results)
+    time.sleep(0.05)
+    # The session goes away mid-stream
+    generator.close()
+    waiter.join(timeout=5)
+    assert results == ['fetched by waiter']
+    assert not flight.in_flight('key')
+
+
+def test_stream_closed_after_its_result_still_shares_it():
+    flight = SingleFlight()
+
+    def stream():
+        with flight.lead('key') as call:
+            call.result = 'streamed'
+            yield 'fallback tips'
+
+    generator = stream()
+    next(generator)
+    results = []
+    waiter = follow(flight, 'key', lambda: 'fetched by waiter', results)
+    time.sleep(0.05)
+    generator.close()
+    waiter.join(timeout=5)
+    assert results == ['streamed']
+
+
+def test_waiters_give_up_after_the_maximum_wait():
+    flight = SingleFlight(max_wait_seconds=0.05)
+    release = threading.Event()
+    results = []
+    leader = follow(flight, 'key', lambda: release.wait(), results)
+    wait_for_leader(flight, 'key')
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('key', lambda: 'never run')
+    release.set()
+    leader.join()
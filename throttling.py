@@ -0,0 +1,223 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # The leader went away (e.g. a closed generator) without a result or an error
+        self.abandoned = False
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when the call being waited on takes longer than allowed"""
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into a single upstream call"""
+
+    def __init__(self, max_wait_seconds=60):
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key, follow=True):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                if follow:
+                    self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    @staticmethod
+    def _fail(call, error):
+        """Record why the leader stopped; only errors are passed on to waiters"""
+        if isinstance(error, Exception):
+            call.error = error
+        elif call.result is None:
+            # GeneratorExit, KeyboardInterrupt...: not the waiters' problem
+            call.abandoned = True
+
+    def do(self, key, fn):
+        """Run fn, or wait for the identical call already running and share its result"""
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            if not call.done.wait(max(deadline - time.monotonic(), 0)):
+                raise SingleFlightTimeout(f"identical request still running after {self.max_wait_seconds}s")
+            if call.abandoned:
+                # Try again, leading the call this time unless someone else got there first
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            self._fail(call, e)
+            raise
+        finally:
+            self._finish(key, call)
+
+    @contextmanager
+    def lead(self, key):
+        """Register the caller as the in-flight call for key.
+
+        Yields the call (set call.result before leaving the block so waiters get
+        it), or None when another caller is already leading.
+        """
+        call, leader = self._join(key, follow=False)
+        if not leader:
+            yield None
+            return
+        try:
+            yield call
+            if call.result is None and call.error is None:
+                call.error = RuntimeError("in-flight request finished without a result")
+        except BaseException as e:
+            self._fail(call, e)
+            raise
+        finally:
+            self._finish(key, call)
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request would have to queue longer than allowed"""
+
+
+class RateLimiter:
+    """Token buckets capping requests and tokens per minute; callers queue for capacity"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_wait_seconds=30):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait_seconds = max_wait_seconds
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.queued = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60.0)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60.0)
+
+    def acquire(self, tokens, max_wait=None):
+        """Block until one request and `tokens` tokens are available, for at most the limiter's
+        max wait or `max_wait` if that is shorter; returns seconds waited"""
+        tokens = min(tokens, self.tokens_per_minute)
+        started = time.monotonic()
+        max_wait = self.max_wait_seconds if max_wait is None else min(max_wait, self.max_wait_seconds)
+        deadline = started + max_wait
+        counted = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        waited = now - started
+                        self.acquired += 1
+                        self.total_wait += waited
+                        self.max_wait = max(self.max_wait, waited)
+                        return waited
+                    if not counted:
+                        counted = True
+                        self.queued += 1
+                        self.waiting += 1
+                    delay = max(
+                        (1 - self._requests) * 60.0 / self.requests_per_minute,
+                        (tokens - self._tokens) * 60.0 / self.tokens_per_minute,
+                    )
+                if now + delay > deadline:
+                    with self._lock:
+                        self.rejected += 1
+                    raise RateLimitTimeout(f"rate limit queue wait would exceed {max_wait:.0f}s")
+                time.sleep(delay)
+        finally:
+            if counted:
+                with self._lock:
+                    self.waiting -= 1
+
+    def settle(self, estimated, actual):
+        """Correct the token bucket once a response reports its real usage"""
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated - actual)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'acquired': self.acquired,
+                'queued': self.queued,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / self.acquired if self.acquired else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token cost of a completion: ~4 characters per prompt token plus the reply budget"""
+    return sum(len(m['content']) for m in messages) // 4 + (max_tokens or 0)
+
+
+class _ChatCompletion:
+    def __init__(self, create):
+        self.create = create
+
+
+class ThrottledClient:
+    """Wraps the openai module so every ChatCompletion.create goes through a RateLimiter"""
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self.limiter = limiter
+        self.ChatCompletion = _ChatCompletion(self._create)
+
+    def _create(self, **kwargs):
+        estimated = min(estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens')),
+                        self.limiter.tokens_per_minute)
+        timeout = kwargs.get('request_timeout')
+        waited = self.limiter.acquire(estimated, max_wait=timeout)
+        if timeout:
+            # The request timeout covers the queue too, so the caller's deadline holds
+            kwargs = dict(kwargs, request_timeout=timeout - waited)
+        response = self._client.ChatCompletion.create(**kwargs)
+        usage = getattr(response, 'usage', None) if not kwargs.get('stream') else None
+        if usage:
+            self.limiter.settle(estimated, usage['total_tokens'])
+        return response